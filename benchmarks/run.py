@@ -0,0 +1,417 @@
+"""
+Measures throughput and latency of the sign-in for several serving profiles.
+
+For every combination of server, ingest mode and database, the application is
+started with `python -m serve` and every scenario is run at every concurrency:
+
+- index: GET /
+- index_location: GET /?location=...
+- sign_in: POST / with a valid sign-in
+- export: GET /export of --rows sign-ins, which are imported before the server
+  starts. Its results also say how many rows per second were exported
+
+Results are printed and written to a JSON file, so runs on different commits can
+be compared with --compare. Run `python benchmarks/run.py --help` for the options.
+
+Only numbers measured on the same machine are comparable. The load is generated on
+the same machine as the server, so on small machines the client takes a
+considerable share of the CPU.
+"""
+import argparse
+import csv
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCATIONS = ("Garten", "Bar", "Küche")
+
+SIGN_IN = urllib.parse.urlencode(
+    {
+        "first_name": "Bea",
+        "last_name": "Benchmark",
+        "street_and_house_number": "Beispielweg 1",
+        "plz_and_city": "20095 Hamburg",
+        "phone_number": "040 123456",
+    }
+).encode()
+
+QUERY = "?" + urllib.parse.urlencode({"location": LOCATIONS[0]})
+
+SCENARIOS = {
+    "index": ("GET", "/", None),
+    "index_location": ("GET", "/" + QUERY, None),
+    # The location is preselected through the URL, like the QR codes do
+    "sign_in": ("POST", "/" + QUERY, SIGN_IN),
+    "export": ("GET", "/export", None),
+}
+
+ADMIN_TOKEN = "benchmark"
+
+EXPECTED_STATUS = {"GET": 200, "POST": 302}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database",
+        action="append",
+        help="Database URI, can be given multiple times. Default: a new SQLite file",
+    )
+    parser.add_argument("--server", default="waitress", help="e.g. waitress,gunicorn")
+    parser.add_argument("--ingest", default="sync", help="e.g. sync,queued")
+    parser.add_argument("--scenario", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,16", help="e.g. 1,16,64")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--warm-up", type=float, default=1, help="Seconds per run")
+    parser.add_argument(
+        "--rows", type=int, default=10000, help="Sign-ins in the table for export"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes that generate the load",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Additional environment for the application",
+    )
+    parser.add_argument("--output", help="JSON file, default: benchmark-<commit>.json")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        databases = args.database or [f"sqlite:///{directory}/benchmark.sqlite"]
+        results = []
+        for database in databases:
+            migrate(database, directory)
+            for server in args.server.split(","):
+                for ingest in args.ingest.split(","):
+                    if server == "uvicorn" and ingest != "sync":
+                        continue  # Always stores directly, see asgi.py
+                    if server == "uvicorn" and not database.startswith("postgresql"):
+                        print("uvicorn needs PostgreSQL, skipping", file=sys.stderr)
+                        continue
+                    profile = {
+                        "server": server,
+                        "ingest": ingest,
+                        "database": urllib.parse.urlsplit(database).scheme,
+                    }
+                    results += run_profile(profile, database, directory, args)
+
+    report = {
+        "commit": _commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": _processor(),
+            "cpus": os.cpu_count(),
+            "memory": _memory(),
+            "python": platform.python_version(),
+        },
+        "duration": args.duration,
+        "processes": args.processes,
+        "env": args.env,
+        "results": results,
+    }
+    output = args.output or f"benchmark-{report['commit'][:10]}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+def run_profile(profile, database, directory, args):
+    clear(database)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.path.join(ROOT, "src"),
+        "CORONA_SIGN_IN_DATABASE_URI": database,
+        "CORONA_SIGN_IN_SECRET_KEY": "benchmark",
+        "CORONA_SIGN_IN_LOCATIONS": ";".join(LOCATIONS),
+        "CORONA_SIGN_IN_SERVER": profile["server"],
+        "CORONA_SIGN_IN_INGEST_MODE": profile["ingest"],
+        "CORONA_SIGN_IN_INGEST_SPILL_DIR": os.path.join(directory, "spill"),
+        "CORONA_SIGN_IN_HOST": "127.0.0.1",
+        # Every client sends the same sign-in from the same address
+        "CORONA_SIGN_IN_DEDUP_WINDOW": "0",
+        "CORONA_SIGN_IN_RATE_LIMIT_PER_IP": "0",
+        "CORONA_SIGN_IN_RATE_LIMIT_GLOBAL": "0",
+        "CORONA_SIGN_IN_PORT": str(port),
+        "CORONA_SIGN_IN_ADMIN_TOKEN": ADMIN_TOKEN,
+        **dict(setting.split("=", 1) for setting in args.env),
+    }
+    if "export" in args.scenario.split(","):
+        fill(env, args.rows, directory)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "serve"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(directory, "server.log"), "a"),
+    )
+    results = []
+    try:
+        _wait_for(port, server)
+        for scenario in args.scenario.split(","):
+            for concurrency in map(int, args.concurrency.split(",")):
+                load(port, scenario, concurrency, args.warm_up, args.processes)
+                result = load(
+                    port, scenario, concurrency, args.duration, args.processes
+                )
+                result = {**profile, "scenario": scenario, **result}
+                if scenario == "export":
+                    result["rows"] = args.rows
+                    result["rows_per_second"] = round(
+                        result["requests_per_second"] * args.rows
+                    )
+                print(_format(result))
+                results.append(result)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def load(port, scenario, concurrency, duration, processes):
+    """Runs `concurrency` clients for `duration` seconds, spread over processes"""
+    processes = max(min(processes, concurrency), 1)
+    shares = [concurrency // processes] * processes
+    for i in range(concurrency % processes):
+        shares[i] += 1
+    with multiprocessing.Pool(processes) as pool:
+        parts = pool.starmap(
+            _clients, [(port, scenario, share, duration) for share in shares]
+        )
+    latencies = sorted(latency for part, _ in parts for latency in part)
+    errors = sum(errors for _, errors in parts)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[int(p * (len(latencies) - 1))] * 1000, 2)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "latency_ms": {
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": percentile(1),
+        },
+    }
+
+
+def _clients(port, scenario, count, duration):
+    method, path, body = SCENARIOS[scenario]
+    headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+    if scenario == "export":
+        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = [0]
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != EXPECTED_STATUS[method]:
+                    errors[0] += 1
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection.close()
+            latencies.append(time.monotonic() - started)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def migrate(database, directory):
+    subprocess.run(
+        [sys.executable, "-m", "flask", "db", "upgrade"],
+        cwd=ROOT,
+        env={
+            **os.environ,
+            "PYTHONPATH": os.path.join(ROOT, "src"),
+            "FLASK_APP": "app:create_app",
+            "CORONA_SIGN_IN_DATABASE_URI": database,
+        },
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(directory, "migrate.log"), "a"),
+    )
+
+
+def fill(env, rows, directory):
+    """Imports `rows` sign-ins of the last days, encrypted like the server would"""
+    path = os.path.join(directory, "sign_ins.csv")
+    now = datetime.now().replace(microsecond=0)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "location",
+                "first_name",
+                "last_name",
+                "street_and_house_number",
+                "plz_and_city",
+                "phone_number",
+                "signed_in_at",
+            ]
+        )
+        for i in range(rows):
+            signed_in_at = now - timedelta(seconds=rows - i)
+            writer.writerow(
+                [
+                    LOCATIONS[i % len(LOCATIONS)],
+                    "Bea",
+                    f"Benchmark {i}",
+                    "Beispielweg 1",
+                    "20095 Hamburg",
+                    "040 123456",
+                    signed_in_at.isoformat(" "),
+                ]
+            )
+    subprocess.run(
+        [sys.executable, "-m", "flask", "import", path],
+        cwd=ROOT,
+        env={**env, "FLASK_APP": "app:create_app"},
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(directory, "import.log"), "a"),
+    )
+
+
+def clear(database):
+    """Every profile starts with an empty table"""
+    engine = sqlalchemy.create_engine(database)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DELETE FROM sign_ins"))
+    engine.dispose()
+
+
+def compare(before, after):
+    print(f"\nCompared to {before['commit'][:10]} ({before['date']}):")
+
+    def key(result):
+        return tuple(
+            result[name]
+            for name in ("server", "ingest", "database", "scenario", "concurrency")
+        )
+
+    earlier = {key(result): result for result in before["results"]}
+    for result in after["results"]:
+        old = earlier.get(key(result))
+        if old is None or not old["requests_per_second"]:
+            continue
+        change = result["requests_per_second"] / old["requests_per_second"] - 1
+        p99_old, p99_new = old["latency_ms"]["p99"], result["latency_ms"]["p99"]
+        print(
+            f"{' '.join(map(str, key(result))):<45} "
+            f"{change:+7.1%} req/s, p99 {p99_old}ms -> {p99_new}ms"
+        )
+
+
+def _format(result):
+    latency = result["latency_ms"]
+    return (
+        f"{result['server']:<8} {result['ingest']:<6} {result['database']:<10} "
+        f"{result['scenario']:<14} x{result['concurrency']:<4} "
+        f"{result['requests_per_second']:>8} req/s  "
+        f"p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  "
+        f"errors {result['errors']}"
+        + (f"  {result['rows_per_second']} rows/s" if "rows" in result else "")
+    )
+
+
+def _commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout.decode()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit.strip()
+
+
+def _processor():
+    """The CPU model, platform.processor() is empty on most Linux systems"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or "unknown"
+
+
+def _memory():
+    """Total memory in GiB, or None if unknown"""
+    try:
+        pages = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+    return round(pages / 2 ** 30, 1)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise Exception("The application exited, see server.log")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise Exception(f"The application didn't start within {timeout} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Index sign_ins by time and location
+
+Revision ID: 346dc2ba15e4
+Revises: 955e39ea4c83
+Create Date: 2026-10-18 10:02:31.187220
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "346dc2ba15e4"
+down_revision = "955e39ea4c83"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # On PostgreSQL, build the indexes without locking the table against inserts
+    concurrently = op.get_bind().dialect.name == "postgresql"
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sign_ins_signed_in_at",
+            "sign_ins",
+            ["signed_in_at"],
+            postgresql_concurrently=concurrently,
+        )
+        op.create_index(
+            "ix_sign_ins_location_signed_in_at",
+            "sign_ins",
+            ["location", "signed_in_at"],
+            postgresql_concurrently=concurrently,
+        )
+
+
+def downgrade():
+    op.drop_index("ix_sign_ins_location_signed_in_at", table_name="sign_ins")
+    op.drop_index("ix_sign_ins_signed_in_at", table_name="sign_ins")
@@ -0,0 +1,68 @@
+"""Store when guests leave, to query overlapping stays
+
+Existing sign-ins are checked out automatically, AUTO_CHECKOUT minutes after they
+signed in. On PostgreSQL, the stays are indexed as ranges with GiST.
+
+Revision ID: 5f0c2a9d8e17
+Revises: b94726f70f55
+Create Date: 2026-10-18 16:45:12.204117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = "5f0c2a9d8e17"
+down_revision = "b94726f70f55"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    minutes = int(current_app.config["AUTO_CHECKOUT"])
+    op.add_column("sign_ins", sa.Column("signed_out_at", sa.DateTime(), nullable=True))
+    if bind.dialect.name == "postgresql":
+        op.execute(
+            "UPDATE sign_ins "
+            f"SET signed_out_at = signed_in_at + interval '{minutes} minutes'"
+        )
+    else:
+        op.execute(
+            "UPDATE sign_ins "
+            f"SET signed_out_at = datetime(signed_in_at, '+{minutes} minutes')"
+        )
+
+    if bind.dialect.name != "postgresql":
+        return
+    # Indexes on partitioned tables can't be created concurrently
+    concurrently = not _is_partitioned(bind)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sign_ins_stay",
+            "sign_ins",
+            [text("tsrange(signed_in_at, signed_out_at)")],
+            postgresql_using="gist",
+            postgresql_concurrently=concurrently,
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_sign_ins_stay", table_name="sign_ins")
+    with op.batch_alter_table("sign_ins") as batch_op:
+        batch_op.drop_column("signed_out_at")
+
+
+def _is_partitioned(bind):
+    return bool(
+        bind.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass('sign_ins')"
+            )
+        ).scalar()
+    )
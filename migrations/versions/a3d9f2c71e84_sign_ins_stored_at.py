@@ -0,0 +1,68 @@
+"""Store when sign-ins were inserted, so backups find late ones
+
+Existing sign-ins have no stored_at on PostgreSQL, see backup.py.
+
+Revision ID: a3d9f2c71e84
+Revises: e7a41c9b2d53
+Create Date: 2026-10-19 10:12:40.318275
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = "a3d9f2c71e84"
+down_revision = "e7a41c9b2d53"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # A volatile default would rewrite the table, so only new rows get it
+        op.add_column("sign_ins", sa.Column("stored_at", sa.DateTime(), nullable=True))
+        op.execute(
+            "ALTER TABLE sign_ins ALTER COLUMN stored_at SET DEFAULT clock_timestamp()"
+        )
+    else:
+        # SQLite can't add a column with such a default, so the table is copied
+        with op.batch_alter_table("sign_ins", recreate="always") as batch_op:
+            batch_op.add_column(
+                sa.Column(
+                    "stored_at",
+                    sa.DateTime(),
+                    server_default=text(
+                        "(strftime('%Y-%m-%d %H:%M:%f', 'now') || '000')"
+                    ),
+                    nullable=True,
+                )
+            )
+    # Indexes on partitioned tables can't be created concurrently
+    concurrently = bind.dialect.name == "postgresql" and not _is_partitioned(bind)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sign_ins_stored_at",
+            "sign_ins",
+            ["stored_at"],
+            postgresql_concurrently=concurrently,
+        )
+
+
+def downgrade():
+    op.drop_index("ix_sign_ins_stored_at", table_name="sign_ins")
+    with op.batch_alter_table("sign_ins") as batch_op:
+        batch_op.drop_column("stored_at")
+
+
+def _is_partitioned(bind):
+    return bool(
+        bind.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass('sign_ins')"
+            )
+        ).scalar()
+    )
@@ -0,0 +1,85 @@
+"""Optionally partition sign_ins by day
+
+This only does something on PostgreSQL, and only if CORONA_SIGN_IN_STORAGE is set
+to "partitioned" when the migration runs. To switch later, downgrade to 346dc2ba15e4
+and upgrade again with the setting changed.
+
+Revision ID: b94726f70f55
+Revises: 346dc2ba15e4
+Create Date: 2026-10-18 11:24:05.512934
+
+"""
+from datetime import date, timedelta
+
+from alembic import op
+from flask import current_app
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = "b94726f70f55"
+down_revision = "346dc2ba15e4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    if current_app.config["SIGN_INS_STORAGE"] != "partitioned":
+        return
+
+    op.execute("ALTER TABLE sign_ins RENAME TO sign_ins_unpartitioned")
+    op.execute("DROP INDEX ix_sign_ins_signed_in_at")
+    op.execute("DROP INDEX ix_sign_ins_location_signed_in_at")
+    op.execute(
+        "CREATE TABLE sign_ins (LIKE sign_ins_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (signed_in_at)"
+    )
+    op.execute("CREATE TABLE sign_ins_default PARTITION OF sign_ins DEFAULT")
+
+    first_day = bind.execute(
+        text("SELECT min(signed_in_at)::date FROM sign_ins_unpartitioned")
+    ).scalar()
+    day = first_day or date.today()
+    # The same days as partitions.ensure()
+    days_ahead = current_app.config["PARTITION_DAYS_AHEAD"]
+    while day <= date.today() + timedelta(days=days_ahead):
+        op.execute(
+            f"CREATE TABLE sign_ins_p{day:%Y%m%d} PARTITION OF sign_ins "
+            f"FOR VALUES FROM ('{day.isoformat()}') "
+            f"TO ('{(day + timedelta(days=1)).isoformat()}')"
+        )
+        day += timedelta(days=1)
+
+    op.execute("INSERT INTO sign_ins SELECT * FROM sign_ins_unpartitioned")
+    op.execute("DROP TABLE sign_ins_unpartitioned")
+    op.create_index("ix_sign_ins_signed_in_at", "sign_ins", ["signed_in_at"])
+    op.create_index(
+        "ix_sign_ins_location_signed_in_at", "sign_ins", ["location", "signed_in_at"]
+    )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    partitioned = bind.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass('sign_ins')"
+        )
+    ).scalar()
+    if not partitioned:
+        return
+
+    op.execute("ALTER TABLE sign_ins RENAME TO sign_ins_partitioned")
+    op.execute("CREATE TABLE sign_ins (LIKE sign_ins_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO sign_ins SELECT * FROM sign_ins_partitioned")
+    # Also drops all the partitions and their indexes
+    op.execute("DROP TABLE sign_ins_partitioned")
+    op.create_index("ix_sign_ins_signed_in_at", "sign_ins", ["signed_in_at"])
+    op.create_index(
+        "ix_sign_ins_location_signed_in_at", "sign_ins", ["location", "signed_in_at"]
+    )
@@ -0,0 +1,57 @@
+"""Store encrypted contact data and the keys it was encrypted with
+
+The names and the phone number become text columns, encrypted values are longer
+than 255 characters. Existing sign-ins stay as they are, see encryption.py.
+
+Revision ID: c3e81f4a6b20
+Revises: 5f0c2a9d8e17
+Create Date: 2026-10-18 21:10:37.518203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c3e81f4a6b20"
+down_revision = "5f0c2a9d8e17"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("first_name", "last_name", "phone_number")
+
+
+def upgrade():
+    op.create_table(
+        "encryption_keys",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("master_key", sa.String(length=16), nullable=True),
+        sa.Column("data_key", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.add_column("sign_ins", sa.Column("key_id", sa.Integer(), nullable=True))
+    # SQLite doesn't enforce the length anyway
+    if op.get_bind().dialect.name == "postgresql":
+        for column in COLUMNS:
+            # Doesn't rewrite the table on PostgreSQL
+            op.alter_column(
+                "sign_ins",
+                column,
+                type_=sa.Text(),
+                existing_type=sa.String(length=255),
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        for column in COLUMNS:
+            op.alter_column(
+                "sign_ins",
+                column,
+                type_=sa.String(length=255),
+                existing_type=sa.Text(),
+            )
+    with op.batch_alter_table("sign_ins") as batch_op:
+        batch_op.drop_column("key_id")
+    op.drop_table("encryption_keys")
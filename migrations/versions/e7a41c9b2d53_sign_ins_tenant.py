@@ -0,0 +1,51 @@
+"""Say whose sign-in it is, for serving several venues
+
+Existing sign-ins have no tenant, see tenants.py.
+
+Revision ID: e7a41c9b2d53
+Revises: c3e81f4a6b20
+Create Date: 2026-10-18 23:04:51.630482
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = "e7a41c9b2d53"
+down_revision = "c3e81f4a6b20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Doesn't rewrite the table, the column is NULL
+    op.add_column("sign_ins", sa.Column("tenant", sa.String(length=63), nullable=True))
+    # Indexes on partitioned tables can't be created concurrently
+    concurrently = bind.dialect.name == "postgresql" and not _is_partitioned(bind)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sign_ins_tenant_signed_in_at",
+            "sign_ins",
+            ["tenant", "signed_in_at"],
+            postgresql_concurrently=concurrently,
+        )
+
+
+def downgrade():
+    op.drop_index("ix_sign_ins_tenant_signed_in_at", table_name="sign_ins")
+    with op.batch_alter_table("sign_ins") as batch_op:
+        batch_op.drop_column("tenant")
+
+
+def _is_partitioned(bind):
+    return bool(
+        bind.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass('sign_ins')"
+            )
+        ).scalar()
+    )
@@ -3,10 +3,30 @@ from datetime import datetime
 
 from flask import Flask, redirect, render_template, request
 
+import backup
+import bulk_import
+import checkout
+import export
+import health
+import metrics
+import qr
+import retention
 import sign_ins
+import staff
+import tenants
+import tracing
+from assets import assets
 from config import ProductionConfig
 from db import db
+from dedup import dedup
+from encryption import encryption
+from ingest import ingest
+from locations import get_locations
 from migrate import migrate
+from occupancy import occupancy
+from pages import CachedPage
+from partitions import partitions
+from ratelimit import ratelimit
 
 
 def create_app(config=None):
@@ -14,12 +34,30 @@ def create_app(config=None):
 
     app.config.from_object(config if config else ProductionConfig())
 
+    tenants.init_app(app)
+    assets.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
+    partitions.init_app(app)
+    ingest.init_app(app)
+    export.init_app(app)
+    bulk_import.init_app(app)
+    backup.init_app(app)
+    health.init_app(app)
+    metrics.init_app(app)
+    ratelimit.init_app(app)
+    retention.init_app(app)
+    tracing.init_app(app)
+    checkout.init_app(app)
+    occupancy.init_app(app)
+    dedup.init_app(app)
+    encryption.init_app(app)
+    staff.init_app(app)
+    qr.init_app(app)
 
     @app.route("/", methods=("GET", "POST"))
     def index():
-        locations = app.config["LOCATIONS"]
+        locations = get_locations(app)
         if locations:
             form = sign_ins.FormWithLocation(locations)
             preselected_location = request.args.get("location")
@@ -30,24 +68,55 @@ def create_app(config=None):
                     return f'Location "{preselected_location}" does not exist', 400
         else:
             form = sign_ins.Form()
-        if form.validate_on_submit():
-            db.session.execute(
-                sign_ins.table.insert().values(**form.data, signed_in_at=datetime.now())
-            )
-            db.session.commit()
-            return redirect("/thank-you")
-        return render_template("index.html.jinja2", form=form)
+        with metrics.phase("validate"):
+            valid = form.validate_on_submit()
+        if valid:
+            data = form.data
+            signed_in_at = datetime.now()
+            row = {
+                **data,
+                "signed_in_at": signed_in_at,
+                "signed_out_at": checkout.planned_checkout(signed_in_at),
+                "tenant": tenants.current_id(),
+            }
+            original = dedup.find_original(row)
+            if original is not None:
+                metrics.duplicates_total.inc()
+                return redirect(
+                    checkout.thank_you_url(original, root=request.script_root)
+                )
+            if not occupancy.admit(row.get("location"), row["signed_out_at"]):
+                return (
+                    render_template(
+                        "index.html.jinja2", form=form, full=row.get("location") or True
+                    ),
+                    409,
+                )
+            try:
+                ingest.submit(encryption.encrypt(row))
+            except BaseException:
+                occupancy.leave(row.get("location"), row["signed_out_at"])
+                raise
+            staff.notify()
+            metrics.sign_ins_total.inc(data.get("location", ""))
+            return redirect(checkout.thank_you_url(row, root=request.script_root))
+        with metrics.phase("render"):
+            return render_template("index.html.jinja2", form=form)
+
+    data_protection_page = CachedPage("data-protection.html.jinja2")
+    thank_you_page = CachedPage("success-page.html.jinja2")
 
     @app.route("/data-protection")
     def data_protection():
-        return render_template("data-protection.html.jinja2")
+        return data_protection_page.response()
 
     @app.route("/thank-you")
     def thank_you():
-        return render_template("success-page.html.jinja2")
+        return thank_you_page.response()
 
     @app.errorhandler(500)
     def internal_server_error(e):
+        metrics.errors_total.inc()
         return render_template("error-page.html.jinja2"), 500
 
     app.register_error_handler(500, internal_server_error)
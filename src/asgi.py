@@ -0,0 +1,376 @@
+"""
+An ASGI entry point for busy doors, with `CORONA_SIGN_IN_SERVER=uvicorn`.
+
+With waitress or gunicorn, every sign-in occupies one of a few threads until its
+insert is committed, so a slow database makes every guest in line wait. Here a
+valid sign-in is validated with the same forms as in app.py and inserted through
+an asyncpg connection pool, without occupying a thread. One process can then keep
+thousands of guests' connections open.
+
+/staff/stream is served here as well, so door staff's devices don't occupy threads
+(see staff.py). With TENANTS_FILE, both are found below the tenants' hosts and path
+prefixes (see tenants.py).
+
+The rate limit, duplicate and capacity checks lock files, and encrypting a
+sign-in or creating partitions can query the database, so they run in the event
+loop's default thread pool. They take a few microseconds to milliseconds, and
+don't hold up the other guests meanwhile.
+
+Everything else (the pages, invalid sign-ins, /export, ...) is passed on to the
+Flask application, which runs in a thread pool of CORONA_SIGN_IN_THREADS threads.
+Sign-ins are always inserted directly, CORONA_SIGN_IN_INGEST_MODE does not apply.
+
+Needs PostgreSQL and the asyncpg, a2wsgi and uvicorn packages.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine.url import make_url
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import url_decode
+
+import metrics
+import sign_ins
+import staff
+import tenants
+from app import create_app
+from auth import CHALLENGE, is_valid_token
+from checkout import planned_checkout, thank_you_url
+from dedup import dedup
+from encryption import encryption
+from locations import get_locations
+from occupancy import occupancy
+from partitions import partitions
+from ratelimit import ENVIRON_KEY as RATE_LIMITED
+from ratelimit import client_address, ratelimit, too_many_requests
+
+# Bytes. The form is a few hundred, anything much bigger is not a sign-in
+MAX_BODY_SIZE = 64 * 1024
+
+COLUMNS = sign_ins.INSERT_COLUMNS
+INSERT = "INSERT INTO {} ({}) VALUES ({})".format(
+    sign_ins.table.name,
+    ", ".join(COLUMNS),
+    ", ".join(f"${i}" for i in range(1, len(COLUMNS) + 1)),
+)
+
+
+class SignInApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config["THREADS"])
+        self.resolver = (
+            tenants.Resolver(flask_app.extensions["tenants"])
+            if flask_app.extensions["tenants"]
+            else None
+        )
+        self._pool = None
+        # Created in the event loop, see _get_pool
+        self._pool_lock = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        tenant, root, path = self.resolve(scope)
+        if (
+            scope["type"] == "http"
+            and scope["method"] == "GET"
+            and path == "/staff/stream"
+        ):
+            await self.stream(scope, receive, send, tenant)
+            return
+        if scope["type"] == "http" and scope["method"] == "POST" and path == "/":
+            started = time.perf_counter()
+            wait = await _in_thread(
+                self.check_rate_limit, self.client_address(scope), tenant
+            )
+            if wait:
+                status, headers, message = too_many_requests(wait)
+                await _respond(
+                    send,
+                    status,
+                    [(b"retry-after", headers["Retry-After"].encode())],
+                    message.encode(),
+                )
+                return
+            body = await _read_body(receive)
+            if body is None:
+                await _respond(send, 413)
+                return
+            row = self.validate(scope, body, tenant)
+            encrypted = row and await _in_thread(self.admit, row, tenant)
+            if encrypted:
+                try:
+                    await self.store(encrypted)
+                except BaseException:
+                    # Even if the request was cancelled
+                    await asyncio.shield(_in_thread(self.leave, row, tenant))
+                    raise
+                with self.acting_for(tenant):
+                    staff.notify(self.flask_app)
+                location = thank_you_url(row, self.flask_app.config, root)
+                await _respond(send, 302, [(b"location", location.encode())])
+                metrics.request_seconds.observe(
+                    time.perf_counter() - started, "index", "POST"
+                )
+                metrics.requests_total.inc("index", "POST", 302)
+                return
+            # Let Flask render the errors or that the location is full, or look
+            # up the original sign-in
+            receive = _replay(body, receive)
+            # The sign-in took its rate limit tokens already
+            scope = {**scope, RATE_LIMITED: True}
+        await self.wsgi(scope, receive, send)
+
+    def resolve(self, scope):
+        """
+        (tenant, path prefix, path below it), see tenants.py. The path is None for
+        requests without a tenant, Flask answers them
+        """
+        if self.resolver is None or scope["type"] != "http":
+            return None, "", scope.get("path")
+        host = dict(scope["headers"]).get(b"host", b"").decode("latin-1")
+        tenant, prefix = self.resolver.resolve(host, scope["path"])
+        if tenant is None:
+            return None, "", None
+        return tenant, prefix, scope["path"][len(prefix) :]
+
+    @contextmanager
+    def acting_for(self, tenant):
+        """Makes the occupancy, the staff feed etc. use the tenant's"""
+        if tenant is None:
+            yield
+            return
+        # Werkzeug's context locals are context variables, so this is local to the
+        # task even across awaits
+        with self.flask_app.app_context(), tenants.use(tenant):
+            yield
+
+    def validate(self, scope, body, tenant=None):
+        """The row to insert, or None if the sign-in is not valid"""
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+        if content_type != b"application/x-www-form-urlencoded":
+            return None
+        formdata = MultiDict(url_decode(body))
+        preselected_location = url_decode(scope["query_string"]).get("location")
+
+        started = time.perf_counter()
+        with self.flask_app.app_context() as context:
+            context.g.tenant = tenant
+            locations = get_locations(self.flask_app)
+            if locations:
+                form = sign_ins.FormWithLocation(locations, formdata=formdata)
+                if preselected_location:
+                    try:
+                        form.set_location(preselected_location)
+                    except ValueError:
+                        return None
+            else:
+                form = sign_ins.Form(formdata=formdata)
+            valid = form.validate()
+            # The labels of locations are only looked up for valid forms
+            data = form.data if valid else None
+        metrics.phase_seconds.observe(
+            time.perf_counter() - started, "index", "validate"
+        )
+        if not valid:
+            return None
+        signed_in_at = datetime.now()
+        return {
+            **data,
+            "signed_in_at": signed_in_at,
+            "signed_out_at": planned_checkout(signed_in_at, self.flask_app.config),
+            "tenant": tenant.id if tenant is not None else None,
+        }
+
+    def admit(self, row, tenant=None):
+        """
+        The row to insert, encrypted, or None if it might be a duplicate or the
+        location is full. Blocks, so it runs in a thread
+        """
+        with self.acting_for(tenant):
+            if dedup.might_be_duplicate(row, self.flask_app):
+                return None
+            if not occupancy.admit(
+                row.get("location"), row["signed_out_at"], self.flask_app
+            ):
+                return None
+            try:
+                # Only talks to the database every few days, to create partitions
+                # ahead
+                partitions.ensure(self.flask_app)
+                return encryption.encrypt(row, self.flask_app)
+            except BaseException:
+                self.leave(row)
+                raise
+
+    def check_rate_limit(self, address, tenant=None):
+        """0 or the seconds the client has to wait, see ratelimit.py"""
+        with self.acting_for(tenant):
+            return ratelimit.check(address, self.flask_app)
+
+    def leave(self, row, tenant=None):
+        """Takes back the place admit took, if the row couldn't be stored"""
+        with self.acting_for(tenant):
+            occupancy.leave(row.get("location"), row["signed_out_at"], self.flask_app)
+
+    async def store(self, row):
+        """Inserts a row that admit returned"""
+        pool = await self._get_pool()
+        started = time.perf_counter()
+        await pool.execute(INSERT, *(row.get(column) for column in COLUMNS))
+        metrics.phase_seconds.observe(time.perf_counter() - started, "index", "execute")
+        metrics.sign_ins_total.inc(row.get("location", ""))
+
+    def client_address(self, scope):
+        forwarded_for = dict(scope["headers"]).get(b"x-forwarded-for", b"")
+        return client_address(
+            scope["client"][0] if scope.get("client") else None,
+            forwarded_for.decode("latin-1"),
+            self.flask_app.config["PROXIES"],
+        )
+
+    async def stream(self, scope, receive, send, tenant=None):
+        """/staff/stream, see staff.py"""
+        config = tenant.config if tenant is not None else self.flask_app.config
+        expected = config["STAFF_TOKEN"]
+        if not expected:
+            await _respond(send, 404)
+            return
+        authorization = dict(scope["headers"]).get(b"authorization", b"")
+        if not is_valid_token(authorization.decode("latin-1"), expected):
+            await _respond(send, 401, [(b"www-authenticate", CHALLENGE.encode())])
+            return
+
+        with self.acting_for(tenant):
+            feed = staff.get_feed(self.flask_app)
+        headers = [
+            (name.lower().encode(), value.encode())
+            for name, value in staff.HEADERS.items()
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        disconnected = asyncio.ensure_future(_disconnected(receive))
+        version = None
+        try:
+            while True:
+                waiting = asyncio.ensure_future(
+                    feed.wait_async(version, staff.KEEP_ALIVE)
+                )
+                await asyncio.wait(
+                    [waiting, disconnected], return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    waiting.cancel()
+                    return
+                new_version, data = waiting.result()
+                if new_version == version:
+                    body = ": keep-alive\n\n"
+                else:
+                    version = new_version
+                    body = staff.event(data)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": body.encode(),
+                        "more_body": True,
+                    }
+                )
+        finally:
+            disconnected.cancel()
+
+    async def _get_pool(self):
+        if self._pool is None:
+            # Before 3.10, asyncio.Lock() needs an event loop
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await create_pool(self.flask_app.config)
+        return self._pool
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self._get_pool()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._pool is not None:
+                    await self._pool.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_pool(config):
+    """An asyncpg pool, configured like the SQLAlchemy pool (see config.py)"""
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if not url.drivername.startswith("postgresql"):
+        raise ValueError("The ASGI application only works with PostgreSQL")
+    url.drivername = "postgresql"
+    server_settings = {}
+    if config["DB_STATEMENT_TIMEOUT"]:
+        milliseconds = int(config["DB_STATEMENT_TIMEOUT"] * 1000)
+        server_settings["statement_timeout"] = str(milliseconds)
+    return asyncpg.create_pool(
+        str(url),
+        min_size=1,
+        max_size=config["DB_POOL_SIZE"] + config["DB_POOL_MAX_OVERFLOW"],
+        max_inactive_connection_lifetime=max(config["DB_POOL_RECYCLE"], 0),
+        server_settings=server_settings,
+    )
+
+
+def create_asgi_app(config=None):
+    flask_app = create_app(config)
+    return SignInApp(flask_app)
+
+
+def _in_thread(function, *args):
+    """Runs a blocking function in the event loop's default thread pool"""
+    return asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def _read_body(receive):
+    """The request body, or None if it is larger than MAX_BODY_SIZE"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_SIZE:
+            return None
+        if not message.get("more_body", False):
+            return body
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _replay(body, receive):
+    """A receive callable that returns the body that was already read first"""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def replay():
+        if messages:
+            return messages.pop()
+        return await receive()
+
+    return replay
+
+
+async def _respond(send, status, headers=(), body=b""):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-length", str(len(body)).encode()), *headers],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,247 @@
+"""
+Fingerprinted and precompressed static files.
+
+url_for("static", filename="styles/main.css") returns a name that contains a hash
+of the file's content, e.g. styles/main.1a2b3c4d.css. Those URLs change whenever
+the file changes, so browsers may cache them forever. Relative url() references in
+stylesheets are rewritten to the fingerprinted names, and the stylesheet's hash is
+taken after that, so it changes with the images it uses, too.
+
+`flask assets build` writes .gz and .br (if the brotli package is installed)
+versions of text files and .webp versions of images (if Pillow is installed) next
+to the originals. The static view serves them to browsers that accept them.
+
+`flask assets fonts` generates the web fonts, see fonts.py.
+"""
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+import re
+
+import click
+from flask import current_app, request, send_file
+from flask.cli import with_appcontext
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import safe_join
+
+from fonts import build_fonts
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+COMPRESSIBLE = (".css", ".js", ".svg", ".ico", ".woff", ".ttf")
+CONVERTIBLE_TO_WEBP = (".jpg", ".jpeg", ".png")
+VARIANTS = {".gz": "gzip", ".br": "br", ".webp": "image/webp"}
+
+# url(...) in stylesheets, with or without quotes
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")\s]+)\1\s*\)""")
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+class Assets:
+    def init_app(self, app):
+        app.extensions["assets"] = _scan(app.static_folder)
+        app.url_defaults(_fingerprint_static_urls)
+        app.view_functions["static"] = send_static
+        app.add_template_global(has_static)
+        app.cli.add_command(assets_command)
+
+
+assets = Assets()
+
+
+class _Manifest:
+    def __init__(self):
+        self.fingerprinted = {}
+        self.originals = {}
+        self.variants = {}
+        # The content of stylesheets with rewritten url()s, by name
+        self.contents = {}
+
+
+def _scan(folder):
+    manifest = _Manifest()
+    names = sorted(_static_files(folder), key=lambda name: name.endswith(".css"))
+    # Stylesheets last, they refer to the fingerprinted names of the others
+    for name in names:
+        with open(os.path.join(folder, name), "rb") as f:
+            content = f.read()
+        if name.endswith(".css"):
+            content = _rewrite_css(name, content, manifest.fingerprinted)
+            manifest.contents[name] = content
+        digest = hashlib.sha256(content).hexdigest()[:10]
+        stem, extension = os.path.splitext(name)
+        fingerprinted = f"{stem}.{digest}{extension}"
+        manifest.fingerprinted[name] = fingerprinted
+        manifest.originals[fingerprinted] = name
+        manifest.variants[name] = {
+            variant: name + suffix
+            for suffix, variant in VARIANTS.items()
+            if os.path.isfile(os.path.join(folder, name + suffix))
+        }
+    return manifest
+
+
+def _rewrite_css(name, content, fingerprinted):
+    """Replaces relative url()s in the stylesheet with the fingerprinted names"""
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        quote, url = match.groups()
+        path, suffix = re.match(r"([^?#]*)(.*)", url).groups()
+        if not path or ":" in path or path.startswith("/"):
+            return match.group(0)  # Absolute, data: or only a fragment
+        target = fingerprinted.get(posixpath.normpath(posixpath.join(directory, path)))
+        if target is None:
+            return match.group(0)
+        url = posixpath.relpath(target, directory or ".") + suffix
+        return f"url({quote}{url}{quote})"
+
+    return CSS_URL.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+
+def _static_files(folder):
+    """Relative paths of the files in folder, without generated variants"""
+    for directory, _, files in os.walk(folder):
+        for file in files:
+            if os.path.splitext(file)[1] in VARIANTS:
+                continue
+            path = os.path.relpath(os.path.join(directory, file), folder)
+            yield path.replace(os.sep, "/")
+
+
+def _manifest():
+    if current_app.debug:
+        # Pick up changes to the files during development
+        current_app.extensions["assets"] = _scan(current_app.static_folder)
+    return current_app.extensions["assets"]
+
+
+def _fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        manifest = _manifest()
+        values["filename"] = manifest.fingerprinted.get(
+            values["filename"], values["filename"]
+        )
+
+
+def has_static(filename):
+    return filename in _manifest().fingerprinted
+
+
+def send_static(filename):
+    manifest = _manifest()
+    original = manifest.originals.get(filename)
+    name = original or filename
+    variants = manifest.variants.get(name, {})
+
+    path = name
+    encoding = None
+    mimetype = None
+    if "image/webp" in variants and _accepts_webp():
+        path = variants["image/webp"]
+        mimetype = "image/webp"
+    elif "br" in variants and request.accept_encodings["br"]:
+        path, encoding = variants["br"], "br"
+    elif "gzip" in variants and request.accept_encodings["gzip"]:
+        path, encoding = variants["gzip"], "gzip"
+
+    full_path = safe_join(current_app.static_folder, path)
+    if full_path is None or not os.path.isfile(full_path):
+        raise NotFound()
+    if path in manifest.contents:
+        # A stylesheet without a compressed variant, with its url()s rewritten
+        full_path = io.BytesIO(manifest.contents[path])
+    response = send_file(
+        full_path,
+        # The type of the original file, not of the .gz
+        mimetype=mimetype or _guess_mimetype(name),
+        max_age=ONE_YEAR if original else None,
+    )
+    if original:
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if variants:
+        response.vary.add("Accept-Encoding")
+        response.vary.add("Accept")
+    return response
+
+
+def _accepts_webp():
+    # accept_mimetypes["image/webp"] also matches image/* and */*, which browsers
+    # without WebP send for images too
+    return any(
+        mimetype == "image/webp" and quality > 0
+        for mimetype, quality in request.accept_mimetypes
+    )
+
+
+def _guess_mimetype(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def build(folder, echo=lambda message: None):
+    """Write the compressed and converted variants of the files in folder"""
+    manifest = _scan(folder)
+    for name in _static_files(folder):
+        path = os.path.join(folder, name)
+        extension = os.path.splitext(name)[1].lower()
+        if name in manifest.contents:
+            content = manifest.contents[name]
+        else:
+            with open(path, "rb") as f:
+                content = f.read()
+
+        variants = {}
+        if extension in COMPRESSIBLE:
+            variants[".gz"] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants[".br"] = brotli.compress(content, quality=11)
+        if extension in CONVERTIBLE_TO_WEBP and Image is not None:
+            with Image.open(io.BytesIO(content)) as image:
+                webp = io.BytesIO()
+                image.save(webp, format="WEBP", quality=80, method=6)
+                variants[".webp"] = webp.getvalue()
+
+        for suffix, data in variants.items():
+            if len(data) >= len(content):
+                continue
+            with open(path + suffix, "wb") as f:
+                f.write(data)
+            echo(f"{name}{suffix}: {len(content)} -> {len(data)} bytes")
+
+
+@click.group("assets")
+def assets_command():
+    """Manage static files"""
+
+
+@assets_command.command("build")
+@with_appcontext
+def build_command():
+    """Write compressed and converted versions of the static files"""
+    if brotli is None:
+        click.echo("brotli is not installed, skipping .br files")
+    if Image is None:
+        click.echo("Pillow is not installed, skipping .webp files")
+    build(current_app.static_folder, echo=click.echo)
+
+
+@assets_command.command("fonts")
+@with_appcontext
+def fonts_command():
+    """Download and subset the web fonts. Run this before `build`"""
+    build_fonts(current_app.static_folder, echo=click.echo)
@@ -0,0 +1,51 @@
+import hmac
+from functools import wraps
+
+from flask import abort, request
+from werkzeug.http import parse_authorization_header
+
+import tenants
+
+CHALLENGE = 'Basic realm="corona-sign-in"'
+
+
+def token_required(config_key):
+    """
+    Protects a view with the token configured in app.config[config_key], or in the
+    settings of the current tenant (see tenants.py).
+
+    The token can be sent as a bearer token or as the password of HTTP basic auth, so
+    the endpoints can be used from curl as well as from a browser. If no token is
+    configured, the view does not exist.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            expected = tenants.config().get(config_key)
+            if not expected:
+                abort(404)
+            if not is_valid_token(request.headers.get("Authorization"), expected):
+                return "Unauthorized", 401, {"WWW-Authenticate": CHALLENGE}
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_valid_token(authorization, expected):
+    """Whether the value of an Authorization header contains the expected token"""
+    return hmac.compare_digest(
+        _supplied_token(authorization).encode(), expected.encode()
+    )
+
+
+def _supplied_token(authorization):
+    authorization = authorization or ""
+    if authorization.lower().startswith("bearer "):
+        return authorization[len("bearer ") :].strip()
+    basic = parse_authorization_header(authorization)
+    if basic and basic.password:
+        return basic.password
+    return ""
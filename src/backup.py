@@ -0,0 +1,555 @@
+"""
+`flask backup` writes the sign-ins to compressed, encrypted archives, one or more
+per day, and restores them.
+
+Every run only reads the sign-ins since the last one: the manifest in BACKUP_DIR
+remembers up to which signed_in_at (the high-water mark) the sign-ins were backed
+up, and the next run continues there, using the signed_in_at index. Sign-ins of the
+last AUTO_CHECKOUT minutes are left for the next run, since guests can still check
+out and change them.
+
+Sign-ins can also be stored later for earlier times: by `flask import`, `flask
+backup restore`, or from the spill files of queued ingest after a crash (see
+ingest.py). The database sets sign_ins.stored_at on every insert, and the manifest
+also remembers the latest stored_at a run saw. The next run looks up the sign-ins
+stored after it (in the stored_at index) that are older than the high-water mark,
+and backs up their days again as a whole. The new archive replaces the day's older
+ones. This only reads the sign-ins stored since the last run. A sign-in that is
+committed after a run started, but got an earlier stored_at than one the run saw,
+is missed.
+
+An archive is a CSV file with the columns of `flask export`, compressed with gzip
+and encrypted with AES-GCM in segments of SEGMENT_SIZE bytes, so archives of any
+size are written and read as streams. Every archive has its own data key, encrypted
+with the current master key of ENCRYPTION_KEY_FILE (see encryption.py) in the
+archive's header, so restoring only needs the key file. Each segment says whether
+it is the last one, a truncated or altered archive doesn't decrypt.
+
+Archives are written to a temporary file, read back and checked, and only then
+added to the manifest with their SHA-256 checksum. `flask backup verify` checks all
+of them again. Archives of days older than RETENTION_DAYS are deleted.
+
+With TENANTS_FILE, every tenant's sign-ins are backed up to a directory of its own
+in BACKUP_DIR, named after its id, and kept for its RETENTION_DAYS (see tenants.py).
+Sign-ins without a tenant, e.g. from before TENANTS_FILE, are backed up to
+BACKUP_DIR itself.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+
+import encryption
+import sign_ins
+import tenants
+from bulk_import import REQUIRED_COLUMNS, import_records, read_csv
+from db import db
+from export import COLUMNS, iter_rows
+from retention import cutoff
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+MAGIC = b"CSIBAK01"
+# Bytes of plaintext per encrypted segment
+SEGMENT_SIZE = 64 * 1024
+MANIFEST = "manifest.json"
+NAME = re.compile(r"corona-sign-in-(\d{4}-\d\d-\d\d)\.(\d+)\.backup$")
+
+
+class CorruptArchive(Exception):
+    """An archive doesn't match its checksum, or doesn't decrypt"""
+
+
+class _Encrypting(io.RawIOBase):
+    """Encrypts what is written to it into file, segment by segment"""
+
+    def __init__(self, file, config):
+        key, master_fingerprint, data_key = encryption.new_data_key(config)
+        data_key = data_key.encode("ascii")
+        self._header = (
+            MAGIC
+            + master_fingerprint.encode("ascii")
+            + os.urandom(8)
+            + len(data_key).to_bytes(2, "big")
+            + data_key
+        )
+        self._file = file
+        self._aead = AESGCM(key)
+        self._counter = 0
+        self._buffer = bytearray()
+        self.sha256 = hashlib.sha256()
+        self._write(self._header)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= SEGMENT_SIZE:
+            self._segment(bytes(self._buffer[:SEGMENT_SIZE]), last=False)
+            del self._buffer[:SEGMENT_SIZE]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._segment(bytes(self._buffer), last=True)
+        super().close()
+
+    def _segment(self, plaintext, last):
+        flag = b"\x01" if last else b"\x00"
+        nonce = self._header[24:32] + self._counter.to_bytes(4, "big")
+        ciphertext = self._aead.encrypt(nonce, plaintext, self._header + flag)
+        self._write(flag + len(ciphertext).to_bytes(4, "big") + ciphertext)
+        self._counter += 1
+
+    def _write(self, data):
+        self._file.write(data)
+        self.sha256.update(data)
+
+
+class _Decrypting(io.RawIOBase):
+    """Reads what _Encrypting wrote to file"""
+
+    def __init__(self, file, config):
+        self._file = file
+        fixed = self._read(34)
+        if fixed[:8] != MAGIC:
+            raise CorruptArchive(f"{file.name} is not a backup archive")
+        data_key = self._read(int.from_bytes(fixed[32:34], "big"))
+        self._header = fixed + data_key
+        key = encryption.open_data_key(
+            dict(encryption.read_master_keys(config)),
+            fixed[8:24].decode("ascii"),
+            data_key.decode("ascii"),
+        )
+        self._aead = AESGCM(key)
+        self._counter = 0
+        self._plaintext = b""
+        self._offset = 0
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset == len(self._plaintext) and not self._done:
+            self._next_segment()
+        size = min(len(buffer), len(self._plaintext) - self._offset)
+        buffer[:size] = self._plaintext[self._offset : self._offset + size]
+        self._offset += size
+        return size
+
+    def _next_segment(self):
+        prefix = self._read(5)
+        flag = prefix[:1]
+        ciphertext = self._read(int.from_bytes(prefix[1:], "big"))
+        nonce = self._header[24:32] + self._counter.to_bytes(4, "big")
+        try:
+            self._plaintext = self._aead.decrypt(nonce, ciphertext, self._header + flag)
+        except InvalidTag:
+            raise CorruptArchive(f"{self._file.name} was altered") from None
+        self._offset = 0
+        self._counter += 1
+        if flag == b"\x01":
+            self._done = True
+            if self._file.read(1):
+                raise CorruptArchive(f"{self._file.name} has data after its end")
+
+    def _read(self, size):
+        data = self._file.read(size)
+        if len(data) < size:
+            raise CorruptArchive(f"{self._file.name} is truncated")
+        return data
+
+
+@contextmanager
+def open_archive(path, config):
+    """The decrypted and decompressed CSV file"""
+    with open(path, "rb") as file:
+        decrypted = io.BufferedReader(_Decrypting(file, config), SEGMENT_SIZE)
+        with gzip.GzipFile(fileobj=decrypted, mode="rb") as decompressed:
+            yield io.TextIOWrapper(decompressed, encoding="utf-8", newline="")
+
+
+class ArchiveWriter:
+    def __init__(self, path, config):
+        self.path = path
+        self.rows = 0
+        self._file = open(path + ".tmp", "wb")
+        self._encrypting = _Encrypting(self._file, config)
+        self._gzip = gzip.GzipFile(fileobj=self._encrypting, mode="wb", mtime=0)
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8", newline="")
+        self._csv = csv.writer(self._text)
+        self._csv.writerow(COLUMNS)
+
+    def write(self, rows):
+        self._csv.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self):
+        """Writes the rest to disk, returns the archive's SHA-256 checksum"""
+        self._text.close()  # Also closes self._gzip, but not the files below
+        self._encrypting.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        return self._encrypting.sha256.hexdigest()
+
+    def commit(self, config):
+        """Checks the written archive and moves it in place, returns its checksum"""
+        sha256 = self.close()
+        check_archive(self.path + ".tmp", sha256, self.rows, config)
+        os.replace(self.path + ".tmp", self.path)
+        return sha256
+
+
+def check_archive(path, sha256, rows, config):
+    """Raises CorruptArchive unless the archive has the checksum and the rows"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(SEGMENT_SIZE), b""):
+            digest.update(block)
+    if digest.hexdigest() != sha256:
+        raise CorruptArchive(f"{path} doesn't match its checksum")
+    try:
+        with open_archive(path, config) as text:
+            found = sum(1 for _ in csv.reader(text)) - 1
+    except (OSError, EOFError) as e:  # gzip's errors, e.g. a wrong CRC
+        raise CorruptArchive(f"{path} can't be decompressed: {e}") from e
+    if found != rows:
+        raise CorruptArchive(f"{path} has {found} instead of {rows} rows")
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"high_water_mark": None, "stored_at": None, "archives": {}}
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def backup(directory, config, now=None):
+    """
+    Backs up the current tenant's sign-ins since the last backup, and the days that
+    gained sign-ins since theirs. Yields (name, rows) for every new archive. Needs
+    an app context. With TENANTS_FILE and no current tenant, backs up the sign-ins
+    without a tenant
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    _remove_unlisted(directory, manifest)
+    start = manifest["high_water_mark"]
+    start = datetime.fromisoformat(start) if start else None
+    now = now or datetime.now()
+    end = now - timedelta(minutes=config["AUTO_CHECKOUT"])
+    if start is not None and end <= start:
+        return
+    # Before reading, so sign-ins stored meanwhile are looked at by the next run
+    stored_at = db.session.execute(select([func.max(sign_ins.table.c.stored_at)]))
+    stored_at = stored_at.scalar()
+
+    committed = {}
+    replaced = []
+    if start is not None and manifest.get("stored_at"):
+        since = cutoff(config["RETENTION_DAYS"], now.date())
+        late = datetime.fromisoformat(manifest["stored_at"])
+        for day in _changed_days(late, since, start):
+            first = datetime.combine(day, datetime.min.time())
+            query = _query(first, min(first + timedelta(days=1), start))
+            replaced += [
+                name
+                for name, archive in manifest["archives"].items()
+                if archive["day"] == day.isoformat()
+            ]
+            yield from _write_archives(query, directory, manifest, committed, config)
+    yield from _write_archives(
+        _query(start, end), directory, manifest, committed, config
+    )
+    for name in replaced:
+        del manifest["archives"][name]
+    manifest["archives"].update(committed)
+    manifest["high_water_mark"] = end.isoformat()
+    if stored_at is not None:
+        manifest["stored_at"] = stored_at.isoformat()
+    save_manifest(directory, manifest)
+    for name in replaced:
+        os.unlink(os.path.join(directory, name))
+
+
+def _query(start, end):
+    """The current tenant's sign-ins from start (None: the first) to before end"""
+    table = sign_ins.table
+    query = _restrict(
+        select([table]).where(table.c.signed_in_at < end).order_by(table.c.signed_in_at)
+    )
+    if start is not None:
+        query = query.where(table.c.signed_in_at >= start)
+    return query
+
+
+def _restrict(query):
+    """Like tenants.restrict, but without a tenant only the rows without one"""
+    if tenants.enabled() and tenants.current() is None:
+        return query.where(sign_ins.table.c.tenant.is_(None))
+    return tenants.restrict(query)
+
+
+def _changed_days(stored_after, since, before):
+    """The days from since to before with sign-ins stored after stored_after"""
+    table = sign_ins.table
+    query = _restrict(
+        select([table.c.signed_in_at])
+        .where(table.c.stored_at > stored_after)
+        .where(table.c.signed_in_at >= since)
+        .where(table.c.signed_in_at < before)
+    )
+    return sorted({row.signed_in_at.date() for row in db.session.execute(query)})
+
+
+def _write_archives(query, directory, manifest, committed, config):
+    """Writes the rows of query to new archives, one per day, yields (name, rows)"""
+    writer = None
+    try:
+        for rows in iter_rows(query):
+            for day, day_rows in groupby(rows, key=lambda row: row.signed_in_at.date()):
+                if writer is not None and writer.day != day:
+                    committed[writer.name] = _commit(writer, config)
+                    yield writer.name, writer.rows
+                    writer = None
+                if writer is None:
+                    writer = _new_writer(directory, manifest, committed, day, config)
+                writer.write(list(day_rows))
+        if writer is not None:
+            committed[writer.name] = _commit(writer, config)
+            yield writer.name, writer.rows
+            writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+            os.unlink(writer.path + ".tmp")
+
+
+def prune_archives(directory, before):
+    """Deletes the archives of the days before `before`, returns their names"""
+    manifest = load_manifest(directory)
+    names = [
+        name
+        for name, archive in manifest["archives"].items()
+        if date.fromisoformat(archive["day"]) < before
+    ]
+    for name in names:
+        del manifest["archives"][name]
+    # The manifest first: an archive it doesn't list is deleted by the next run
+    save_manifest(directory, manifest)
+    for name in names:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return names
+
+
+def verify(directory, config):
+    """Yields (name, None or the problem) for every archive"""
+    manifest = load_manifest(directory)
+    for name, archive in sorted(manifest["archives"].items()):
+        try:
+            check_archive(
+                os.path.join(directory, name),
+                archive["sha256"],
+                archive["rows"],
+                config,
+            )
+        except (CorruptArchive, OSError) as e:
+            yield name, str(e)
+        else:
+            yield name, None
+
+
+def archived_records(directory, config, first_day=None, last_day=None):
+    """The (archive:line, record) of the sign-ins between the days, for import"""
+    manifest = load_manifest(directory)
+    for name, archive in sorted(manifest["archives"].items()):
+        day = date.fromisoformat(archive["day"])
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        with open_archive(os.path.join(directory, name), config) as text:
+            fieldnames, records = read_csv(text)
+            missing = REQUIRED_COLUMNS - set(fieldnames)
+            if missing:
+                raise CorruptArchive(f"{name} is missing {', '.join(sorted(missing))}")
+            for number, record in records:
+                yield f"{name}:{number}", record
+
+
+def _new_writer(directory, manifest, committed, day, config):
+    parts = [
+        int(match.group(2))
+        for match in map(NAME.match, [*manifest["archives"], *committed])
+        if match and match.group(1) == day.isoformat()
+    ]
+    name = f"corona-sign-in-{day.isoformat()}.{max(parts, default=0) + 1}.backup"
+    writer = ArchiveWriter(os.path.join(directory, name), config)
+    writer.name = name
+    writer.day = day
+    return writer
+
+
+def _commit(writer, config):
+    sha256 = writer.commit(config)
+    return {"day": writer.day.isoformat(), "rows": writer.rows, "sha256": sha256}
+
+
+def _remove_unlisted(directory, manifest):
+    # Left by a run that didn't get to save the manifest, their rows are backed up
+    # again
+    for name in os.listdir(directory):
+        unfinished = name.endswith(".backup.tmp")
+        if unfinished or (NAME.match(name) and name not in manifest["archives"]):
+            os.unlink(os.path.join(directory, name))
+
+
+def _directory(directory):
+    directory = directory or current_app.config["BACKUP_DIR"]
+    if not directory:
+        raise click.UsageError("Set BACKUP_DIR or pass --directory")
+    tenant = tenants.current()
+    return os.path.join(directory, tenant.id) if tenant is not None else directory
+
+
+directory_option = click.option(
+    "--directory",
+    type=click.Path(file_okay=False),
+    help="Where the archives are. Defaults to BACKUP_DIR",
+)
+
+
+@click.group("backup")
+def backup_command():
+    """Back up sign-ins to encrypted archives, and restore them"""
+
+
+@backup_command.command("run")
+@directory_option
+@click.option("--keep", is_flag=True, help="Don't delete archives past retention")
+@with_appcontext
+def run_command(directory, keep):
+    """Back up the sign-ins since the last run, delete archives past retention"""
+    for tenant in _owners():
+        if tenant is not None:
+            click.echo(f"Backing up {tenant.id}")
+        elif tenants.enabled():
+            click.echo("Backing up the sign-ins without a tenant")
+        with tenants.use(tenant):
+            _run(_directory(directory), keep)
+
+
+def _owners():
+    """Every tenant, and None for the sign-ins without one"""
+    if not tenants.enabled():
+        return [None]
+    return [*tenants.all_tenants(), None]
+
+
+def _run(directory, keep):
+    config = tenants.config()
+    started = time.monotonic()
+    total = 0
+    try:
+        for name, rows in backup(directory, config):
+            click.echo(f"Wrote {name} with {rows} sign-ins")
+            total += rows
+    except (encryption.MissingKey, CorruptArchive) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Backed up {total} sign-ins in {time.monotonic() - started:.1f}s")
+    if not keep:
+        before = cutoff(config["RETENTION_DAYS"]).date()
+        for name in prune_archives(directory, before):
+            click.echo(f"Deleted {name}")
+
+
+@backup_command.command("verify")
+@directory_option
+@with_appcontext
+def verify_command(directory):
+    """Check the checksums of all archives and that they decrypt"""
+    problems = 0
+    for tenant in _owners():
+        with tenants.use(tenant):
+            path = _directory(directory)
+        prefix = f"{tenant.id}/" if tenant is not None else ""
+        for name, problem in verify(path, current_app.config):
+            click.echo(f"{prefix}{name}: {problem or 'OK'}")
+            problems += problem is not None
+    if problems:
+        raise click.ClickException(f"{problems} archives are damaged")
+
+
+@backup_command.command("restore")
+@directory_option
+@click.option("--from", "first_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--to", "last_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--batch-size", type=int, default=5000, show_default=True)
+@click.option("--skip-invalid", is_flag=True, help="e.g. of locations removed since")
+@click.option("--dry-run", is_flag=True, help="Only read and check the archives")
+@with_appcontext
+@tenants.tenant_option
+def restore_command(directory, first_day, last_day, batch_size, skip_invalid, dry_run):
+    """
+    Import the archived sign-ins of the days, see `flask import`. Sign-ins that
+    are still in the database are imported again
+    """
+    tenants.require_tenant()
+    records = archived_records(
+        _directory(directory),
+        current_app.config,
+        first_day.date() if first_day else None,
+        last_day.date() if last_day else None,
+    )
+    started = time.monotonic()
+    try:
+        imported, invalid = import_records(
+            records,
+            batch_size,
+            dry_run=dry_run,
+            skip_invalid=skip_invalid,
+            on_error=lambda number, errors: click.echo(
+                f"{number}: {'; '.join(errors)}", err=True
+            ),
+        )
+    except (encryption.MissingKey, CorruptArchive) as e:
+        raise click.ClickException(str(e))
+    verb = "Would restore" if dry_run else "Restored"
+    seconds = time.monotonic() - started
+    click.echo(f"{verb} {imported} sign-ins in {seconds:.1f}s, {invalid} invalid")
+    if invalid and not skip_invalid:
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(backup_command)
@@ -0,0 +1,342 @@
+"""
+`flask import` loads sign-ins from CSV or Parquet files, e.g. from paper lists.
+
+The files need the columns of `flask export`. signed_in_at can be ISO 8601 or a
+German date and time (31.12.2020 18:30). Times with a UTC offset are converted to
+the server's time zone, those without are taken as they are. signed_out_at is
+optional, without it guests are checked out automatically (see checkout.py), it
+can't be before signed_in_at. Every row is checked with the rules of the sign-in
+form, including the configured LOCATIONS. The location column contains the name of
+the location, as in the export.
+
+Rows are streamed from the file and written in batches, with COPY on PostgreSQL and
+multi-row inserts elsewhere, within one transaction. If a row is invalid, nothing
+is imported unless --skip-invalid is given.
+
+Parquet needs pyarrow, which is not installed by default.
+"""
+import csv
+import io
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from werkzeug.datastructures import MultiDict
+from wtforms import StringField
+from wtforms.validators import DataRequired
+
+import sign_ins
+import tenants
+from checkout import planned_checkout
+from db import db
+from encryption import encryption
+from locations import get_locations
+from partitions import partitions
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+COLUMNS = sign_ins.COLUMNS
+REQUIRED_COLUMNS = set(COLUMNS) - {"location", "signed_out_at"}
+
+DATETIME_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S")
+
+
+class InvalidFile(Exception):
+    """A problem with the whole file, e.g. a missing column"""
+
+
+def read_csv(file):
+    """Returns the column names and an iterator of (line number, record)"""
+    reader = csv.DictReader(file)
+    fieldnames = reader.fieldnames or []
+    return fieldnames, ((reader.line_num, record) for record in reader)
+
+
+def read_parquet(path, batch_size=10000):
+    if parquet is None:
+        raise InvalidFile("Install pyarrow to import Parquet files")
+    file = parquet.ParquetFile(path)
+
+    def records():
+        number = 0
+        for batch in file.iter_batches(batch_size=batch_size):
+            for record in batch.to_pylist():
+                number += 1
+                yield number, record
+
+    return file.schema_arrow.names, records()
+
+
+class RowValidator:
+    """Checks records with the rules of the sign-in form"""
+
+    def __init__(self, locations):
+        self.locations = locations
+        # Filling an existing form is a lot faster than creating one per row
+        if locations:
+            self.form = sign_ins.FormWithLocation(locations, formdata=MultiDict())
+        else:
+            self.form = sign_ins.Form(formdata=MultiDict())
+        self._text_fields = _required_text_fields(self.form)
+
+    def validate(self, record):
+        """Returns (row, None) for valid records, (None, [error, ...]) otherwise"""
+        values = {
+            column: _text(record.get(column)) for column in COLUMNS if column in record
+        }
+        errors = []
+
+        location = values.pop("location", "")
+        if self.locations:
+            try:
+                values["location"] = self.locations.value_for(location)
+            except ValueError:
+                errors.append(f'location: Unknown location "{location}"')
+        elif location:
+            errors.append(f'location: "{location}", but no LOCATIONS are configured')
+
+        try:
+            signed_in_at = _parse_datetime(values.pop("signed_in_at", ""))
+        except ValueError as e:
+            signed_in_at = None
+            errors.append(f"signed_in_at: {e}")
+        signed_out_at = values.pop("signed_out_at", "")
+        if signed_out_at:
+            try:
+                signed_out_at = _parse_datetime(signed_out_at)
+            except ValueError as e:
+                errors.append(f"signed_out_at: {e}")
+            else:
+                # The stays' GiST index (see tracing.py) rejects those on PostgreSQL
+                if signed_in_at is not None and signed_out_at < signed_in_at:
+                    errors.append("signed_out_at: Before signed_in_at")
+        elif not errors:
+            signed_out_at = planned_checkout(signed_in_at)
+
+        if not errors and self._text_fields is not None:
+            row = {name: values.get(name, "") for name in self._text_fields}
+            if all(row.values()):
+                # What the form would return, without the overhead of running it
+                row["location"] = location or None
+                row["signed_in_at"] = signed_in_at
+                row["signed_out_at"] = signed_out_at
+                return row, None
+
+        self.form.process(MultiDict(values))
+        if not self.form.validate():
+            errors += [
+                f"{field}: {message}"
+                for field, messages in self.form.errors.items()
+                for message in messages
+            ]
+        if errors:
+            return None, errors
+        row = {
+            **self.form.data,
+            "signed_in_at": signed_in_at,
+            "signed_out_at": signed_out_at,
+        }
+        row.setdefault("location", None)
+        return row, None
+
+
+def _required_text_fields(form):
+    """
+    The names of the form's fields if all of them are text fields that only need to
+    be filled in. Then a record with all of them is valid. None otherwise
+    """
+    names = []
+    for name, field in form._fields.items():
+        if name == "location":
+            continue  # Checked with the locations
+        if (
+            type(field) is not StringField
+            or getattr(form, f"validate_{name}", None)
+            or [type(v) for v in field.validators] != [DataRequired]
+        ):
+            return None
+        names.append(name)
+    return names
+
+
+def import_records(
+    records, batch_size, dry_run=False, skip_invalid=False, on_error=None
+):
+    """
+    Validates and stores the records. Needs an app context.
+
+    Returns (number of imported rows, number of invalid rows). If there are invalid
+    rows and skip_invalid is False, nothing is stored. The rows belong to the current
+    tenant, see tenants.py.
+    """
+    on_error = on_error or (lambda number, errors: None)
+    tenant = tenants.current_id()
+    validator = RowValidator(get_locations())
+    imported = 0
+    invalid = 0
+
+    def valid_batches():
+        nonlocal invalid
+        batch = []
+        for number, record in records:
+            row, errors = validator.validate(record)
+            if errors:
+                invalid += 1
+                on_error(number, errors)
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if dry_run:
+        for batch in valid_batches():
+            imported += len(batch)
+        return imported, invalid
+
+    partitions.ensure()
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            write = _copy if connection.dialect.name == "postgresql" else _insert
+            for batch in valid_batches():
+                if invalid and not skip_invalid:
+                    continue  # Will be rolled back anyway, just check the rest
+                write(
+                    connection,
+                    [encryption.encrypt({**row, "tenant": tenant}) for row in batch],
+                )
+                imported += len(batch)
+            if invalid and not skip_invalid:
+                transaction.rollback()
+                return 0, invalid
+            transaction.commit()
+        except BaseException:
+            transaction.rollback()
+            raise
+    return imported, invalid
+
+
+def _copy(connection, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        writer.writerow([row.get(column) for column in sign_ins.INSERT_COLUMNS])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {sign_ins.table.name} ({', '.join(sign_ins.INSERT_COLUMNS)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def _insert(connection, rows):
+    connection.execute(sign_ins.table.insert(), rows)
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    return str(value).strip()
+
+
+def _parse_datetime(value):
+    """A naive local time, like the sign-ins of the form"""
+    if not value:
+        raise ValueError("Missing")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        return parsed
+    for format in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError(f'"{value}" is not a date and time like 31.12.2020 18:30')
+
+
+@click.command("import")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "format",
+    type=click.Choice(["csv", "parquet"]),
+    help="Defaults to the file's extension",
+)
+@click.option("--batch-size", type=int, default=5000, show_default=True)
+@click.option("--skip-invalid", is_flag=True, help="Import the valid rows anyway")
+@click.option("--dry-run", is_flag=True, help="Only check the rows")
+@click.option(
+    "--max-errors",
+    type=int,
+    default=100,
+    show_default=True,
+    help="Show at most this many invalid rows",
+)
+@with_appcontext
+@tenants.tenant_option
+def import_command(file, format, batch_size, skip_invalid, dry_run, max_errors):
+    """Import sign-ins from a CSV or Parquet file, e.g. from paper lists"""
+    tenants.require_tenant()
+    format = format or ("parquet" if file.endswith(".parquet") else "csv")
+    shown = 0
+
+    def on_error(number, errors):
+        nonlocal shown
+        if shown < max_errors:
+            click.echo(f"{number}: {'; '.join(errors)}", err=True)
+        shown += 1
+
+    started = time.monotonic()
+    with ExitStack() as stack:
+        try:
+            if format == "parquet":
+                fieldnames, records = read_parquet(file)
+            else:
+                f = stack.enter_context(open(file, newline="", encoding="utf-8-sig"))
+                fieldnames, records = read_csv(f)
+            missing = REQUIRED_COLUMNS - set(fieldnames)
+            if missing:
+                raise InvalidFile(f"Missing columns: {', '.join(sorted(missing))}")
+        except InvalidFile as e:
+            raise click.ClickException(str(e))
+        imported, invalid = import_records(
+            records,
+            batch_size,
+            dry_run=dry_run,
+            skip_invalid=skip_invalid,
+            on_error=on_error,
+        )
+    seconds = time.monotonic() - started
+
+    if invalid > max_errors:
+        click.echo(f"... and {invalid - max_errors} more invalid rows", err=True)
+    verb = "Would import" if dry_run else "Imported"
+    click.echo(f"{verb} {imported} sign-ins in {seconds:.1f}s, {invalid} invalid")
+    if invalid and not skip_invalid:
+        if not dry_run:
+            click.echo("Nothing was imported. Fix the rows or use --skip-invalid")
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(import_command)
@@ -0,0 +1,132 @@
+"""
+Guests check out when they leave, so contact tracing knows how long they stayed.
+
+Every sign-in is stored with signed_out_at set to AUTO_CHECKOUT minutes after
+signed_in_at. After signing in, guests are redirected to /thank-you?checkout=...,
+with a signed token that identifies their sign-in by tenant, location and
+signed_in_at. The page itself is the same for everyone (see pages.py), a script
+turns the token into a check-out button. Tapping it before the automatic check-out
+moves signed_out_at to the current time.
+
+The token contains no personal data. It needs SECRET_KEY and is valid until the
+automatic check-out, at the tenant it was made for (see tenants.py).
+
+A sign-in that waits in the ingest queue (see ingest.py) can't be checked out yet.
+The process's own queue is written first, if the sign-in waits in another process's
+queue or in a spill file, the guest is asked to try again in a few seconds.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app, render_template, request
+from itsdangerous import BadData, URLSafeTimedSerializer
+from sqlalchemy import and_, select
+
+import sign_ins
+import staff
+import tenants
+from db import db
+from occupancy import occupancy
+
+# Seconds after which guests should try again if their sign-in isn't stored yet
+RETRY_SECONDS = 5
+
+
+def planned_checkout(signed_in_at, config=None):
+    """When a guest who signed in at signed_in_at is checked out automatically"""
+    config = config or current_app.config
+    return signed_in_at + timedelta(minutes=config["AUTO_CHECKOUT"])
+
+
+def thank_you_url(row, config=None, root=""):
+    """Where guests are sent after signing in, root is a tenant's path prefix"""
+    token = make_token(row, config)
+    return f"{root}/thank-you?checkout={token}" if token else f"{root}/thank-you"
+
+
+def make_token(row, config=None):
+    """The check-out token for a sign-in, or None if there is no SECRET_KEY"""
+    serializer = _serializer(config or current_app.config)
+    if serializer is None:
+        return None
+    return serializer.dumps(
+        [row.get("tenant"), row.get("location"), row["signed_in_at"].isoformat()]
+    )
+
+
+def check_out(token, now=None):
+    """
+    Checks out the guest the token was made for. Returns False if they are already
+    checked out, raises ValueError if the token is invalid or expired and
+    LookupError if the sign-in isn't stored yet.
+    """
+    config = current_app.config
+    serializer = _serializer(config)
+    if serializer is None:
+        raise ValueError("Checking out is disabled")
+    try:
+        tenant, location, signed_in_at = serializer.loads(
+            token, max_age=config["AUTO_CHECKOUT"] * 60
+        )
+        signed_in_at = datetime.fromisoformat(signed_in_at)
+    except (BadData, TypeError, ValueError) as e:
+        raise ValueError("Invalid check-out token") from e
+    if tenant != tenants.current_id():
+        raise ValueError("The check-out token is for another tenant")
+
+    now = now or datetime.now()
+    table = sign_ins.table
+    # Uses the (location, signed_in_at) index
+    same_sign_in = and_(
+        table.c.location.is_(None)
+        if location is None
+        else table.c.location == location,
+        table.c.signed_in_at == signed_in_at,
+    )
+    update = (
+        table.update()
+        .where(same_sign_in)
+        .where(table.c.signed_out_at > now)
+        .values(signed_out_at=now)
+    )
+    checked_out = _execute(tenants.restrict(update)).rowcount
+    queue = current_app.extensions["ingest"]
+    if not checked_out and queue is not None and queue.size:
+        queue.flush()
+        checked_out = _execute(tenants.restrict(update)).rowcount
+    if not checked_out:
+        stored = select([table.c.signed_out_at]).where(same_sign_in)
+        if db.session.execute(tenants.restrict(stored)).first() is None:
+            raise LookupError("The sign-in isn't stored yet")
+        return False
+    occupancy.leave(location, planned_checkout(signed_in_at, config))
+    staff.notify()
+    return True
+
+
+def checkout_view():
+    token = request.form.get("token", "")
+    try:
+        checked_out = check_out(token)
+    except ValueError:
+        return render_template("checkout.html.jinja2", state="expired"), 400
+    except LookupError:
+        page = render_template("checkout.html.jinja2", state="pending", token=token)
+        return page, 503, {"Retry-After": str(RETRY_SECONDS)}
+    state = "checked out" if checked_out else "already checked out"
+    return render_template("checkout.html.jinja2", state=state)
+
+
+def _execute(statement):
+    result = db.session.execute(statement)
+    db.session.commit()
+    return result
+
+
+def _serializer(config):
+    if not config.get("SECRET_KEY"):
+        return None
+    return URLSafeTimedSerializer(config["SECRET_KEY"], salt="checkout")
+
+
+def init_app(app):
+    app.add_url_rule("/checkout", "checkout", checkout_view, methods=("POST",))
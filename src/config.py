@@ -1,10 +1,18 @@
 # Create a reasonably secure secret key using `python -c import os; print (os.urandom(128))`
 import os
+import tempfile
+
+from pool import TimedQueuePool
 
 
 class ProductionConfig:
     WTF_CSRF_ENABLED = False
 
+    @property
+    def SECRET_KEY(self):
+        """Signs the check-out links. Without it, guests can't check out"""
+        return os.environ.get("CORONA_SIGN_IN_SECRET_KEY")
+
     @property
     def SQLALCHEMY_DATABASE_URI(self):
         return os.environ["CORONA_SIGN_IN_DATABASE_URI"]
@@ -12,6 +20,95 @@ class ProductionConfig:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     """ This makes a deprecation warning go away. It doesn't change behaviour"""
 
+    @property
+    def SQLALCHEMY_ENGINE_OPTIONS(self):
+        if self.SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+            return {}
+        options = {
+            "poolclass": TimedQueuePool,
+            "pool_size": self.DB_POOL_SIZE,
+            "max_overflow": self.DB_POOL_MAX_OVERFLOW,
+            "pool_timeout": self.DB_POOL_TIMEOUT,
+            "pool_recycle": self.DB_POOL_RECYCLE,
+            "pool_pre_ping": self.DB_POOL_PRE_PING,
+        }
+        if self.DB_STATEMENT_TIMEOUT and self.SQLALCHEMY_DATABASE_URI.startswith(
+            "postgresql"
+        ):
+            milliseconds = int(self.DB_STATEMENT_TIMEOUT * 1000)
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={milliseconds}"
+            }
+        return options
+
+    @property
+    def DB_POOL_SIZE(self):
+        """
+        Connections kept open per process. By default every thread can hold one
+        while it handles a request
+        """
+        return int(os.environ.get("CORONA_SIGN_IN_DB_POOL_SIZE", self.THREADS))
+
+    @property
+    def DB_POOL_MAX_OVERFLOW(self):
+        """Additional connections for peaks and background work (e.g. queued ingest)"""
+        return int(os.environ.get("CORONA_SIGN_IN_DB_POOL_MAX_OVERFLOW", 2))
+
+    @property
+    def DB_POOL_TIMEOUT(self):
+        """Seconds a request waits for a free connection before it fails"""
+        return float(os.environ.get("CORONA_SIGN_IN_DB_POOL_TIMEOUT", 10))
+
+    @property
+    def DB_POOL_RECYCLE(self):
+        """Connections older than this many seconds are replaced, -1 to disable"""
+        return int(os.environ.get("CORONA_SIGN_IN_DB_POOL_RECYCLE", 1800))
+
+    @property
+    def DB_POOL_PRE_PING(self):
+        """Test connections before using them, so a database restart causes no 500s"""
+        return (
+            os.environ.get("CORONA_SIGN_IN_DB_POOL_PRE_PING", "true").lower() == "true"
+        )
+
+    @property
+    def DB_STATEMENT_TIMEOUT(self):
+        """Seconds after which PostgreSQL cancels a statement, 0 to disable"""
+        return float(os.environ.get("CORONA_SIGN_IN_DB_STATEMENT_TIMEOUT", 30))
+
+    @property
+    def SERVER(self):
+        """Used by serve.py, either "waitress" or "gunicorn" """
+        return os.environ.get("CORONA_SIGN_IN_SERVER", "waitress")
+
+    @property
+    def HOST(self):
+        return os.environ.get("CORONA_SIGN_IN_HOST", "0.0.0.0")
+
+    @property
+    def PORT(self):
+        return int(os.environ.get("CORONA_SIGN_IN_PORT", 8080))
+
+    @property
+    def WORKERS(self):
+        """Number of processes, only for gunicorn"""
+        return int(os.environ.get("CORONA_SIGN_IN_WORKERS", os.cpu_count() or 1))
+
+    @property
+    def THREADS(self):
+        """Number of threads per process"""
+        return int(os.environ.get("CORONA_SIGN_IN_THREADS", 4))
+
+    @property
+    def CONNECTION_LIMIT(self):
+        """Maximum number of open client connections per process"""
+        return int(os.environ.get("CORONA_SIGN_IN_CONNECTION_LIMIT", 100))
+
+    @property
+    def PRELOAD(self):
+        """Create the app before forking the gunicorn workers"""
+        return os.environ.get("CORONA_SIGN_IN_PRELOAD", "true").lower() == "true"
+
     @property
     def LOCATIONS(self):
         locations_raw = os.environ.get("CORONA_SIGN_IN_LOCATIONS")
@@ -20,6 +117,178 @@ class ProductionConfig:
         else:
             return None
 
+    @property
+    def LOCATIONS_FILE(self):
+        """Reads the locations from this file instead, see locations.py"""
+        return os.environ.get("CORONA_SIGN_IN_LOCATIONS_FILE")
+
+    PAGE_MAX_AGE = 24 * 60 * 60
+    """ Seconds browsers may cache /thank-you and /data-protection without asking"""
+
+    @property
+    def ADMIN_TOKEN(self):
+        """Needed to use /export. If this is not set, the endpoint is disabled"""
+        return os.environ.get("CORONA_SIGN_IN_ADMIN_TOKEN")
+
+    @property
+    def STAFF_TOKEN(self):
+        """Needed to use /staff. If this is not set, the page is disabled"""
+        return os.environ.get("CORONA_SIGN_IN_STAFF_TOKEN")
+
+    @property
+    def STAFF_STREAM_SECONDS(self):
+        """How long a WSGI thread serves one /staff/stream before it reconnects"""
+        return int(os.environ.get("CORONA_SIGN_IN_STAFF_STREAM_SECONDS", 300))
+
+    @property
+    def METRICS_TOKEN(self):
+        """Needed to use /metrics. If this is not set, the endpoint is disabled"""
+        return os.environ.get("CORONA_SIGN_IN_METRICS_TOKEN")
+
+    @property
+    def EXPORT_CHUNK_SIZE(self):
+        return int(os.environ.get("CORONA_SIGN_IN_EXPORT_CHUNK_SIZE", 1000))
+
+    @property
+    def AUTO_CHECKOUT(self):
+        """Minutes after which guests who didn't check out are checked out"""
+        return int(os.environ.get("CORONA_SIGN_IN_AUTO_CHECKOUT", 120))
+
+    @property
+    def CAPACITY(self):
+        """
+        How many guests may be present at once, see occupancy.py. Either one number
+        for every location or e.g. "Balcony=30;Hacienda=50"
+        """
+        capacity_raw = os.environ.get("CORONA_SIGN_IN_CAPACITY")
+        if not capacity_raw:
+            return None
+        if "=" not in capacity_raw:
+            return int(capacity_raw)
+        capacity = {}
+        for item in capacity_raw.split(";"):
+            if item.strip():
+                location, number = item.rsplit("=", 1)
+                capacity[location.strip()] = int(number)
+        return capacity
+
+    @property
+    def OCCUPANCY_FILE(self):
+        """Where the processes share the occupancy counters, see occupancy.py"""
+        return os.environ.get(
+            "CORONA_SIGN_IN_OCCUPANCY_FILE",
+            os.path.join(tempfile.gettempdir(), "corona-sign-in-occupancy"),
+        )
+
+    @property
+    def DEDUP_WINDOW(self):
+        """Seconds in which a sign-in sent again isn't stored, see dedup.py. 0: off"""
+        return int(os.environ.get("CORONA_SIGN_IN_DEDUP_WINDOW", 300))
+
+    @property
+    def DEDUP_CAPACITY(self):
+        """Sign-ins per DEDUP_WINDOW the duplicate detection is sized for"""
+        return int(os.environ.get("CORONA_SIGN_IN_DEDUP_CAPACITY", 10000))
+
+    @property
+    def DEDUP_FILE(self):
+        return os.environ.get(
+            "CORONA_SIGN_IN_DEDUP_FILE",
+            os.path.join(tempfile.gettempdir(), "corona-sign-in-dedup"),
+        )
+
+    @property
+    def RATE_LIMIT_PER_IP(self):
+        """Sign-ins per minute from one address, needs PROXIES. 0: no limit"""
+        return int(os.environ.get("CORONA_SIGN_IN_RATE_LIMIT_PER_IP", 20))
+
+    @property
+    def RATE_LIMIT_GLOBAL(self):
+        """Sign-ins per minute from all addresses together. 0: no limit"""
+        return int(os.environ.get("CORONA_SIGN_IN_RATE_LIMIT_GLOBAL", 600))
+
+    @property
+    def RATE_LIMIT_FILE(self):
+        return os.environ.get(
+            "CORONA_SIGN_IN_RATE_LIMIT_FILE",
+            os.path.join(tempfile.gettempdir(), "corona-sign-in-ratelimit"),
+        )
+
+    @property
+    def PROXIES(self):
+        """Number of reverse proxies that add the client to X-Forwarded-For, or 0"""
+        proxies = os.environ.get("CORONA_SIGN_IN_PROXIES")
+        # Unset: unknown, so sign-ins aren't limited per address, see ratelimit.py
+        return int(proxies) if proxies else None
+
+    @property
+    def ENCRYPTION_KEY_FILE(self):
+        """Encrypts the contact data with the keys in this file, see encryption.py"""
+        return os.environ.get("CORONA_SIGN_IN_ENCRYPTION_KEY_FILE")
+
+    @property
+    def TENANTS_FILE(self):
+        """Serves the venues in this file instead of one, see tenants.py"""
+        return os.environ.get("CORONA_SIGN_IN_TENANTS_FILE")
+
+    @property
+    def BASE_URL(self):
+        """Where guests reach the form, e.g. for QR codes, see qr.py"""
+        return os.environ.get("CORONA_SIGN_IN_BASE_URL")
+
+    @property
+    def BACKUP_DIR(self):
+        """Where `flask backup` keeps its archives, see backup.py"""
+        return os.environ.get("CORONA_SIGN_IN_BACKUP_DIR")
+
+    @property
+    def TRACING_WINDOW(self):
+        """Minutes guests are assumed to stay, see tracing.py"""
+        return int(os.environ.get("CORONA_SIGN_IN_TRACING_WINDOW", 120))
+
+    @property
+    def RETENTION_DAYS(self):
+        """`flask prune` deletes sign-ins older than this"""
+        return int(os.environ.get("CORONA_SIGN_IN_RETENTION_DAYS", 28))
+
+    @property
+    def PRUNE_BATCH_SIZE(self):
+        return int(os.environ.get("CORONA_SIGN_IN_PRUNE_BATCH_SIZE", 1000))
+
+    @property
+    def SIGN_INS_STORAGE(self):
+        """Either "plain" or "partitioned", see partitions.py. Read by the migrations"""
+        return os.environ.get("CORONA_SIGN_IN_STORAGE", "plain")
+
+    @property
+    def PARTITION_DAYS_AHEAD(self):
+        return int(os.environ.get("CORONA_SIGN_IN_PARTITION_DAYS_AHEAD", 7))
+
+    @property
+    def INGEST_MODE(self):
+        """Either "sync" (commit every sign-in immediately) or "queued", see ingest.py"""
+        return os.environ.get("CORONA_SIGN_IN_INGEST_MODE", "sync")
+
+    @property
+    def INGEST_QUEUE_SIZE(self):
+        return int(os.environ.get("CORONA_SIGN_IN_INGEST_QUEUE_SIZE", 1000))
+
+    @property
+    def INGEST_BATCH_SIZE(self):
+        return int(os.environ.get("CORONA_SIGN_IN_INGEST_BATCH_SIZE", 50))
+
+    @property
+    def INGEST_FLUSH_INTERVAL(self):
+        """Maximum number of seconds a queued sign-in waits before it is written"""
+        return float(os.environ.get("CORONA_SIGN_IN_INGEST_FLUSH_INTERVAL", 1))
+
+    @property
+    def INGEST_SPILL_DIR(self):
+        return os.environ.get(
+            "CORONA_SIGN_IN_INGEST_SPILL_DIR",
+            os.path.join(tempfile.gettempdir(), "corona-sign-in-ingest"),
+        )
+
 
 class TestConfig(ProductionConfig):
     ENV = "test"
@@ -28,3 +297,17 @@ class TestConfig(ProductionConfig):
         f"sqlite:///{os.path.dirname(os.path.dirname(__file__))}/testing.sqlite"
     )
     LOCATIONS = None
+    LOCATIONS_FILE = None
+    INGEST_MODE = "sync"
+    ADMIN_TOKEN = "insecure admin token for testing"
+    METRICS_TOKEN = "insecure metrics token for testing"
+    STAFF_TOKEN = "insecure staff token for testing"
+    CAPACITY = None
+    OCCUPANCY_FILE = None
+    DEDUP_FILE = None
+    RATE_LIMIT_PER_IP = 0
+    RATE_LIMIT_GLOBAL = 0
+    RATE_LIMIT_FILE = None
+    ENCRYPTION_KEY_FILE = None
+    TENANTS_FILE = None
+    BASE_URL = None
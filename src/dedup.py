@@ -0,0 +1,180 @@
+"""
+Recognizes sign-ins that were sent twice, e.g. by double-tapping "Jetzt einchecken"
+or by sending the form again after going back from /thank-you.
+
+A sign-in is a duplicate of one of the same tenant (see tenants.py) at the same
+location with the same names and phone number within the last DEDUP_WINDOW
+seconds. Duplicates aren't stored again, the guest is sent to /thank-you for the
+first sign-in.
+
+To avoid a database query for every sign-in, the sign-ins of the last window are
+remembered in a bloom filter. It can only err in one direction: a sign-in it hasn't
+seen is new for sure, which is almost every sign-in. If it might have seen one, the
+sign-in is looked up in the database (in the (location, signed_in_at) index), so a
+false positive costs a query but never loses a sign-in.
+
+There are two filters, for the current and the previous window, and sign-ins are
+looked up in both. When a new window starts, the older filter is cleared and reused,
+so the filters always contain at least the last DEDUP_WINDOW seconds, in a fixed
+amount of memory: every filter is sized for DEDUP_CAPACITY sign-ins with
+a false positive rate of FALSE_POSITIVE_RATE. Like occupancy.py, the filters are
+shared by all processes of a server, in DEDUP_FILE.
+
+With encryption (see encryption.py), the names and phone numbers of the sign-ins at
+the location within the window are decrypted to compare them.
+
+Sign-ins that are still in the ingest queue (see ingest.py) aren't found in the
+database yet, so their duplicates are stored.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+import sign_ins
+from db import db
+from encryption import FIELDS as ENCRYPTED_FIELDS, encryption
+from shared import SharedMemory
+
+FALSE_POSITIVE_RATE = 0.001
+
+# What makes two sign-ins the same
+FIELDS = ("tenant", "location", "first_name", "last_name", "phone_number")
+
+
+class RotatingBloomFilter:
+    """Two bloom filters, for the current and the previous window of `window` seconds"""
+
+    def __init__(self, path, capacity, window):
+        self.window = window
+        # The optimal number of bits and hash functions for the false positive rate
+        self.bits = math.ceil(
+            -capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2
+        )
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        size = math.ceil(self.bits / 8)
+        self._memory = SharedMemory(
+            path, 2 * 8 + 2 * size, ["dedup", self.bits, self.hashes, window]
+        )
+        # The window each filter is used for, then the filters' bits
+        self._windows = self._memory.data[:16].cast("q")
+        self._filters = (
+            self._memory.data[16 : 16 + size],
+            self._memory.data[16 + size :],
+        )
+
+    def add(self, key, now=None):
+        """Adds key, returns whether it might have been added before"""
+        current = int((now or time.time()) // self.window)
+        positions = self._positions(key)
+        with self._memory.locked():
+            bits = self._filter(current)
+            seen = self._contains(bits, positions)
+            if not seen and self._windows[(current - 1) % 2] == current - 1:
+                seen = self._contains(self._filters[(current - 1) % 2], positions)
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+        return seen
+
+    def _filter(self, current):
+        index = current % 2
+        if self._windows[index] != current:
+            # The filter of a window that has passed
+            self._filters[index][:] = bytes(len(self._filters[index]))
+            self._windows[index] = current
+        return self._filters[index]
+
+    def _positions(self, key):
+        # Double hashing, see Kirsch and Mitzenmacher, "Less Hashing, Same Performance"
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits, positions):
+        return all(
+            bits[position >> 3] & (1 << (position & 7)) for position in positions
+        )
+
+
+class Dedup:
+    def init_app(self, app):
+        app.extensions["dedup"] = _State()
+
+    def might_be_duplicate(self, row, app=None):
+        """
+        Remembers the sign-in. Returns False if it is new for sure, True if it might
+        be a duplicate, see find_original
+        """
+        app = app or current_app
+        if not app.config["DEDUP_WINDOW"]:
+            return False
+        return self._filter(app).add(fingerprint(row))
+
+    def find_original(self, row):
+        """
+        The stored sign-in that row duplicates, as a dict, or None. Queries the
+        database only if the bloom filter might have seen the sign-in
+        """
+        if not self.might_be_duplicate(row):
+            return None
+        window = timedelta(seconds=current_app.config["DEDUP_WINDOW"])
+        encrypted = encryption.enabled()
+        table = sign_ins.table
+        query = select([table])
+        for field in FIELDS:
+            if encrypted and field in ENCRYPTED_FIELDS:
+                continue  # Compared below, once decrypted
+            value = row.get(field)
+            query = query.where(
+                table.c[field].is_(None) if value is None else table.c[field] == value
+            )
+        query = query.where(
+            table.c.signed_in_at > row["signed_in_at"] - window
+        ).order_by(table.c.signed_in_at.desc())
+        if not encrypted:
+            query = query.limit(1)
+        for original in encryption.decrypt(db.session.execute(query).fetchall()):
+            if all(
+                getattr(original, field) == row.get(field)
+                for field in FIELDS
+                if field in ENCRYPTED_FIELDS
+            ):
+                # Row has no tenant column, it is the same as row's
+                return {**original._asdict(), "tenant": row.get("tenant")}
+        return None
+
+    def _filter(self, app):
+        state = app.extensions["dedup"]
+        # Processes forked by gunicorn need their own file descriptor for flock
+        if state.pid != os.getpid():
+            with state.lock:
+                if state.pid != os.getpid():
+                    state.filter = RotatingBloomFilter(
+                        app.config["DEDUP_FILE"],
+                        app.config["DEDUP_CAPACITY"],
+                        app.config["DEDUP_WINDOW"],
+                    )
+                    state.pid = os.getpid()
+        return state.filter
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.filter = None
+
+
+def fingerprint(row):
+    return json.dumps([row.get(field) for field in FIELDS]).encode()
+
+
+dedup = Dedup()
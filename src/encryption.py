@@ -0,0 +1,261 @@
+"""
+Encrypts the guests' contact data, so a database dump or backup can't be read
+without the key.
+
+With ENCRYPTION_KEY_FILE set, the names, address and phone number of every sign-in
+are encrypted with AES-GCM before they are stored. The location and the times stay
+readable, the indexes, check-out and occupancy need them.
+
+The key file holds master keys, one per line, which only ever encrypt data keys.
+Every process creates a data key per day, stores it in encryption_keys, encrypted
+with the last master key in the file, and encrypts sign-ins with it; sign_ins.key_id
+says with which. So a new master key (`flask encryption new-key`) takes effect
+without touching any sign-in, and an older one is needed as long as sign-ins from
+its time are kept. `flask prune` deletes the data keys of the days it deletes, which
+makes those sign-ins unreadable in old database dumps, too. `flask backup` archives
+hold the decrypted export under keys of their own, they are only deleted after
+RETENTION_DAYS (see backup.py).
+
+Only export.py and tracing.py decrypt, a chunk of rows at a time: the data keys a
+chunk needs are loaded in one query and kept, so a field costs a few microseconds.
+Sign-ins stored without encryption have no key_id and are read as they are.
+
+Keep the key file out of the database backups. Without it, nobody can read the
+sign-ins, including the Gesundheitsamt.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+import sign_ins
+from db import db
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+FIELDS = (
+    "first_name",
+    "last_name",
+    "street_and_house_number",
+    "plz_and_city",
+    "phone_number",
+)
+
+NONCE_SIZE = 12
+
+table = db.Table(
+    "encryption_keys",
+    db.Column("id", db.Integer, primary_key=True),
+    # The fingerprint of the master key that encrypted this data key
+    db.Column("master_key", db.String(length=16)),
+    db.Column("data_key", db.Text),
+    db.Column("created_at", db.DateTime),
+)
+
+# A decrypted sign-in
+Row = namedtuple("Row", sign_ins.COLUMNS)
+
+# The encrypted fields' positions in sign_ins.COLUMNS, and the associated data that
+# ties the ciphertext to its column
+_POSITIONS = [(sign_ins.COLUMNS.index(field), field.encode()) for field in FIELDS]
+
+
+class MissingKey(Exception):
+    """Sign-ins can't be decrypted with the keys at hand"""
+
+
+class Encryption:
+    def init_app(self, app):
+        app.extensions["encryption"] = _State()
+        app.cli.add_command(encryption_command)
+
+    def enabled(self, app=None):
+        return bool((app or current_app).config["ENCRYPTION_KEY_FILE"])
+
+    def encrypt(self, row, app=None):
+        """The row with its contact data encrypted, or the row itself if disabled"""
+        app = app or current_app
+        if not self.enabled(app):
+            return row
+        key_id, aead = self._data_key(app)
+        encrypted = {**row, "key_id": key_id}
+        for field in FIELDS:
+            value = row.get(field)
+            if value is not None:
+                encrypted[field] = _seal(aead, field.encode(), value.encode())
+        return encrypted
+
+    def decrypt(self, rows):
+        """
+        Rows of select([sign_ins.table]) with their contact data decrypted, as Row
+        tuples without stored_at, tenant and key_id. Needs an app context
+        """
+        keys = self._data_keys({row[-1] for row in rows} - {None})
+        decrypted = []
+        for row in rows:
+            *values, _, _, key_id = row
+            aead = keys.get(key_id)
+            if aead is not None:
+                for position, field in _POSITIONS:
+                    if values[position] is not None:
+                        values[position] = _open(aead, field, values[position]).decode()
+            decrypted.append(Row._make(values))
+        return decrypted
+
+    def forget(self, before):
+        """
+        Deletes the data keys created before `before`, returns how many. Only
+        sign-ins signed in before then were encrypted with them
+        """
+        with db.engine.begin() as connection:
+            return connection.execute(
+                table.delete().where(table.c.created_at < before)
+            ).rowcount
+
+    def _data_key(self, app):
+        state = app.extensions["encryption"]
+        today = date.today()
+        if state.day != today:
+            with state.lock:
+                if state.day != today:
+                    state.data_key = _create_data_key(app)
+                    state.keys[state.data_key[0]] = state.data_key[1]
+                    state.day = today
+        return state.data_key
+
+    def _data_keys(self, key_ids):
+        """The AESGCM instances for the key ids, loaded once per process"""
+        state = current_app.extensions["encryption"]
+        missing = key_ids - state.keys.keys()
+        if not missing:
+            return state.keys
+        with state.lock:
+            master_keys = dict(read_master_keys(current_app.config))
+            with db.engine.connect() as connection:
+                found = connection.execute(
+                    select([table]).where(table.c.id.in_(missing))
+                ).fetchall()
+            for key_id, master_key, data_key, _ in found:
+                key = open_data_key(master_keys, master_key, data_key)
+                state.keys[key_id] = AESGCM(key)
+        missing -= state.keys.keys()
+        if missing:
+            raise MissingKey(f"Data keys {sorted(missing)} were deleted")
+        return state.keys
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day = None
+        # The current (key id, AESGCM) for encrypting
+        self.data_key = None
+        # All data keys used so far, by id
+        self.keys = {}
+
+
+def read_master_keys(config):
+    """The (fingerprint, key) pairs in the key file, the current key last"""
+    path = config["ENCRYPTION_KEY_FILE"]
+    if not path:
+        raise MissingKey("Sign-ins are encrypted, set ENCRYPTION_KEY_FILE")
+    if AESGCM is None:
+        raise MissingKey("Install cryptography to use ENCRYPTION_KEY_FILE")
+    keys = []
+    with open(path, encoding="ascii") as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                key = base64.urlsafe_b64decode(line)
+                if len(key) != 32:
+                    raise ValueError(f"{path} contains a key that isn't 256 bits")
+                keys.append((fingerprint(key), key))
+    if not keys:
+        raise MissingKey(f"{path} contains no key")
+    return keys
+
+
+def fingerprint(master_key):
+    return hashlib.sha256(master_key).hexdigest()[:16]
+
+
+def new_data_key(config):
+    """
+    A new data key, and the fingerprint of the current master key with the data key
+    encrypted by it
+    """
+    master_fingerprint, master_key = read_master_keys(config)[-1]
+    key = AESGCM.generate_key(bit_length=256)
+    return key, master_fingerprint, _seal(AESGCM(master_key), b"data key", key)
+
+
+def open_data_key(master_keys, master_fingerprint, data_key):
+    """Decrypts a data key from new_data_key, master_keys maps fingerprints to keys"""
+    if master_fingerprint not in master_keys:
+        raise MissingKey(f"Master key {master_fingerprint} is not in the key file")
+    return _open(AESGCM(master_keys[master_fingerprint]), b"data key", data_key)
+
+
+def _create_data_key(app):
+    key, master_fingerprint, data_key = new_data_key(app.config)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            key_id = connection.execute(
+                table.insert().values(
+                    master_key=master_fingerprint,
+                    data_key=data_key,
+                    created_at=datetime.now(),
+                )
+            ).inserted_primary_key[0]
+    return key_id, AESGCM(key)
+
+
+def _seal(aead, associated_data, plaintext):
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = aead.encrypt(nonce, plaintext, associated_data)
+    return binascii.b2a_base64(nonce + ciphertext, newline=False).decode("ascii")
+
+
+def _open(aead, associated_data, text):
+    data = binascii.a2b_base64(text)
+    try:
+        plaintext = aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], associated_data)
+    except InvalidTag:
+        raise MissingKey("The data doesn't match its key, or was changed") from None
+    return plaintext
+
+
+@click.group("encryption")
+def encryption_command():
+    """Manage the keys that encrypt the contact data"""
+
+
+@encryption_command.command("new-key")
+@with_appcontext
+def new_key_command():
+    """Add a master key to ENCRYPTION_KEY_FILE, new data keys will use it"""
+    path = current_app.config["ENCRYPTION_KEY_FILE"]
+    if not path:
+        raise click.UsageError("Set ENCRYPTION_KEY_FILE first")
+    if AESGCM is None:
+        raise click.ClickException("Install cryptography first")
+    key = AESGCM.generate_key(bit_length=256)
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    with open(descriptor, "a", encoding="ascii") as file:
+        file.write(base64.urlsafe_b64encode(key).decode("ascii") + "\n")
+    click.echo(f"Added master key {fingerprint(key)} to {path}")
+
+
+encryption = Encryption()
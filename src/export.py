@@ -0,0 +1,181 @@
+"""
+Streams sign-ins out of the database, e.g. when the Gesundheitsamt requests them.
+
+Rows are read through a server-side cursor (on PostgreSQL) in chunks of
+EXPORT_CHUNK_SIZE, decrypted (see encryption.py) and encoded on the fly, so memory
+use does not depend on the number of sign-ins that are exported.
+
+/export only exports the sign-ins of its tenant (see tenants.py), `flask export`
+everyone's unless it is given --tenant.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask import Response, current_app, request, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+import sign_ins
+import tenants
+from auth import token_required
+from db import db
+from encryption import encryption
+
+COLUMNS = sign_ins.COLUMNS
+
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def build_query(first_day=None, last_day=None, location=None):
+    """Select the tenant's sign-ins between first_day and last_day, both inclusive"""
+    table = sign_ins.table
+    query = tenants.restrict(select([table]).order_by(table.c.signed_in_at))
+    if first_day:
+        query = query.where(table.c.signed_in_at >= datetime.combine(first_day, time()))
+    if last_day:
+        query = query.where(
+            table.c.signed_in_at
+            < datetime.combine(last_day + timedelta(days=1), time())
+        )
+    if location is not None:
+        query = query.where(table.c.location == location)
+    return query
+
+
+def iter_rows(query, chunk_size=None):
+    """
+    Yields lists of the decrypted sign-ins that query selects, see build_query. Needs
+    an app context for as long as it is iterated
+    """
+    chunk_size = chunk_size or current_app.config["EXPORT_CHUNK_SIZE"]
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield encryption.decrypt(rows)
+
+
+def encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def encode_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, row)), default=_json_default) + "\n"
+            for row in rows
+        )
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def gzipped(text_chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for text in text_chunks:
+        compressed = compressor.compress(text.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(format, compress=False, **filters):
+    """Yields the encoded sign-ins matching filters, as str or (if compressed) bytes"""
+    encoded = ENCODERS[format](iter_rows(build_query(**filters)))
+    return gzipped(encoded) if compress else encoded
+
+
+def filename(format, compress, first_day, last_day):
+    first = first_day.isoformat() if first_day else "start"
+    last = (last_day or date.today()).isoformat()
+    return f"corona-sign-in-{first}-to-{last}.{format}" + (".gz" if compress else "")
+
+
+@token_required("ADMIN_TOKEN")
+def export_view():
+    try:
+        first_day = _parse_date(request.args.get("from"))
+        last_day = _parse_date(request.args.get("to"))
+    except ValueError:
+        return "Dates need to be in the format YYYY-MM-DD", 400
+    format = request.args.get("format", "csv")
+    if format not in ENCODERS:
+        return f'Unknown format "{format}"', 400
+    compress = request.args.get("gzip") not in (None, "", "0", "false")
+
+    body = stream_export(
+        format,
+        compress,
+        first_day=first_day,
+        last_day=last_day,
+        location=request.args.get("location"),
+    )
+    name = filename(format, compress, first_day, last_day)
+    return Response(
+        stream_with_context(body),
+        mimetype="application/gzip" if compress else MIMETYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@click.command("export")
+@click.option("--from", "first_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--to", "last_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--location", help="Only export sign-ins for this location")
+@click.option("--format", "format", type=click.Choice(sorted(ENCODERS)), default="csv")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output")
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write to this file instead of stdout. Use '.' for the default file name",
+)
+@with_appcontext
+@tenants.tenant_option
+def export_command(first_day, last_day, location, format, compress, output):
+    """Export sign-ins, e.g. for the Gesundheitsamt"""
+    first_day = first_day.date() if first_day else None
+    last_day = last_day.date() if last_day else None
+    if output == ".":
+        output = filename(format, compress, first_day, last_day)
+
+    body = stream_export(
+        format, compress, first_day=first_day, last_day=last_day, location=location
+    )
+    with click.open_file(output or "-", "wb") as out:
+        for chunk in body:
+            out.write(chunk if compress else chunk.encode("utf-8"))
+
+
+def init_app(app):
+    app.add_url_rule("/export", "export", export_view)
+    app.cli.add_command(export_command)
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _drain(buffer):
+    value = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {value!r}")
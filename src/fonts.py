@@ -0,0 +1,96 @@
+"""
+Self-hosted web fonts.
+
+`flask assets fonts` downloads Monoton and Montserrat from the Google Fonts
+repository, cuts the weights we use out of Montserrat's variable font and reduces
+both to the characters we need. The resulting WOFF2 files end up in static/fonts,
+next to the fonts' license. The fonts of PRINTED are also saved as TTF for
+`flask qr`, because Pillow only reads WOFF2 if its FreeType was built with brotli.
+The download needs network access, so it runs when the docker image is built.
+Guests never talk to a third party.
+
+Needs fonttools, which is only installed in the docker image, and brotli.
+"""
+import io
+import os
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+
+SOURCE = "https://github.com/google/fonts/raw/main/ofl"
+
+Font = namedtuple("Font", "name source weight characters")
+
+
+def _characters(*ranges):
+    return "".join(chr(c) for (first, last) in ranges for c in range(first, last + 1))
+
+
+# Headlines are uppercased in CSS, so we need no lowercase letters for Monoton
+HEADLINE = _characters((0x20, 0x5A)) + "ÄÖÜẞ–…"  # Space to Z
+
+# Montserrat is also used for the inputs, so this needs to cover guests' names
+TEXT = (
+    _characters(
+        (0x20, 0x7E),  # Basic Latin
+        (0xA0, 0xFF),  # Latin-1 Supplement, incl. German umlauts
+        (0x100, 0x17F),  # Latin Extended-A, e.g. Polish and Turkish names
+    )
+    + "ẞ‐–—‘’‚“”„…€"
+)
+
+FONTS = (
+    Font("monoton-400", "monoton/Monoton-Regular.ttf", None, HEADLINE),
+    Font("montserrat-300", "montserrat/Montserrat[wght].ttf", 300, TEXT),
+    Font("montserrat-700", "montserrat/Montserrat[wght].ttf", 700, TEXT),
+    Font("montserrat-800", "montserrat/Montserrat[wght].ttf", 800, TEXT),
+)
+
+# Also saved as TTF, see qr.py
+PRINTED = ("montserrat-700",)
+
+LICENSES = {"monoton": "monoton/OFL.txt", "montserrat": "montserrat/OFL.txt"}
+
+
+def build_fonts(folder, echo=lambda message: None, download=None):
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+    from fontTools.varLib import instancer
+
+    download = download or _download
+    folder = os.path.join(folder, "fonts")
+    os.makedirs(folder, exist_ok=True)
+
+    for family, path in LICENSES.items():
+        with open(os.path.join(folder, f"{family}-OFL.txt"), "wb") as f:
+            f.write(download(path))
+
+    sources = {}
+    for font in FONTS:
+        if font.source not in sources:
+            sources[font.source] = download(font.source)
+        ttf = TTFont(io.BytesIO(sources[font.source]))
+        if font.weight is not None:
+            ttf = instancer.instantiateVariableFont(ttf, {"wght": font.weight})
+
+        options = subset.Options()
+        options.flavor = "woff2"
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(text=font.characters)
+        subsetter.subset(ttf)
+
+        if font.name in PRINTED:
+            target = os.path.join(folder, f"{font.name}.ttf")
+            ttf.flavor = None
+            ttf.save(target)
+            echo(f"fonts/{font.name}.ttf: {os.path.getsize(target)} bytes")
+        target = os.path.join(folder, f"{font.name}.woff2")
+        ttf.flavor = "woff2"
+        ttf.save(target)
+        echo(f"fonts/{font.name}.woff2: {os.path.getsize(target)} bytes")
+
+
+def _download(path):
+    url = f"{SOURCE}/{urllib.parse.quote(path)}"
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
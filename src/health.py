@@ -0,0 +1,26 @@
+"""
+/health tells load balancers and monitoring whether the application can reach the
+database, together with the state of the connection pool.
+"""
+from flask import jsonify
+from sqlalchemy import text
+
+from db import db
+from pool import pool_status
+
+
+def health_view():
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        database = "ok"
+    except Exception as e:
+        database = f"error: {type(e).__name__}"
+    response = jsonify(database=database, pool=pool_status(db.engine.pool))
+    response.status_code = 200 if database == "ok" else 503
+    response.cache_control.no_store = True
+    return response
+
+
+def init_app(app):
+    app.add_url_rule("/health", "health", health_view)
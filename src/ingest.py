@@ -0,0 +1,269 @@
+"""
+Writes sign-ins to the database, either directly or through a write-behind queue.
+
+In the default "sync" mode every sign-in is inserted and committed within the
+request. In "queued" mode, rows are appended to a spill file (fsync'd, so they
+survive a crash of the process) and put on a bounded in-memory queue. The fsync
+happens outside the queue's lock, and one fsync covers the rows of every thread that
+waited for it, so concurrent sign-ins share it (group commit). A background
+thread writes them to the database as multi-row inserts once INGEST_BATCH_SIZE rows
+are waiting or INGEST_FLUSH_INTERVAL seconds have passed. If the queue is full, the
+sign-in is written synchronously instead.
+
+Delivery is at-least-once: if the process dies after a batch was committed but
+before its spill file was removed, that batch is inserted again on the next start.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+import sign_ins
+from db import db
+from metrics import phase
+from partitions import partitions
+
+logger = logging.getLogger(__name__)
+
+
+class Ingest:
+    def init_app(self, app):
+        if app.config["INGEST_MODE"] == "queued":
+            queue = WriteBehindQueue(
+                app,
+                max_size=app.config["INGEST_QUEUE_SIZE"],
+                batch_size=app.config["INGEST_BATCH_SIZE"],
+                flush_interval=app.config["INGEST_FLUSH_INTERVAL"],
+                spill_dir=app.config["INGEST_SPILL_DIR"],
+            )
+        elif app.config["INGEST_MODE"] == "sync":
+            queue = None
+        else:
+            raise ValueError(f'Unknown INGEST_MODE "{app.config["INGEST_MODE"]}"')
+        app.extensions["ingest"] = queue
+
+    def submit(self, row):
+        """Store a sign-in. Must be called within a request or app context"""
+        queue = current_app.extensions["ingest"]
+        if queue is not None:
+            with phase("queue"):
+                if queue.put(row):
+                    return
+        partitions.ensure()
+        with phase("execute"):
+            db.session.execute(sign_ins.table.insert().values(**row))
+        with phase("commit"):
+            db.session.commit()
+
+
+ingest = Ingest()
+
+
+class WriteBehindQueue:
+    def __init__(self, app, max_size, batch_size, flush_interval, spill_dir):
+        self.app = app
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._spill = None
+        self._unflushed = []
+        self._buffered = 0
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+        os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def size(self):
+        """Number of rows that are accepted, but not committed to the database yet"""
+        return self._buffered
+
+    def put(self, row) -> bool:
+        """Queue a row, returns False if the queue is full"""
+        with self._condition:
+            self._start_in_this_process()
+            if self._buffered >= self.max_size:
+                return False
+            spill = self._spill
+            number = spill.write(json.dumps(row, default=_encode_datetime) + "\n")
+            self._pending.append(row)
+            self._buffered += 1
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        spill.sync(number)
+        return True
+
+    def flush(self):
+        """Write everything that is queued right now, in the calling thread"""
+        with self._condition:
+            self._rotate()
+        self._write_unflushed()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2 * self.flush_interval)
+
+    def recover(self):
+        """Insert rows left in the spill files of processes that are gone"""
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "ingest-*.ndjson"))):
+            try:
+                spill = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with spill:
+                try:
+                    fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Someone is still writing to this file
+                if os.fstat(spill.fileno()).st_nlink == 0:
+                    continue  # Already recovered by someone else
+                rows = [
+                    json.loads(line, object_hook=_decode_datetime) for line in spill
+                ]
+                if rows:
+                    self._insert(rows)
+                    logger.info("Recovered %d sign-ins from %s", len(rows), path)
+                os.unlink(path)
+
+    def _start_in_this_process(self):
+        # Threads and open spill files don't survive a fork, so every worker process
+        # starts its own flusher the first time it queues something.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = []
+        self._unflushed = []
+        self._buffered = 0
+        self._spill = None
+        self._open_spill()
+        self._thread = threading.Thread(
+            target=self._run, name="ingest-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _open_spill(self):
+        path = os.path.join(
+            self.spill_dir,
+            f"ingest-{os.getpid()}-{datetime.now():%Y%m%d%H%M%S%f}.ndjson",
+        )
+        self._spill = Spill(path)
+
+    def _rotate(self):
+        """Hand the pending rows and their spill file over to the flusher"""
+        if not self._pending:
+            return
+        self._unflushed.append((self._pending, self._spill))
+        self._pending = []
+        self._open_spill()
+
+    def _run(self):
+        try:
+            self.recover()
+        except Exception:
+            logger.exception("Could not recover spilled sign-ins")
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                self._rotate()
+                stopping = self._stopping
+            self._write_unflushed()
+            if stopping:
+                self._remove_empty_spill()
+                return
+
+    def _remove_empty_spill(self):
+        with self._condition:
+            if not self._pending:
+                self._spill.remove()
+
+    def _write_unflushed(self):
+        with self._write_lock:
+            while self._unflushed:
+                rows, spill = self._unflushed[0]
+                try:
+                    self._insert(rows)
+                except Exception:
+                    # The rows are still in the spill file and will be retried
+                    logger.exception("Could not write %d queued sign-ins", len(rows))
+                    return
+                spill.remove()
+                self._unflushed.pop(0)
+                with self._condition:
+                    self._buffered -= len(rows)
+
+    def _insert(self, rows):
+        # A multi-row insert needs the same keys in every row
+        columns = sign_ins.INSERT_COLUMNS
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+        partitions.ensure(self.app)
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                for start in range(0, len(rows), self.batch_size):
+                    chunk = rows[start : start + self.batch_size]
+                    connection.execute(sign_ins.table.insert().values(chunk))
+
+
+class Spill:
+    """A spill file of a WriteBehindQueue, written under the queue's lock"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._written = 0
+        self._synced = 0
+        self._sync_lock = threading.Lock()
+
+    def write(self, line):
+        """Appends a line, returns its number for sync"""
+        self._file.write(line)
+        self._file.flush()
+        self._written += 1
+        return self._written
+
+    def sync(self, number):
+        """Returns once the lines up to number are on disk"""
+        with self._sync_lock:
+            if self._synced >= number:
+                return  # Synced together with another thread's line
+            if self._file.closed:
+                return  # Removed once the lines were in the database
+            written = self._written
+            os.fsync(self._file.fileno())
+            self._synced = written
+
+    def remove(self):
+        with self._sync_lock:
+            os.unlink(self.path)
+            self._file.close()
+
+
+def _encode_datetime(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot serialize {value!r}")
+
+
+def _decode_datetime(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
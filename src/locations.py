@@ -0,0 +1,156 @@
+"""
+The locations guests choose from, configured by LOCATIONS or LOCATIONS_FILE.
+
+LOCATIONS_FILE has one location per line, lines starting with # are comments. Every
+process looks at the file's modification time at most every CHECK_INTERVAL seconds,
+when a guest loads or sends the form, and reads it again when it changed. So a
+location can be added or renamed without a restart, and no request queries
+anything. Write the file at once (e.g. by renaming a new one over it, like
+kubernetes does with a ConfigMap), a half written file would be read as it is.
+
+Every version of the file becomes a new Locations, which a request uses from start
+to end. Forms that were loaded before a location was removed or renamed can still
+be sent for RETIRED_SECONDS, the sign-in is stored with the old name.
+"""
+import logging
+import os
+import threading
+import time
+from base64 import b64encode
+
+from flask import current_app
+
+import tenants
+
+# Seconds between checks whether LOCATIONS_FILE changed
+CHECK_INTERVAL = 2
+# Seconds a removed location is still accepted from forms that show it
+RETIRED_SECONDS = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class Locations:
+    """
+    The locations guests can choose from, together with the values used in the form.
+
+    The values are the base64 encoded location names. This is built once per list of
+    locations, so handling the location in a request only needs dictionary lookups.
+    Retired locations are found by their value, but aren't choices anymore.
+    """
+
+    def __init__(self, labels, retired=()):
+        self.labels = tuple(labels)
+        self._value_by_label = {label: _value(label) for label in self.labels}
+        self._label_by_value = {
+            value: label for (label, value) in self._value_by_label.items()
+        }
+        for label in retired:
+            self._label_by_value.setdefault(_value(label), label)
+        self.choices = (("", "Bitte Auswählen"),) + tuple(
+            (value, label) for (label, value) in self._value_by_label.items()
+        )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def value_for(self, label: str) -> str:
+        try:
+            return self._value_by_label[label]
+        except KeyError:
+            raise ValueError(f'Location "{label}" not found')
+
+    def label_for(self, value: str) -> str:
+        try:
+            return self._label_by_value[value]
+        except KeyError:
+            raise ValueError(f'Location value "{value}" not found')
+
+    def has_value(self, value: str) -> bool:
+        return value in self._label_by_value
+
+
+class WatchedFile:
+    """The Locations of a LOCATIONS_FILE, replaced when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.locations = None
+        self._lock = threading.Lock()
+        self._checked = None
+        # The file's (modification time, size, inode) when it was read
+        self._version = None
+        # Removed labels, and until when they are accepted
+        self._retired = {}
+
+    def get(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= CHECK_INTERVAL:
+            with self._lock:
+                if self._checked is None or now - self._checked >= CHECK_INTERVAL:
+                    self._check(now)
+                    self._checked = now
+        return self.locations
+
+    def _check(self, now):
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            labels = read_locations(self.path) if version != self._version else None
+        except OSError:
+            if self._version is None:
+                raise
+            logger.exception("Could not read %s, keeping the locations", self.path)
+            return
+        expired = [label for label, until in self._retired.items() if until <= now]
+        if labels is None and not expired:
+            return
+        for label in expired:
+            del self._retired[label]
+        if labels is None:
+            labels = self.locations.labels if self.locations else ()
+        else:
+            self._version = version
+            for label in self.locations.labels if self.locations else ():
+                if label not in labels:
+                    self._retired[label] = now + RETIRED_SECONDS
+            for label in labels:
+                self._retired.pop(label, None)
+        self.locations = Locations(labels, self._retired) if labels else None
+
+
+def read_locations(path):
+    """The labels in a LOCATIONS_FILE"""
+    with open(path, encoding="utf-8") as file:
+        lines = (line.strip() for line in file)
+        return tuple(
+            dict.fromkeys(line for line in lines if line and not line.startswith("#"))
+        )
+
+
+def get_locations(app=None):
+    """
+    Returns the Locations for the LOCATIONS or LOCATIONS_FILE config of the app or
+    the current tenant (see tenants.py), or None if there are none.
+
+    The result is cached until the LOCATIONS config is replaced or the file changes.
+    """
+    app = app or current_app
+    config = tenants.config(app)
+    cache = tenants.cache(app)
+    path = config["LOCATIONS_FILE"]
+    if path:
+        watched = cache.get("locations_file")
+        if watched is None or watched.path != path:
+            watched = cache["locations_file"] = WatchedFile(path)
+        return watched.get()
+    configured = config["LOCATIONS"]
+    cached = cache.get("locations")
+    if cached is None or cached[0] is not configured:
+        cached = (configured, Locations(configured) if configured else None)
+        cache["locations"] = cached
+    return cached[1]
+
+
+def _value(label):
+    return b64encode(label.encode("utf-8")).decode("utf-8")
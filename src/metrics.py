@@ -0,0 +1,240 @@
+"""
+Metrics in the Prometheus text format, served at /metrics.
+
+Every request is timed per endpoint, and the sign-in form additionally per phase
+(validate, execute, commit, queue, render), so we can see where the time of a
+sign-in goes. Successful sign-ins are counted per location.
+
+Recording happens on every request, so it must not make them slower: every thread
+writes to its own counters and only /metrics adds them up, so threads never wait
+for each other. The pool and queue gauges are read when /metrics is requested.
+
+With gunicorn, every worker process has its own metrics and /metrics returns those
+of the worker that handles the request.
+
+/metrics needs METRICS_TOKEN, see auth.py.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+
+from auth import token_required
+from db import db
+from occupancy import occupancy
+from pool import pool_status
+
+# Seconds. Most sign-ins take a few milliseconds, timeouts take seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        REGISTRY.append(self)
+
+    def _values(self):
+        """The values of the current thread, {label values: value}"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append(values)
+            return values
+
+    def _collect(self):
+        with self._lock:
+            shards = list(self._shards)
+        for values in shards:
+            # list() doesn't release the GIL, so the owning thread can't change
+            # the dict while it is copied
+            yield from list(values.items())
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        values = self._values()
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def _samples(self):
+        totals = {}
+        for label_values, value in self._collect():
+            totals[label_values] = totals.get(label_values, 0) + value
+        for label_values, value in sorted(totals.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, seconds, *label_values):
+        values = self._values()
+        counts = values.get(label_values)
+        if counts is None:
+            # One count per bucket, then +Inf and the sum
+            counts = values[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def _samples(self):
+        totals = {}
+        for label_values, counts in self._collect():
+            total = totals.setdefault(label_values, [0] * len(counts))
+            for i, count in enumerate(list(counts)):
+                total[i] += count
+        for label_values, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), label_values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge(_Metric):
+    """A value that is read from `read` when the metrics are exposed"""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels, read):
+        super().__init__(name, help, labels)
+        self.read = read
+
+    def _samples(self):
+        for label_values, value in sorted(self.read().items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _pool_values():
+    return {(key,): value for key, value in pool_status(db.engine.pool).items()}
+
+
+def _queue_values():
+    queue = current_app.extensions["ingest"]
+    return {(): queue.size if queue is not None else 0}
+
+
+def _occupancy_values():
+    return {(label or "",): present for label, present in occupancy.present().items()}
+
+
+REGISTRY = []
+
+requests_total = Counter(
+    "corona_sign_in_requests_total",
+    "Requests by endpoint, method and status code",
+    ("endpoint", "method", "status"),
+)
+request_seconds = Histogram(
+    "corona_sign_in_request_seconds",
+    "Time spent handling requests",
+    ("endpoint", "method"),
+)
+phase_seconds = Histogram(
+    "corona_sign_in_phase_seconds",
+    "Time spent in the phases of handling a request",
+    ("endpoint", "phase"),
+)
+sign_ins_total = Counter(
+    "corona_sign_in_sign_ins_total", "Stored sign-ins by location", ("location",)
+)
+errors_total = Counter("corona_sign_in_errors_total", "Internal server errors")
+rate_limited_total = Counter(
+    "corona_sign_in_rate_limited_total",
+    "Sign-ins rejected by the per address or global limit, see ratelimit.py",
+    ("scope",),
+)
+duplicates_total = Counter(
+    "corona_sign_in_duplicates_total", "Sign-ins that were sent again, see dedup.py"
+)
+Gauge(
+    "corona_sign_in_db_pool",
+    "State of the database connection pool, see pool.py",
+    ("stat",),
+    _pool_values,
+)
+Gauge(
+    "corona_sign_in_ingest_queue_size",
+    "Sign-ins that are queued, but not stored yet",
+    (),
+    _queue_values,
+)
+Gauge(
+    "corona_sign_in_occupancy",
+    "Guests who are present, by location. See occupancy.py",
+    ("location",),
+    _occupancy_values,
+)
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the current request, e.g. `with phase("validate"): ...`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        endpoint = request.endpoint if has_request_context() else None
+        phase_seconds.observe(time.perf_counter() - started, endpoint or "", name)
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.get("metrics_started")
+    if started is not None:
+        endpoint = request.endpoint or ""
+        request_seconds.observe(time.perf_counter() - started, endpoint, request.method)
+        requests_total.inc(endpoint, request.method, response.status_code)
+    return response
+
+
+@token_required("METRICS_TOKEN")
+def metrics_view():
+    lines = [line for metric in REGISTRY for line in metric.expose()]
+    response = Response("\n".join(lines) + "\n", mimetype="text/plain")
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    response.cache_control.no_store = True
+    return response
+
+
+def init_app(app):
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
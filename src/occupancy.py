@@ -0,0 +1,266 @@
+"""
+How many guests are at each location right now, without counting sign_ins.
+
+Guests are present from signing in until signed_out_at (see checkout.py). For every
+location there is a ring of counters, one per minute of the next AUTO_CHECKOUT
+minutes, that count the guests leaving in that minute. A sign-in adds one to the
+minute the guest will be checked out, checking out early takes it away again, and
+the guests present are the sum of the minutes that haven't passed yet. Passed
+minutes are reused for new ones, so nothing needs to be cleaned up.
+
+The counters are in OCCUPANCY_FILE, so all processes of a server share them (see
+shared.py). The first process that opens a new file fills it from the database.
+Without OCCUPANCY_FILE, every process has its own counters.
+
+/occupancy returns the counts as JSON, for the door staff like /staff (see staff.py).
+With CAPACITY set, sign-ins at a full location are rejected. The check and the count
+happen under one lock, so concurrent sign-ins can't exceed the capacity.
+
+Every tenant (see tenants.py) has its own counters, in OCCUPANCY_FILE.<id>. When
+LOCATIONS_FILE changes (see locations.py), every process switches to new counters,
+filled from the database, in a file of their own: the previous file is still
+mapped by processes that haven't seen the change yet.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import zlib
+from datetime import datetime
+
+from flask import current_app, jsonify
+from sqlalchemy import TIMESTAMP, cast, func, select
+
+import shared
+import sign_ins
+import tenants
+from auth import token_required
+from db import db
+from locations import get_locations
+from shared import SharedMemory
+
+# The first value says whether the counters were filled from the database
+FILLED = 0
+
+
+class Counters:
+    """
+    Guests leaving per location and minute, for `slots` minutes ahead.
+
+    Minutes are counted since the epoch. Every slot holds the minute it counts and
+    the number of guests.
+    """
+
+    def __init__(self, path, labels, slots):
+        # Sign-ins without a location are counted as None
+        self.labels = (None, *labels)
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        self.slots = slots
+        self._memory = SharedMemory(
+            path,
+            (1 + len(self.labels) * slots * 2) * 8,
+            ["occupancy", list(labels), slots],
+        )
+        self._values = self._memory.data.cast("q")
+        self.locked = self._memory.locked
+
+    @property
+    def filled(self):
+        return bool(self._values[FILLED])
+
+    def fill(self, leaving, now):
+        """Replaces all counters. Call with the lock held"""
+        self._values[:] = memoryview(bytes(len(self._values) * 8)).cast("q")
+        for (label, minute), count in leaving.items():
+            if label in self._index:
+                self._add(label, self._clamp(minute, now), count)
+        self._values[FILLED] = 1
+
+    def add(self, label, minute, now, capacity=None):
+        """Counts a guest leaving in minute, unless capacity is reached"""
+        if label not in self._index:
+            return True  # Not a configured location anymore
+        minute = self._clamp(minute, now)
+        with self.locked():
+            if capacity is not None and self._present(label, now) >= capacity:
+                return False
+            self._add(label, minute, 1)
+        return True
+
+    def remove(self, label, minute, now):
+        if label not in self._index:
+            return
+        minute = self._clamp(minute, now)
+        with self.locked():
+            offset = self._offset(label, minute)
+            if self._values[offset] == minute and self._values[offset + 1] > 0:
+                self._values[offset + 1] -= 1
+
+    def present(self, label, now):
+        with self.locked():
+            return self._present(label, now)
+
+    def _add(self, label, minute, count):
+        offset = self._offset(label, minute)
+        if self._values[offset] != minute:
+            # A minute that has passed
+            self._values[offset] = minute
+            self._values[offset + 1] = 0
+        self._values[offset + 1] += count
+
+    def _present(self, label, now):
+        start = 1 + self._index[label] * self.slots * 2
+        values = self._values[start : start + self.slots * 2]
+        return sum(
+            count for minute, count in zip(values[::2], values[1::2]) if minute > now
+        )
+
+    def _clamp(self, minute, now):
+        # Longer stays, e.g. imported ones, are counted until the last slot
+        return min(minute, now + self.slots - 1)
+
+    def _offset(self, label, minute):
+        return 1 + (self._index[label] * self.slots + minute % self.slots) * 2
+
+
+class Occupancy:
+    def init_app(self, app):
+        app.extensions["occupancy"] = _State()
+        app.add_url_rule("/occupancy", "occupancy", occupancy_view)
+
+    def admit(self, location, signed_out_at, app=None):
+        """
+        Counts a guest who signs in now and leaves at signed_out_at. Returns False
+        and doesn't count them if the location is full
+        """
+        app = app or current_app
+        counters = self._counters(app)
+        return counters.add(
+            location or None,
+            _minute(signed_out_at),
+            _current_minute(),
+            capacity_for(location, tenants.config(app)),
+        )
+
+    def leave(self, location, signed_out_at, app=None):
+        """A guest who was counted with signed_out_at left now, or never came"""
+        counters = self._counters(app or current_app)
+        counters.remove(location or None, _minute(signed_out_at), _current_minute())
+
+    def present(self, app=None):
+        """The number of guests per location label, None for those without one"""
+        app = app or current_app
+        counters = self._counters(app)
+        now = _current_minute()
+        labels = counters.labels[1:] if get_locations(app) else (None,)
+        return {label: counters.present(label, now) for label in labels}
+
+    def snapshot(self, app=None):
+        """The guests present and the capacity of every location, for the JSON APIs"""
+        app = app or current_app
+        config = tenants.config(app)
+        return [
+            {
+                "location": label,
+                "present": present,
+                "capacity": capacity_for(label, config),
+            }
+            for label, present in self.present(app).items()
+        ]
+
+    def _counters(self, app):
+        # Created here for tenants, they only need counters once they are used
+        state = tenants.cache(app).setdefault("occupancy", _State())
+        locations = get_locations(app)
+        labels = locations.labels if locations else ()
+        # Compared by labels, locations.py also builds new Locations when only the
+        # retired ones change. Processes forked by gunicorn need their own file
+        # descriptor for flock
+        key = (labels, os.getpid())
+        if state.key != key:
+            with state.lock:
+                if state.key != key:
+                    counters = Counters(
+                        _path(app, labels), labels, app.config["AUTO_CHECKOUT"] + 2
+                    )
+                    with counters.locked():
+                        if not counters.filled:
+                            counters.fill(_leaving(app), _current_minute())
+                    state.counters = counters
+                    state.key = key
+        return state.counters
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key = None
+        self.counters = None
+
+
+def reset(config):
+    """Makes the first process that uses the counters fill them from the database"""
+    shared.remove(config.OCCUPANCY_FILE)
+    if config.OCCUPANCY_FILE:
+        # Those of the tenants and of the versions of LOCATIONS_FILE
+        for path in glob.glob(glob.escape(config.OCCUPANCY_FILE) + ".*"):
+            shared.remove(path)
+
+
+def capacity_for(location, config):
+    """How many guests may be at the location at once, or None"""
+    capacity = config["CAPACITY"]
+    if isinstance(capacity, dict):
+        return capacity.get(location)
+    return capacity
+
+
+def _path(app, labels):
+    path = tenants.path(app.config["OCCUPANCY_FILE"])
+    if path and tenants.config(app)["LOCATIONS_FILE"]:
+        path += ".{:08x}".format(zlib.crc32(json.dumps(labels).encode()))
+    return path
+
+
+def _leaving(app):
+    """The guests present according to the database, by label and leaving minute"""
+    now = datetime.now()
+    table = sign_ins.table
+    query = select([table.c.location, table.c.signed_out_at]).where(
+        table.c.signed_out_at > now
+    )
+    # Before the app context is pushed, which has a g of its own
+    query = tenants.restrict(query)
+    leaving = {}
+    with app.app_context():
+        with db.engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                # Uses the stays' GiST index (see tracing.py)
+                stay = func.tsrange(table.c.signed_in_at, table.c.signed_out_at)
+                query = query.where(stay.op("@>")(cast(now, TIMESTAMP)))
+            # Elsewhere all sign-ins are read, imported stays can be longer than
+            # AUTO_CHECKOUT. This only happens when the counters are filled
+            for location, signed_out_at in connection.execute(query):
+                key = (location or None, _minute(signed_out_at))
+                leaving[key] = leaving.get(key, 0) + 1
+    return leaving
+
+
+def _minute(when):
+    """The minute in which someone leaving at `when` is gone"""
+    return math.ceil(when.timestamp() / 60)
+
+
+def _current_minute():
+    return math.floor(datetime.now().timestamp() / 60)
+
+
+@token_required("STAFF_TOKEN")
+def occupancy_view():
+    response = jsonify(locations=occupancy.snapshot())
+    response.cache_control.no_store = True
+    return response
+
+
+occupancy = Occupancy()
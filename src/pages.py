@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import Response, current_app, render_template, request
+
+import tenants
+
+
+class CachedPage:
+    """
+    A page whose content only changes between deployments.
+
+    It is rendered (and compressed) on the first request and then served from
+    memory, with an ETag and Last-Modified header so browsers can revalidate it with
+    a 304 response. Every tenant (see tenants.py) gets its own rendering, one for
+    its hosts and one for its path prefix, since the page's links differ.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._lock = threading.Lock()
+        # By tenant id and path prefix
+        self._rendered = {}
+
+    def response(self):
+        body, compressed, etag, last_modified = self._render()
+        if request.accept_encodings["gzip"]:
+            response = Response(compressed, mimetype="text/html")
+            response.headers["Content-Encoding"] = "gzip"
+            response.set_etag(etag + "-gzip")
+        else:
+            response = Response(body, mimetype="text/html")
+            response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["PAGE_MAX_AGE"]
+        return response.make_conditional(request)
+
+    def _render(self):
+        key = (tenants.current_id(), request.script_root)
+        rendered = self._rendered.get(key)
+        if rendered is not None and not current_app.templates_auto_reload:
+            return rendered
+        with self._lock:
+            body = render_template(self.template).encode("utf-8")
+            rendered = self._rendered[key] = (
+                body,
+                gzip.compress(body, compresslevel=9, mtime=0),
+                hashlib.sha256(body).hexdigest()[:32],
+                _templates_last_modified(),
+            )
+            return rendered
+
+
+def _templates_last_modified():
+    # Every worker process renders the page itself, so this needs to be the same for
+    # all of them. The rendering time would not be.
+    folder = os.path.join(current_app.root_path, current_app.template_folder)
+    newest = max(
+        os.path.getmtime(os.path.join(folder, name)) for name in os.listdir(folder)
+    )
+    return datetime.fromtimestamp(int(newest), timezone.utc)
@@ -0,0 +1,147 @@
+"""
+Daily partitions for sign_ins on PostgreSQL.
+
+This is opt-in: set SIGN_INS_STORAGE to "partitioned" before running the migration
+that turns sign_ins into a table partitioned by the day of signed_in_at. Whether
+the table is partitioned is detected at runtime, so on SQLite or with the plain
+table everything here does nothing.
+
+PostgreSQL routes inserts into the right partition by itself, we only need to make
+sure the partitions exist. They are created PARTITION_DAYS_AHEAD days in advance,
+and a default partition catches everything else. Retention can then drop whole
+partitions instead of deleting rows.
+"""
+import logging
+import re
+import threading
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import text
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^sign_ins_p(\d{8})$")
+
+
+def partition_name(day: date) -> str:
+    return f"sign_ins_p{day:%Y%m%d}"
+
+
+def partition_day(name: str):
+    match = PARTITION_NAME.match(name)
+    return datetime.strptime(match.group(1), "%Y%m%d").date() if match else None
+
+
+class Partitions:
+    def init_app(self, app):
+        app.extensions["partitions"] = _State()
+
+    def is_partitioned(self, app=None) -> bool:
+        return self._ensure(app or current_app).partitioned
+
+    def ensure(self, app=None):
+        """Make sure the partitions for today and the next days exist. Cheap to call"""
+        self._ensure(app or current_app)
+
+    def _ensure(self, app):
+        state = app.extensions["partitions"]
+        today = date.today()
+        if state.covered_until is not None and today < state.covered_until:
+            return state
+        with state.lock:
+            if state.covered_until is not None and today < state.covered_until:
+                return state
+            with app.app_context():
+                state.partitioned = _detect(db.engine)
+                if state.partitioned:
+                    days = app.config["PARTITION_DAYS_AHEAD"]
+                    create_partitions(db.engine, today, today + timedelta(days=days))
+                    # Check again once half of the partitions ahead are used up
+                    state.covered_until = today + timedelta(days=max(days // 2, 1))
+                else:
+                    state.covered_until = date.max
+        return state
+
+    def drop_before(self, before: date, dry_run=False):
+        """
+        Drops the partitions that only contain days before `before`.
+
+        Yields (partition name, rows, seconds) for every partition.
+        """
+        if not self.is_partitioned():
+            return
+        with db.engine.connect() as connection:
+            names = [
+                row[0]
+                for row in connection.execute(
+                    text(
+                        "SELECT child.relname FROM pg_inherits "
+                        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                        "WHERE pg_inherits.inhparent = 'sign_ins'::regclass "
+                        "ORDER BY child.relname"
+                    )
+                )
+            ]
+        for name in names:
+            day = partition_day(name)
+            if day is None or day >= before:
+                continue
+            started = clock.monotonic()
+            with db.engine.begin() as connection:
+                rows = connection.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+                if not dry_run:
+                    connection.execute(
+                        text(f"ALTER TABLE sign_ins DETACH PARTITION {name}")
+                    )
+                    connection.execute(text(f"DROP TABLE {name}"))
+            yield name, rows, clock.monotonic() - started
+
+
+partitions = Partitions()
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.partitioned = False
+        self.covered_until = None
+
+
+def _detect(engine) -> bool:
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as connection:
+        return bool(
+            connection.execute(
+                text(
+                    "SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass('sign_ins')"
+                )
+            ).scalar()
+        )
+
+
+def create_partitions(engine, first_day: date, last_day: date):
+    """Create the partitions for first_day to last_day (inclusive)"""
+    day = first_day
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        while day <= last_day:
+            start = datetime.combine(day, time())
+            end = start + timedelta(days=1)
+            try:
+                connection.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {partition_name(day)} "
+                        "PARTITION OF sign_ins FOR VALUES FROM (:start) TO (:end)"
+                    ).bindparams(start=start, end=end)
+                )
+            except Exception:
+                # Most likely the default partition already has rows for that day.
+                # They are still stored, just not in their own partition.
+                logger.exception("Could not create partition for %s", day)
+            day += timedelta(days=1)
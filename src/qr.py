@@ -0,0 +1,219 @@
+"""
+QR codes that open the sign-in form with a location chosen, e.g. for table tents.
+
+/qr/<location> returns the code of BASE_URL?location=<location> as SVG, or as PNG
+with ?format=png. ?scale= sets the pixels (or SVG units) per module. The URL never
+comes from the request (e.g. its Host header), so nobody can make the server hand
+out codes that lead elsewhere. Without BASE_URL, there are no codes. A tenant's
+BASE_URL is the server's with its path prefix, or its own (see tenants.py).
+
+Renders are kept in an LRU cache of CACHE_SIZE by URL, format and scale, so a
+location's code is rendered once per size. Only configured locations and scales up
+to MAX_SCALE have a code, so requests can't fill the cache with anything else.
+
+`flask qr` writes a printable PDF with a code and the name of every location,
+CODES_PER_PAGE per A4 page, for BASE_URL or the URL it is given. The codes are
+rendered in --jobs processes, one per CPU by default. With --directory, it also
+writes a file with the code of every location.
+
+Needs segno, and Pillow for PNG and PDF.
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlencode
+
+import click
+from flask import Response, current_app, request
+from flask.cli import with_appcontext
+from werkzeug.exceptions import NotFound
+
+import tenants
+from locations import get_locations
+
+try:
+    import segno
+except ImportError:
+    segno = None
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# Renders kept in memory, by URL, format and scale
+CACHE_SIZE = 256
+DEFAULT_SCALE = 10
+MAX_SCALE = 40
+# Codes still work when 15% of them are covered or dirty
+ERROR_CORRECTION = "m"
+
+MIMETYPES = {"svg": "image/svg+xml", "png": "image/png"}
+
+# A4 at 300 dpi, in pixels
+PAGE_SIZE = (2480, 3508)
+DPI = 300
+COLUMNS, ROWS = 2, 3
+CODES_PER_PAGE = COLUMNS * ROWS
+# Width of the code in a cell of the sheet
+CODE_SIZE = 900
+LABEL_SIZE = 60
+# Generated by `flask assets fonts`, Pillow's own font has no umlauts
+FONT = os.path.join("fonts", "montserrat-700.ttf")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render(url, format="svg", scale=DEFAULT_SCALE):
+    """The QR code of url as SVG or PNG bytes"""
+    if segno is None:
+        raise RuntimeError("segno is not installed")
+    out = io.BytesIO()
+    segno.make(url, error=ERROR_CORRECTION).save(out, kind=format, scale=scale)
+    return out.getvalue()
+
+
+def location_url(base_url, label):
+    """The URL of the form with the location chosen"""
+    return f"{base_url.rstrip('/')}/?{urlencode({'location': label})}"
+
+
+def qr_view(location):
+    base_url = tenants.config()["BASE_URL"]
+    locations = get_locations()
+    if segno is None or not base_url or not locations:
+        raise NotFound()
+    try:
+        locations.value_for(location)
+    except ValueError:
+        raise NotFound()
+    format = request.args.get("format", "svg")
+    if format not in MIMETYPES or (format == "png" and Image is None):
+        return f'Unknown format "{format}"', 400
+    try:
+        scale = int(request.args.get("scale", DEFAULT_SCALE))
+    except ValueError:
+        scale = 0
+    if not 1 <= scale <= MAX_SCALE:
+        return f"The scale needs to be between 1 and {MAX_SCALE}", 400
+    response = Response(
+        render(location_url(base_url, location), format, scale),
+        mimetype=MIMETYPES[format],
+    )
+    # The code changes with the URL only
+    response.cache_control.public = True
+    response.cache_control.max_age = 24 * 60 * 60
+    return response
+
+
+@lru_cache(maxsize=None)
+def _font(path):
+    if path and os.path.isfile(path):
+        try:
+            return ImageFont.truetype(path, LABEL_SIZE)
+        except (OSError, ImportError):
+            pass  # A font FreeType can't read, or Pillow without FreeType
+    return ImageFont.load_default(size=LABEL_SIZE)
+
+
+def cell(url, label, font_path=None):
+    """A cell of the sheet: the code of url above the label, as a grayscale image"""
+    code = Image.open(io.BytesIO(render(url, "png", scale=1))).convert("L")
+    # Whole pixels per module, so all modules are equally large
+    side = code.width * (CODE_SIZE // code.width)
+    code = code.resize((side, side), Image.NEAREST)
+    width, height = PAGE_SIZE[0] // COLUMNS, PAGE_SIZE[1] // ROWS
+    image = Image.new("L", (width, height), 255)
+    image.paste(code, ((width - side) // 2, LABEL_SIZE))
+    draw = ImageDraw.Draw(image)
+    draw.text(
+        (width // 2, CODE_SIZE + 2 * LABEL_SIZE),
+        label,
+        fill=0,
+        font=_font(font_path),
+        anchor="mt",
+    )
+    return image
+
+
+def _cell_bytes(args):
+    # Images are sent between processes as raw pixels, that is cheaper than PNG
+    return cell(*args).tobytes()
+
+
+def render_sheet(codes, jobs=1):
+    """
+    A PDF with the cells of (url, label, font path) tuples, rendered in jobs
+    processes
+    """
+    if jobs > 1 and len(codes) > 1:
+        size = (PAGE_SIZE[0] // COLUMNS, PAGE_SIZE[1] // ROWS)
+        with ProcessPoolExecutor(jobs) as executor:
+            pixels = executor.map(_cell_bytes, codes, chunksize=CODES_PER_PAGE)
+            cells = [Image.frombytes("L", size, data) for data in pixels]
+    else:
+        cells = [cell(*code) for code in codes]
+    pages = []
+    for first in range(0, len(cells), CODES_PER_PAGE):
+        page = Image.new("L", PAGE_SIZE, 255)
+        for i, image in enumerate(cells[first : first + CODES_PER_PAGE]):
+            row, column = divmod(i, COLUMNS)
+            page.paste(image, (column * image.width, row * image.height))
+        # Black and white pages are stored losslessly, and are small
+        pages.append(page.convert("1", dither=Image.NONE))
+    out = io.BytesIO()
+    pages[0].save(out, "PDF", resolution=DPI, save_all=True, append_images=pages[1:])
+    return out.getvalue()
+
+
+@click.command("qr")
+@click.argument("url", required=False)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, writable=True),
+    default="qr-codes.pdf",
+    show_default=True,
+    help="Where to write the PDF",
+)
+@click.option(
+    "--directory",
+    type=click.Path(file_okay=False, writable=True),
+    help="Also write a file with the code of every location here",
+)
+@click.option("--format", "format", type=click.Choice(sorted(MIMETYPES)), default="svg")
+@click.option(
+    "--jobs", type=click.IntRange(1), help="Processes, one per CPU by default"
+)
+@with_appcontext
+@tenants.tenant_option
+def qr_command(url, output, directory, format, jobs):
+    """Print QR codes that lead to the form for every location, at BASE_URL or URL"""
+    if segno is None or Image is None:
+        raise click.ClickException("Needs segno and Pillow, which are not installed")
+    if tenants.enabled() and tenants.current() is None:
+        raise click.UsageError("Pass --tenant, whose locations these are")
+    url = url or tenants.config()["BASE_URL"]
+    if not url:
+        raise click.UsageError("Set BASE_URL or pass the URL of the form")
+    locations = get_locations()
+    if not locations:
+        raise click.ClickException("There are no locations")
+    font_path = os.path.join(current_app.static_folder, FONT)
+    codes = [(location_url(url, label), label, font_path) for label in locations.labels]
+
+    with open(output, "wb") as out:
+        out.write(render_sheet(codes, jobs or os.cpu_count() or 1))
+    click.echo(f"Wrote {len(codes)} codes to {output}")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for number, (code_url, label, _) in enumerate(codes, 1):
+            path = os.path.join(directory, f"{number:03}.{format}")
+            with open(path, "wb") as out:
+                out.write(render(code_url, format))
+            click.echo(f"{path}: {label}")
+
+
+def init_app(app):
+    app.add_url_rule("/qr/<path:location>", "qr", qr_view)
+    app.cli.add_command(qr_command)
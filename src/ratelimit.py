@@ -0,0 +1,191 @@
+"""
+Limits how fast sign-ins are accepted, so a script can't flood sign_ins and take
+the database connections from real guests.
+
+Every client IP address has a token bucket that holds RATE_LIMIT_PER_IP tokens and
+refills at RATE_LIMIT_PER_IP tokens per minute, and all sign-ins share one more
+bucket of RATE_LIMIT_GLOBAL tokens. A sign-in takes a token from both, without a
+token it gets a 429 response. Only POST / is limited, the pages are cheap.
+
+The buckets are in RATE_LIMIT_FILE, shared by all processes (see shared.py). The
+addresses are hashed into a fixed table of SETS sets with WAYS buckets each, so a
+check looks at four buckets, whatever the number of clients. When a set is full,
+the bucket that was used least recently is given to the new address; at worst, an
+evicted address starts over with a full bucket.
+
+Behind a reverse proxy, every request comes from the proxy. Set PROXIES to the
+number of proxies in front of the application to use the address they add to
+X-Forwarded-For, or to 0 if clients connect directly. Until PROXIES is set, there
+is only the global limit: every guest might have the proxy's address, and a busy
+door would be limited to RATE_LIMIT_PER_IP sign-ins in total.
+
+Every tenant (see tenants.py) has its own buckets, in RATE_LIMIT_FILE.<id>, and can
+set its own RATE_LIMIT_GLOBAL. A burst at one venue doesn't turn away the guests of
+another.
+
+asgi.py checks the limits itself, the sign-ins it passes on to Flask are marked
+with ENVIRON_KEY so they aren't counted twice.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from flask import current_app, request
+
+import metrics
+import tenants
+from shared import SharedMemory
+
+SETS = 1024
+WAYS = 4
+# Per bucket: the address hash, the tokens and when they were counted
+FIELDS = 3
+GLOBAL = SETS * WAYS
+
+# Set in the ASGI scope (see asgi.py) and so in the WSGI environ
+ENVIRON_KEY = "corona_sign_in.rate_limited"
+
+MESSAGE = "Zu viele Anmeldungen auf einmal. Bitte versuch es gleich noch einmal."
+
+
+class Buckets:
+    def __init__(self, path):
+        self._memory = SharedMemory(
+            path, (GLOBAL + 1) * FIELDS * 8, ["ratelimit", SETS, WAYS]
+        )
+        # The same memory as integers and as floats
+        self._keys = self._memory.data.cast("q")
+        self._values = self._memory.data.cast("d")
+
+    def take(self, key, size, now):
+        """
+        Takes a token from the bucket for key, which holds `size` tokens and gets
+        `size` new ones per minute. Returns 0 or the seconds until there is a token
+        """
+        start = (key % SETS) * WAYS * FIELDS
+        with self._memory.locked():
+            offset = None
+            oldest = None
+            for candidate in range(start, start + WAYS * FIELDS, FIELDS):
+                if self._keys[candidate] == key:
+                    offset = candidate
+                    break
+                if oldest is None or (
+                    self._values[candidate + 2] < self._values[oldest + 2]
+                ):
+                    oldest = candidate
+            if offset is None:
+                offset = oldest
+                self._keys[offset] = key
+                self._values[offset + 1] = size
+                self._values[offset + 2] = now
+            return self._take(offset, size, now)
+
+    def take_global(self, size, now):
+        offset = GLOBAL * FIELDS
+        with self._memory.locked():
+            return self._take(offset, size, now)
+
+    def _take(self, offset, size, now):
+        rate = size / 60
+        # max(): the clock starts over when the machine is restarted
+        elapsed = max(now - self._values[offset + 2], 0)
+        tokens = min(self._values[offset + 1] + elapsed * rate, size)
+        self._values[offset + 2] = now
+        if tokens >= 1:
+            self._values[offset + 1] = tokens - 1
+            return 0
+        self._values[offset + 1] = tokens
+        return (1 - tokens) / rate
+
+
+class RateLimit:
+    def init_app(self, app):
+        app.extensions["ratelimit"] = _State()
+        app.before_request(_limit_sign_ins)
+
+    def check(self, address, app=None):
+        """Returns 0 if the client may sign in, or the seconds it has to wait"""
+        app = app or current_app
+        # Without PROXIES, the address might be a proxy's
+        per_ip = app.config["RATE_LIMIT_PER_IP"]
+        if app.config["PROXIES"] is None:
+            per_ip = 0
+        per_app = tenants.config(app)["RATE_LIMIT_GLOBAL"]
+        if not (per_ip or per_app):
+            return 0
+        buckets = self._buckets(app)
+        now = time.monotonic()
+        if per_ip:
+            wait = buckets.take(_key(address), per_ip, now)
+            if wait:
+                metrics.rate_limited_total.inc("ip")
+                return wait
+        if per_app:
+            wait = buckets.take_global(per_app, now)
+            if wait:
+                metrics.rate_limited_total.inc("global")
+                return wait
+        return 0
+
+    def _buckets(self, app):
+        # Created here for tenants, they only need buckets once they are used
+        state = tenants.cache(app).setdefault("ratelimit", _State())
+        # Processes forked by gunicorn need their own file descriptor for flock
+        if state.pid != os.getpid():
+            with state.lock:
+                if state.pid != os.getpid():
+                    state.buckets = Buckets(
+                        tenants.path(app.config["RATE_LIMIT_FILE"])
+                    )
+                    state.pid = os.getpid()
+        return state.buckets
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.buckets = None
+
+
+def client_address(remote_address, forwarded_for, proxies):
+    """The client's address, taken from X-Forwarded-For behind `proxies` proxies"""
+    if proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(",")]
+        if len(addresses) >= proxies:
+            return addresses[-proxies]
+    return remote_address
+
+
+def too_many_requests(wait):
+    """The status, headers and body of the response for a limited client"""
+    return 429, {"Retry-After": str(max(int(wait + 0.999), 1))}, MESSAGE
+
+
+def _limit_sign_ins():
+    if request.method != "POST" or request.endpoint != "index":
+        return None
+    scope = request.environ.get("asgi.scope", {})
+    if request.environ.get(ENVIRON_KEY) or scope.get(ENVIRON_KEY):
+        return None
+    address = client_address(
+        request.remote_addr,
+        request.headers.get("X-Forwarded-For"),
+        current_app.config["PROXIES"],
+    )
+    wait = ratelimit.check(address)
+    if wait:
+        status, headers, body = too_many_requests(wait)
+        return body, status, headers
+    return None
+
+
+def _key(address):
+    digest = hashlib.blake2b((address or "").encode(), digest_size=8).digest()
+    # 0 marks an unused bucket
+    return int.from_bytes(digest, "little", signed=True) or 1
+
+
+ratelimit = RateLimit()
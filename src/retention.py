@@ -0,0 +1,138 @@
+"""
+Deletes sign-ins that are older than the retention period.
+
+If sign_ins is partitioned (see partitions.py), whole days are removed by dropping
+their partitions first. Remaining rows are deleted oldest first in batches of
+roughly PRUNE_BATCH_SIZE rows, each in its own transaction, so the table is never
+locked for long. The batches are bounded by signed_in_at values, which lets the
+database use the signed_in_at index.
+
+With TENANTS_FILE, every tenant's sign-ins are deleted after its own RETENTION_DAYS
+(see tenants.py), in the (tenant, signed_in_at) index. Partitions and data keys are
+shared, they are only dropped when the longest retention period has passed.
+Sign-ins from before there were tenants are kept for the RETENTION_DAYS of the
+configuration.
+"""
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, select
+
+import sign_ins
+import tenants
+from db import db
+from encryption import encryption
+from partitions import partitions
+
+
+def cutoff(retention_days, today=None):
+    """Everything signed in before this is older than retention_days"""
+    return datetime.combine(
+        (today or date.today()) - timedelta(days=retention_days), time()
+    )
+
+
+def prune(before, batch_size, dry_run=False, pause=0, where=None):
+    """
+    Deletes all sign-ins before `before` and yields (rows, seconds) for every batch.
+    `where` restricts it further, e.g. to one tenant.
+
+    With dry_run, the rows are counted the same way, but not deleted.
+    """
+    table = sign_ins.table
+    after = None
+    while True:
+        started = clock.monotonic()
+        with db.engine.begin() as connection:
+            in_range = table.c.signed_in_at < before
+            if where is not None:
+                in_range = and_(in_range, where)
+            if after is not None:
+                in_range = and_(in_range, table.c.signed_in_at > after)
+            boundary = connection.execute(
+                select([table.c.signed_in_at])
+                .where(in_range)
+                .order_by(table.c.signed_in_at)
+                .offset(batch_size - 1)
+                .limit(1)
+            ).scalar()
+            if boundary is not None:
+                in_range = and_(in_range, table.c.signed_in_at <= boundary)
+
+            if dry_run:
+                rows = connection.execute(
+                    select([func.count()]).select_from(table).where(in_range)
+                ).scalar()
+            else:
+                rows = connection.execute(table.delete().where(in_range)).rowcount
+
+        if rows:
+            yield rows, clock.monotonic() - started
+        if boundary is None:
+            return
+        after = boundary
+        clock.sleep(pause)
+
+
+@click.command("prune")
+@click.option(
+    "--days",
+    type=int,
+    help="Delete sign-ins older than this many days. Defaults to RETENTION_DAYS",
+)
+@click.option("--batch-size", type=int, help="Defaults to PRUNE_BATCH_SIZE")
+@click.option(
+    "--pause",
+    type=float,
+    default=0,
+    help="Seconds to wait between batches, to give inserts more room",
+)
+@click.option("--dry-run", is_flag=True, help="Only count what would be deleted")
+@with_appcontext
+def prune_command(days, batch_size, pause, dry_run):
+    """Delete sign-ins that are older than the retention period"""
+    batch_size = batch_size or current_app.config["PRUNE_BATCH_SIZE"]
+    verb = "Would delete" if dry_run else "Deleted"
+    # (whose, before, condition) for every tenant
+    groups = [("", cutoff(_days(days, current_app.config)), None)]
+    if tenants.enabled():
+        tenant = sign_ins.table.c.tenant
+        groups = [
+            (f" of {t.id}", cutoff(_days(days, t.config)), tenant == t.id)
+            for t in tenants.all_tenants()
+        ] + [(" without a tenant", groups[0][1], tenant.is_(None))]
+    before = min(before for _, before, _ in groups)
+
+    total_rows = 0
+    total_seconds = 0
+    for name, rows, seconds in partitions.drop_before(before.date(), dry_run=dry_run):
+        click.echo(f"{verb} partition {name} with {rows} rows in {seconds:.3f}s")
+        total_seconds += seconds
+        if not dry_run:
+            # In a dry run, these rows are counted again by the batches below
+            total_rows += rows
+    for whose, group_before, where in groups:
+        click.echo(f"{verb} sign-ins{whose} before {group_before.isoformat(' ')}")
+        for rows, seconds in prune(
+            group_before, batch_size, dry_run=dry_run, pause=pause, where=where
+        ):
+            click.echo(f"{verb} {rows} rows in {seconds:.3f}s")
+            total_rows += rows
+            total_seconds += seconds
+    click.echo(f"{verb} {total_rows} rows in total, {total_seconds:.3f}s")
+    if not dry_run:
+        # Makes the deleted sign-ins unreadable in backups, see encryption.py
+        keys = encryption.forget(before)
+        if keys:
+            click.echo(f"Deleted {keys} data keys")
+
+
+def _days(days, config):
+    return days if days is not None else config["RETENTION_DAYS"]
+
+
+def init_app(app):
+    app.cli.add_command(prune_command)
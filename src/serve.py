@@ -0,0 +1,120 @@
+"""
+Runs the application in production, configured by environment variables.
+
+CORONA_SIGN_IN_SERVER selects the server:
+
+- "waitress" (the default): One process with CORONA_SIGN_IN_THREADS threads.
+- "gunicorn": CORONA_SIGN_IN_WORKERS processes with CORONA_SIGN_IN_THREADS threads
+    each. With CORONA_SIGN_IN_PRELOAD (on by default), the application is created
+    and its templates are compiled once before the workers are forked.
+- "uvicorn": One process that stores sign-ins asynchronously, see asgi.py. It
+    keeps up to CORONA_SIGN_IN_CONNECTION_LIMIT connections open.
+
+Every process gets its own database connection pool, sized to its number of
+threads (see ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS).
+
+Use it with `python -m serve`.
+"""
+import signal
+import sys
+
+from app import create_app
+from config import ProductionConfig
+from db import db
+from locations import get_locations
+from occupancy import occupancy, reset as reset_occupancy
+
+
+def warm_up(app):
+    """Do the work that would otherwise happen on the first requests"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    get_locations(app)
+    with app.app_context():
+        occupancy.present()
+
+
+def serve_waitress(config):
+    import waitress
+
+    app = create_app(config)
+    warm_up(app)
+    # Exit normally on SIGTERM, so queued sign-ins are written (see ingest.py)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    waitress.serve(
+        app,
+        host=config.HOST,
+        port=config.PORT,
+        threads=config.THREADS,
+        connection_limit=config.CONNECTION_LIMIT,
+    )
+
+
+def serve_gunicorn(config):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{config.HOST}:{config.PORT}",
+                "workers": config.WORKERS,
+                "threads": config.THREADS,
+                "worker_class": "gthread",
+                "worker_connections": config.CONNECTION_LIMIT,
+                "preload_app": config.PRELOAD,
+                "post_fork": _post_fork,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            app = create_app(config)
+            warm_up(app)
+            return app
+
+    Application().run()
+
+
+def serve_uvicorn(config):
+    import uvicorn
+
+    from asgi import create_asgi_app
+
+    app = create_asgi_app(config)
+    warm_up(app.flask_app)
+    uvicorn.run(
+        app,
+        host=config.HOST,
+        port=config.PORT,
+        limit_concurrency=config.CONNECTION_LIMIT,
+        lifespan="on",
+    )
+
+
+def _post_fork(server, worker):
+    # Connections opened before the fork must not be shared between the workers
+    app = worker.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
+
+
+SERVERS = {
+    "waitress": serve_waitress,
+    "gunicorn": serve_gunicorn,
+    "uvicorn": serve_uvicorn,
+}
+
+
+def main():
+    config = ProductionConfig()
+    try:
+        serve = SERVERS[config.SERVER]
+    except KeyError:
+        raise SystemExit(f'Unknown CORONA_SIGN_IN_SERVER "{config.SERVER}"')
+    # The counters are filled from the database again when the server starts
+    reset_occupancy(config)
+    serve(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Memory that all processes of a server share, for state that must not cost a
+database query per request (see occupancy.py and dedup.py).
+
+The memory is a file that every process maps. Changes are serialized with flock
+between processes and with a lock between threads. The file starts with a checksum
+of its layout, a file with another layout (e.g. after the configuration changed) is
+cleared. Without a path, the memory is private to the process.
+
+flock locks belong to the open file, so processes forked by gunicorn must open the
+file again instead of using their parent's SharedMemory.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+# Magic, layout checksum
+HEADER = struct.Struct("<8sq")
+MAGIC = b"CSISHM01"
+
+
+class SharedMemory:
+    def __init__(self, path, size, layout):
+        """`layout` is anything JSON serializable that describes the content"""
+        checksum = zlib.crc32(json.dumps(layout).encode())
+        size += HEADER.size
+        self._lock = threading.Lock()
+        if path:
+            self._file = open(path, "a+b")
+            with self.locked():
+                if os.fstat(self._file.fileno()).st_size != size:
+                    os.ftruncate(self._file.fileno(), 0)
+                    os.ftruncate(self._file.fileno(), size)
+                self._map = mmap.mmap(self._file.fileno(), size)
+                self._init(checksum)
+        else:
+            self._file = None
+            self._map = mmap.mmap(-1, size)
+            self._init(checksum)
+        self.data = memoryview(self._map)[HEADER.size :]
+
+    def _init(self, checksum):
+        if HEADER.unpack_from(self._map) != (MAGIC, checksum):
+            self._map[:] = bytes(len(self._map))
+            HEADER.pack_into(self._map, 0, MAGIC, checksum)
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            if self._file is None:
+                yield
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+def remove(path):
+    """Makes the next SharedMemory for path start empty"""
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -1,21 +1,71 @@
 from flask_wtf import FlaskForm
-from base64 import b64encode, b64decode
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from wtforms import StringField, SelectField
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, ValidationError
 
 from db import db
 
+
+class insert_time(FunctionElement):
+    """The time of the insert statement, to the microsecond"""
+
+    type = db.DateTime()
+    name = "insert_time"
+
+
+@compiles(insert_time)
+def _insert_time(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(insert_time, "postgresql")
+def _insert_time_postgresql(element, compiler, **kw):
+    # now() is the start of the transaction
+    return "clock_timestamp()"
+
+
+@compiles(insert_time, "sqlite")
+def _insert_time_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP only has seconds, SQLAlchemy stores microseconds
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+
+
 table = db.Table(
     "sign_ins",
     db.Column("location", db.String(length=255)),
-    db.Column("first_name", db.String(length=255)),
-    db.Column("last_name", db.String(length=255)),
+    # Text, because they may be encrypted, see encryption.py
+    db.Column("first_name", db.Text),
+    db.Column("last_name", db.Text),
     db.Column("street_and_house_number", db.Text),
     db.Column("plz_and_city", db.Text),
-    db.Column("phone_number", db.String(length=255)),
+    db.Column("phone_number", db.Text),
     db.Column("signed_in_at", db.DateTime),
+    db.Column("signed_out_at", db.DateTime),
+    # Keep the next three columns last and in this order: encryption.decrypt
+    # unpacks rows as `*values, _, _, key_id` into a Row of COLUMNS
+    # When the row was inserted, set by the database, see backup.py. NULL for rows
+    # from before it was added
+    db.Column("stored_at", db.DateTime, server_default=insert_time()),
+    # Whose sign-in it is, NULL with one tenant, see tenants.py
+    db.Column("tenant", db.String(length=63)),
+    # The data key of the encrypted fields, NULL if they are plaintext
+    db.Column("key_id", db.Integer),
+    db.Index("ix_sign_ins_signed_in_at", "signed_in_at"),
+    db.Index("ix_sign_ins_location_signed_in_at", "location", "signed_in_at"),
+    db.Index("ix_sign_ins_tenant_signed_in_at", "tenant", "signed_in_at"),
+    db.Index("ix_sign_ins_stored_at", "stored_at"),
 )
 
+# The data of a sign-in, as exported and imported
+COLUMNS = tuple(
+    column
+    for column in table.c.keys()
+    if column not in ("stored_at", "tenant", "key_id")
+)
+# What inserts set, the database sets the rest
+INSERT_COLUMNS = tuple(column for column in table.c.keys() if column != "stored_at")
+
 
 class Form(FlaskForm):
     first_name = StringField(
@@ -42,29 +92,27 @@ class Form(FlaskForm):
 
 
 class FormWithLocation(Form):
-    def __init__(self, locations):
-        super().__init__()
-        self.location.choices = [("", "Bitte Auswählen")] + [
-            (b64encode(location.encode("utf-8")).decode("utf-8"), location)
-            for location in locations
-        ]
+    def __init__(self, locations, **kwargs):
+        super().__init__(**kwargs)
+        self._locations = locations
+        self.location.choices = locations.choices
 
     @property
     def data(self):
         data = super().data
-        data["location"] = b64decode(data["location"]).decode("utf-8")
+        data["location"] = self._locations.label_for(data["location"])
         return data
 
     def set_location(self, location: str):
-        try:
-            location_value = next(
-                value for (value, label) in self.location.choices if label == location
-            )
-        except StopIteration:
-            raise ValueError(f'Location "{location}" not found')
-        self.location.data = location_value
+        self.location.data = self._locations.value_for(location)
+
+    def validate_location(self, field):
+        # Replaces SelectField's linear search through the choices
+        if not self._locations.has_value(field.data):
+            raise ValidationError(field.gettext("Not a valid choice"))
 
     location = SelectField(
         "Ort",
         validators=[DataRequired(message="Bitte wähle aus von wo du eincheckst")],
+        validate_choice=False,
     )
@@ -0,0 +1,190 @@
+"""
+A live view of the guests per location for door staff, at /staff.
+
+The page subscribes to /staff/stream, a stream of server-sent events. Each event
+contains the occupancy of all locations (see occupancy.py), so no stream ever
+queries the database. One thread per process watches the occupancy and publishes
+changes to every subscriber. A sign-in or check-out wakes it up, so the event is
+sent right away. It also looks every second for sign-ins handled by other
+processes and for guests who were checked out automatically. A slow subscriber
+skips events and gets the latest one, so subscribers don't queue anything.
+
+With waitress or gunicorn, every open stream occupies a thread for up to
+STAFF_STREAM_SECONDS, then the browser reconnects. So that guests can still sign
+in, at most half of a process's THREADS serve streams. Beyond that, a device gets
+the current occupancy and the instruction to ask again in POLL_SECONDS, which only
+takes a thread for a moment. With uvicorn, streams are served by asgi.py without a
+thread, so any number of devices can follow along.
+
+Both need STAFF_TOKEN, see auth.py. Every tenant (see tenants.py) has a feed and
+a thread of its own, started when its staff first subscribe.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from flask import Response, current_app, render_template
+
+import tenants
+from auth import token_required
+from occupancy import occupancy
+
+# Seconds between checks for changes from other processes and the clock
+INTERVAL = 1
+# Seconds between comments that keep idle connections open through proxies
+KEEP_ALIVE = 15
+# Seconds after which devices that got no stream of their own ask again
+POLL_SECONDS = 5
+
+HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-store",
+    # Stops nginx from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+class Feed:
+    """Publishes the occupancy to any number of threads and coroutines"""
+
+    def __init__(self, app, tenant=None):
+        self.app = app
+        self.tenant = tenant
+        self._condition = threading.Condition()
+        self._version = 0
+        self._data = None
+        self._waiters = []
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._publish(self._read())
+                self._thread = threading.Thread(
+                    target=self._watch, name="staff-feed", daemon=True
+                )
+                self._thread.start()
+
+    def notify(self):
+        """Something changed, publish it now instead of within INTERVAL"""
+        self._wake.set()
+
+    def wait(self, version, timeout):
+        """Returns (version, data) once there is a newer version than `version`"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._data
+
+    async def wait_async(self, version, timeout):
+        with self._condition:
+            if self._version != version:
+                return self._version, self._data
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+        await asyncio.wait([future], timeout=timeout)
+        with self._condition:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            return self._version, self._data
+
+    def _watch(self):
+        while True:
+            self._wake.wait(INTERVAL)
+            self._wake.clear()
+            try:
+                data = self._read()
+            except Exception:
+                continue  # e.g. the database is unreachable while starting
+            with self._condition:
+                if data != self._data:
+                    self._publish(data)
+
+    def _read(self):
+        with self.app.app_context(), tenants.use(self.tenant):
+            return json.dumps({"locations": occupancy.snapshot(self.app)})
+
+    def _publish(self, data):
+        # Called with the condition held
+        self._version += 1
+        self._data = data
+        self._condition.notify_all()
+        for future in self._waiters:
+            try:
+                future.get_loop().call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # The loop was closed
+        self._waiters = []
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def get_feed(app=None):
+    """The feed of the app or the current tenant, started on first use"""
+    app = app or current_app
+    cache = tenants.cache(app)
+    feed = cache.get("staff_feed")
+    if feed is None:
+        feed = cache.setdefault("staff_feed", Feed(app, tenants.current()))
+    feed.start()
+    return feed
+
+
+def notify(app=None):
+    feed = tenants.cache(app or current_app).get("staff_feed")
+    if feed is not None:
+        feed.notify()
+
+
+def event(data, retry=None):
+    """An event, retry sets the seconds until the browser reconnects"""
+    retry = f"retry: {retry * 1000}\n" if retry else ""
+    return f"{retry}event: occupancy\ndata: {data}\n\n"
+
+
+@token_required("STAFF_TOKEN")
+def staff_view():
+    response = Response(render_template("staff.html.jinja2"))
+    response.cache_control.no_store = True
+    return response
+
+
+@token_required("STAFF_TOKEN")
+def stream_view():
+    feed = get_feed()
+    streams = current_app.extensions["staff_streams"]
+    if not streams.acquire(blocking=False):
+        # All threads a stream may occupy are taken, see above
+        _, data = feed.wait(None, 0)
+        return Response(event(data, retry=POLL_SECONDS), headers=HEADERS)
+    seconds = current_app.config["STAFF_STREAM_SECONDS"]
+
+    def events():
+        deadline = time.monotonic() + seconds
+        version = None
+        while time.monotonic() < deadline:
+            new_version, data = feed.wait(version, KEEP_ALIVE)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+            else:
+                version = new_version
+                yield event(data)
+
+    response = Response(events(), headers=HEADERS)
+    # Also called if the stream is closed before it started
+    response.call_on_close(streams.release)
+    return response
+
+
+def init_app(app):
+    app.extensions["staff_feed"] = Feed(app)
+    # Streams served by Flask, so by threads, see above. Shared by all tenants
+    app.extensions["staff_streams"] = threading.BoundedSemaphore(
+        app.config["THREADS"] // 2
+    )
+    app.add_url_rule("/staff", "staff", staff_view)
+    app.add_url_rule("/staff/stream", "staff_stream", stream_view)
@@ -0,0 +1,10 @@
+// The page is cached and the same for everyone, the check-out token is in the URL
+window.onload = function () {
+  const token = new URLSearchParams(window.location.search).get("checkout");
+  if (!token) {
+    return;
+  }
+  const form = document.getElementById("checkout");
+  form.elements["token"].value = token;
+  form.hidden = false;
+};
@@ -0,0 +1,41 @@
+// Shows the events of /staff/stream, the browser reconnects by itself. When all
+// threads for streams are taken, the server sends one event and when to ask again,
+// so the page polls. The URL is relative, so it works below a tenant's path prefix
+// as well
+window.onload = function () {
+  const body = document.querySelector("#occupancy tbody");
+  const status = document.getElementById("occupancy-status");
+  const stream = new EventSource("staff/stream");
+  let disconnected = null;
+
+  stream.addEventListener("occupancy", function (event) {
+    const locations = JSON.parse(event.data).locations;
+    body.replaceChildren(
+      ...locations.map(function (location) {
+        const row = document.createElement("tr");
+        const full =
+          location.capacity !== null && location.present >= location.capacity;
+        row.classList.toggle("full", full);
+        for (const value of [
+          location.location || "Gäste",
+          location.present,
+          location.capacity === null ? "" : location.capacity,
+        ]) {
+          const cell = document.createElement("td");
+          cell.textContent = value;
+          row.appendChild(cell);
+        }
+        return row;
+      })
+    );
+    clearTimeout(disconnected);
+    status.textContent = "Stand: " + new Date().toLocaleTimeString("de-DE");
+  });
+  stream.onerror = function () {
+    // Also called whenever a polled response ends, only show lasting problems
+    clearTimeout(disconnected);
+    disconnected = setTimeout(function () {
+      status.textContent = "Verbindung unterbrochen, verbinde neu…";
+    }, 15000);
+  };
+};
@@ -0,0 +1,262 @@
+"""
+Serves several venues ("tenants") from one server, with TENANTS_FILE.
+
+The file is a JSON object with a settings object for every tenant, by id:
+
+    {"gaengeviertel": {"hosts": ["checkin.das-gaengeviertel.info"],
+                       "name": "Gängeviertel", "locations": ["Garten", "Bar"]}}
+
+A request belongs to the tenant whose `hosts` contain its Host header, otherwise to
+the tenant whose id is the first segment of its path: example.org/gaengeviertel/
+is that tenant's sign-in page. The prefix is moved to SCRIPT_NAME, so the views
+see the same paths as with one tenant and url_for adds the prefix to links.
+Requests for no tenant only reach /health, /metrics and /static.
+
+A tenant's SETTINGS (e.g. its locations, capacity, retention and tokens) replace
+the configuration of the same name (see config), everything else is shared. `name`
+and `logo` (a URL) replace the Gängeviertel's on the pages. Without a `base_url`
+of its own, a tenant's BASE_URL is the server's with its id as the path.
+
+All tenants share the processes, the database pool and the tables, sign_ins.tenant
+says whose a sign-in is. Whatever depends on a tenant's settings is kept per tenant
+in its `cache` (see cache), and created on first use: its Locations, occupancy
+counters (in OCCUPANCY_FILE.<id>), rate limit buckets (in RATE_LIMIT_FILE.<id>),
+pages and staff feed. So a tenant costs memory only once it is used, hundreds of
+them don't cost a connection each.
+
+CLI commands with --tenant work with one tenant's sign-ins, without it with
+everyone's. Without TENANTS_FILE, there is one tenant, configured as before, and
+sign_ins.tenant is NULL.
+"""
+import json
+import re
+from collections import ChainMap
+from contextlib import contextmanager
+from functools import wraps
+
+import click
+from flask import _app_ctx_stack, current_app, g, request
+
+import sign_ins
+
+# The configuration a tenant can replace, by the name in TENANTS_FILE
+SETTINGS = {
+    "locations": "LOCATIONS",
+    "locations_file": "LOCATIONS_FILE",
+    "capacity": "CAPACITY",
+    "rate_limit_global": "RATE_LIMIT_GLOBAL",
+    "retention_days": "RETENTION_DAYS",
+    "admin_token": "ADMIN_TOKEN",
+    "staff_token": "STAFF_TOKEN",
+    "base_url": "BASE_URL",
+}
+
+# Ids end up in paths and file names
+ID = re.compile(r"[a-z0-9][a-z0-9-]{0,62}$")
+
+# What requests without a tenant can reach
+SHARED_PATHS = ("/health", "/metrics", "/static/")
+
+ENVIRON_KEY = "corona_sign_in.tenant"
+
+
+class Tenant:
+    def __init__(self, id, settings, app_config):
+        if not ID.match(id) or any(path.strip("/") == id for path in SHARED_PATHS):
+            raise ValueError(f'"{id}" can\'t be the id of a tenant')
+        unknown = set(settings) - {"hosts", "name", "logo", *SETTINGS}
+        if unknown:
+            unknown = ", ".join(sorted(unknown))
+            raise ValueError(f"Unknown settings for {id}: {unknown}")
+        self.id = id
+        self.hosts = [host.lower() for host in settings.get("hosts", ())]
+        self.name = settings.get("name", id)
+        self.logo = settings.get("logo")
+        own = {
+            SETTINGS[name]: value
+            for name, value in settings.items()
+            if name in SETTINGS
+        }
+        if "LOCATIONS" in own:
+            # Instead of a LOCATIONS_FILE of the configuration
+            own.setdefault("LOCATIONS_FILE", None)
+        if "BASE_URL" not in own and app_config.get("BASE_URL"):
+            # Requests below its path prefix reach it on any host
+            own["BASE_URL"] = f'{app_config["BASE_URL"].rstrip("/")}/{id}/'
+        self.config = ChainMap(own, app_config)
+        self.cache = {}
+
+    def __repr__(self):
+        return f"Tenant({self.id!r})"
+
+
+def read(path):
+    """The settings of every tenant in the file by id, empty without a file"""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load(config):
+    """The tenants of config["TENANTS_FILE"] by id"""
+    return {
+        id: Tenant(id, settings, config)
+        for id, settings in read(config["TENANTS_FILE"]).items()
+    }
+
+
+class Resolver:
+    """Finds the tenant of a request, see the module docstring"""
+
+    def __init__(self, tenants):
+        self.tenants = tenants
+        self.by_host = {
+            host: tenant for tenant in tenants.values() for host in tenant.hosts
+        }
+
+    def resolve(self, host, path):
+        """(tenant, path prefix) of a request, (None, "") for no tenant"""
+        tenant = self.by_host.get(host.rsplit(":", 1)[0].lower())
+        if tenant is not None:
+            return tenant, ""
+        first = path.split("/", 2)[1] if path.startswith("/") else ""
+        tenant = self.tenants.get(first)
+        if tenant is not None:
+            return tenant, "/" + first
+        return None, ""
+
+
+class Middleware:
+    def __init__(self, wsgi_app, resolver):
+        self.wsgi_app = wsgi_app
+        self.resolver = resolver
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        tenant, prefix = self.resolver.resolve(environ.get("HTTP_HOST", ""), path)
+        if tenant is None:
+            if not path.startswith(SHARED_PATHS):
+                start_response("404 Not Found", [("Content-Type", "text/plain")])
+                return [b"Unknown venue"]
+        elif prefix:
+            if path == prefix:
+                start_response("308 Permanent Redirect", [("Location", prefix + "/")])
+                return [b""]
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+            environ["PATH_INFO"] = path[len(prefix) :]
+        environ[ENVIRON_KEY] = tenant
+        return self.wsgi_app(environ, start_response)
+
+
+def current():
+    """The tenant of the request or CLI command, or None"""
+    # Called a few times per sign-in, this is faster than g.get
+    context = _app_ctx_stack.top
+    return getattr(context.g, "tenant", None) if context is not None else None
+
+
+def current_id():
+    """What to store in sign_ins.tenant"""
+    tenant = current()
+    return tenant.id if tenant is not None else None
+
+
+def config(app=None):
+    """The configuration, with the current tenant's settings"""
+    app = app or current_app
+    tenant = _current(app)
+    return tenant.config if tenant is not None else app.config
+
+
+def cache(app=None):
+    """Where to keep what depends on the tenant, its cache or app.extensions"""
+    app = app or current_app
+    tenant = _current(app)
+    return tenant.cache if tenant is not None else app.extensions
+
+
+def _current(app):
+    # Looking at the app context takes a microsecond, a few times per sign-in
+    return current() if app.extensions["tenants"] else None
+
+
+def path(base):
+    """A file for the current tenant next to `base`, e.g. for SharedMemory"""
+    tenant = current()
+    if not base or tenant is None:
+        return base
+    return f"{base}.{tenant.id}"
+
+
+def restrict(query):
+    """Restricts a select, update or delete of sign_ins to the current tenant's rows"""
+    tenant = current()
+    if tenant is None:
+        return query
+    return query.where(sign_ins.table.c.tenant == tenant.id)
+
+
+def enabled(app=None):
+    return bool((app or current_app).extensions["tenants"])
+
+
+def all_tenants(app=None):
+    """Every tenant, or [None] without TENANTS_FILE"""
+    tenants = (app or current_app).extensions["tenants"]
+    return list(tenants.values()) or [None]
+
+
+def get(id, app=None):
+    try:
+        return (app or current_app).extensions["tenants"][id]
+    except KeyError:
+        raise ValueError(f'There is no tenant "{id}"') from None
+
+
+@contextmanager
+def use(tenant):
+    """Acts for the tenant (or no tenant) in the current app context"""
+    previous = g.get("tenant")
+    g.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        g.tenant = previous
+
+
+def tenant_option(command):
+    """Adds --tenant to a CLI command, goes below with_appcontext"""
+
+    @click.option("--tenant", "tenant_id", help="Only this tenant's sign-ins")
+    @wraps(command)
+    def wrapper(*args, tenant_id=None, **kwargs):
+        tenant = None
+        if tenant_id is not None:
+            try:
+                tenant = get(tenant_id)
+            except ValueError as e:
+                raise click.BadParameter(str(e), param_hint="--tenant")
+        with use(tenant):
+            return command(*args, **kwargs)
+
+    return wrapper
+
+
+def require_tenant():
+    """For CLI commands that store sign-ins, which must belong to a tenant"""
+    if enabled() and current() is None:
+        raise click.UsageError("Pass --tenant, whose sign-ins these are")
+
+
+def _set_tenant():
+    g.tenant = request.environ.get(ENVIRON_KEY)
+
+
+def init_app(app):
+    tenants = load(app.config)
+    app.extensions["tenants"] = tenants
+    if tenants:
+        app.wsgi_app = Middleware(app.wsgi_app, Resolver(tenants))
+        app.before_request(_set_tenant)
+    app.context_processor(lambda: {"tenant": current()})
@@ -0,0 +1,271 @@
+"""
+Finds the guests who were at the same location at the same time as a reported case.
+
+Every guest stayed from signed_in_at to signed_out_at (see checkout.py). Someone
+who was present from `start` to `end` met everyone whose stay at the same location
+overlaps that time. Every sign-in has a signed_out_at, the migration that added it
+checked out the existing ones. Rows without one, e.g. written to the database by
+hand, are assumed to stay for TRACING_WINDOW minutes.
+
+The case is either given directly as a location and time span, or looked up by
+name and/or phone number. If the names are encrypted (see encryption.py), looking
+them up decrypts all sign-ins of the given days. On PostgreSQL, the overlapping
+stays are found with the GiST index on the stays. Elsewhere, the (location,
+signed_in_at) index is read from the longest stay (AUTO_CHECKOUT or
+TRACING_WINDOW minutes) before the presence to its end. Stays that were imported
+with a longer one are only found on PostgreSQL.
+"""
+from datetime import date, datetime, timedelta
+
+import click
+from flask import Response, current_app, request, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, or_, select
+
+import sign_ins
+import tenants
+from auth import token_required
+from db import db
+from encryption import encryption
+from export import ENCODERS, MIMETYPES, build_query, iter_rows
+
+
+class Presence:
+    """Someone was at location from start to end"""
+
+    def __init__(self, location, start, end):
+        self.location = location
+        self.start = start
+        self.end = end
+
+    def __eq__(self, other):
+        return (self.location, self.start, self.end) == (
+            other.location,
+            other.start,
+            other.end,
+        )
+
+    def __repr__(self):
+        return f"Presence({self.location!r}, {self.start}, {self.end})"
+
+
+def find_case(
+    last_name=None, first_name=None, phone_number=None, first_day=None, last_day=None
+):
+    """
+    The sign-ins of a guest, matched case-insensitively. Narrow it down with the
+    days, otherwise this reads all sign-ins.
+    """
+    if not (last_name or phone_number):
+        raise ValueError("Need the last name or the phone number")
+    query = build_query(first_day, last_day)
+    filters = {
+        "last_name": last_name,
+        "first_name": first_name,
+        "phone_number": phone_number,
+    }
+    filters = {name: value.strip().lower() for name, value in filters.items() if value}
+    if encryption.enabled():
+        # Encrypted values can only be compared once they are decrypted
+        return [
+            row
+            for rows in iter_rows(query)
+            for row in rows
+            if all(
+                (getattr(row, name) or "").lower() == value
+                for name, value in filters.items()
+            )
+        ]
+    for name, value in filters.items():
+        query = query.where(func.lower(sign_ins.table.c[name]) == value)
+    return encryption.decrypt(db.session.execute(query).fetchall())
+
+
+def presences(case_sign_ins, window):
+    """When and where the case was, overlapping stays at a location merged"""
+    merged = []
+    for row in sorted(
+        case_sign_ins, key=lambda row: (row.location or "", row.signed_in_at)
+    ):
+        start, end = row.signed_in_at, _signed_out_at(row, window)
+        last = merged[-1] if merged else None
+        if last and last.location == row.location and start <= last.end:
+            last.end = max(last.end, end)
+        else:
+            merged.append(Presence(row.location, start, end))
+    return merged
+
+
+def contacts_query(presence, window):
+    """Everyone of the tenant whose stay at the presence's location overlaps it"""
+    table = sign_ins.table
+    location = (
+        table.c.location.is_(None)
+        if presence.location is None
+        else table.c.location == presence.location
+    )
+    if db.engine.dialect.name == "postgresql":
+        # Matches the expression of the ix_sign_ins_stay index. Without an end,
+        # the range would be unbounded
+        stays = and_(
+            func.tsrange(table.c.signed_in_at, table.c.signed_out_at).op("&&")(
+                func.tsrange(presence.start, presence.end)
+            ),
+            table.c.signed_out_at.isnot(None),
+        )
+        legacy = and_(
+            table.c.signed_out_at.is_(None),
+            table.c.signed_in_at > presence.start - window,
+            table.c.signed_in_at < presence.end,
+        )
+        overlaps = or_(stays, legacy)
+    else:
+        longest = max(timedelta(minutes=current_app.config["AUTO_CHECKOUT"]), window)
+        overlaps = and_(
+            table.c.signed_in_at > presence.start - longest,
+            table.c.signed_in_at < presence.end,
+            or_(
+                table.c.signed_out_at > presence.start,
+                and_(
+                    table.c.signed_out_at.is_(None),
+                    table.c.signed_in_at > presence.start - window,
+                ),
+            ),
+        )
+    return tenants.restrict(
+        select([table]).where(location).where(overlaps).order_by(table.c.signed_in_at)
+    )
+
+
+def trace(presences, window, exclude=()):
+    """Yields lists of the sign-ins of everyone who met the case, see iter_rows"""
+    exclude = set(map(tuple, exclude))
+    for presence in presences:
+        for rows in iter_rows(contacts_query(presence, window)):
+            rows = [row for row in rows if tuple(row) not in exclude]
+            if rows:
+                yield rows
+
+
+def trace_case(location=None, start=None, end=None, window=None, **case):
+    """
+    Returns the case's presences and the contacts' sign-ins as lists of rows.
+
+    Either pass location, start and end, or the filters of find_case.
+    """
+    window = window or timedelta(minutes=current_app.config["TRACING_WINDOW"])
+    if start is not None:
+        found = []
+        presence_list = [Presence(location or None, start, end or start + window)]
+    else:
+        found = find_case(**case)
+        presence_list = presences(found, window)
+    return presence_list, trace(presence_list, window, exclude=found)
+
+
+@token_required("ADMIN_TOKEN")
+def trace_view():
+    args = request.args
+    format = args.get("format", "csv")
+    if format not in ENCODERS:
+        return f'Unknown format "{format}"', 400
+    try:
+        window = args.get("window", type=int)
+        window = timedelta(minutes=window) if window else None
+        if args.get("start"):
+            presence_list, contacts = trace_case(
+                location=args.get("location"),
+                start=datetime.fromisoformat(args["start"]),
+                end=datetime.fromisoformat(args["end"]) if args.get("end") else None,
+                window=window,
+            )
+        else:
+            presence_list, contacts = trace_case(
+                last_name=args.get("last_name"),
+                first_name=args.get("first_name"),
+                phone_number=args.get("phone_number"),
+                first_day=_parse_date(args.get("from")),
+                last_day=_parse_date(args.get("to")),
+                window=window,
+            )
+    except ValueError as e:
+        return f"{e}. Pass start (and location) or last_name/phone_number", 400
+    if not presence_list:
+        return "No sign-ins found for this guest", 404
+    return Response(
+        stream_with_context(ENCODERS[format](contacts)), mimetype=MIMETYPES[format]
+    )
+
+
+@click.command("trace")
+@click.option("--last-name")
+@click.option("--first-name")
+@click.option("--phone-number")
+@click.option("--from", "first_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--to", "last_day", type=click.DateTime(["%Y-%m-%d"]))
+@click.option("--location", help="Without a guest: Where the case was")
+@click.option(
+    "--start",
+    type=click.DateTime(["%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M"]),
+    help="Without a guest: When the case arrived",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(["%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M"]),
+    help="Without a guest: When the case left. Defaults to start + window",
+)
+@click.option("--window", type=int, help="Minutes. Defaults to TRACING_WINDOW")
+@click.option("--format", "format", type=click.Choice(sorted(ENCODERS)), default="csv")
+@with_appcontext
+@tenants.tenant_option
+def trace_command(
+    last_name,
+    first_name,
+    phone_number,
+    first_day,
+    last_day,
+    location,
+    start,
+    end,
+    window,
+    format,
+):
+    """Find everyone who was at the same place and time as a guest"""
+    window = timedelta(minutes=window) if window else None
+    try:
+        if start:
+            presence_list, contacts = trace_case(location, start, end, window)
+        else:
+            presence_list, contacts = trace_case(
+                last_name=last_name,
+                first_name=first_name,
+                phone_number=phone_number,
+                first_day=first_day.date() if first_day else None,
+                last_day=last_day.date() if last_day else None,
+                window=window,
+            )
+    except ValueError as e:
+        raise click.UsageError(f"{e}, or use --start")
+    if not presence_list:
+        raise click.ClickException("No sign-ins found for this guest")
+    for presence in presence_list:
+        click.echo(
+            f"{presence.location or 'Without location'}: "
+            f"{presence.start:%Y-%m-%d %H:%M} to {presence.end:%Y-%m-%d %H:%M}",
+            err=True,
+        )
+    for chunk in ENCODERS[format](contacts):
+        click.echo(chunk, nl=False)
+
+
+def _signed_out_at(row, window):
+    return row.signed_out_at or row.signed_in_at + window
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def init_app(app):
+    app.add_url_rule("/trace", "trace", trace_view)
+    app.cli.add_command(trace_command)
@@ -19,6 +19,17 @@ def containertests(c):
     c.run("pytest tests_container")
 
 
+@task
+def benchmark(c, database=None, server="waitress", ingest="sync", concurrency="1,16"):
+    command = (
+        f"python benchmarks/run.py --server {server} --ingest {ingest} "
+        f"--concurrency {concurrency}"
+    )
+    if database:
+        command += f" --database {database}"
+    c.run(command, pty=True)
+
+
 @task
 def run(c):
     c.run("flask run")
@@ -30,6 +30,17 @@ def _db(app):
     return db
 
 
+@pytest.fixture
+def encrypted_app(tmp_path, _db):
+    config = TestConfig()
+    config.ENCRYPTION_KEY_FILE = str(tmp_path / "keys")
+    app = create_app(config)
+    result = app.test_cli_runner().invoke(args=["encryption", "new-key"])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        yield app
+
+
 @pytest.fixture
 def broken_app(app, mocker):
     mocker.patch("app.sign_ins.Form", return_value={})
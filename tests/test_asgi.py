@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from urllib.parse import urlencode
+
+import pytest
+
+from app import create_app
+from config import TestConfig
+from factories import makeSignInData
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("a2wsgi")
+
+from asgi import SignInApp  # noqa: E402
+
+
+def request(asgi_app, method, path, body=b""):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(60)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    status = sent[0]["status"]
+    return status, b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_pages_are_served_by_flask(app):
+    status, body = request(SignInApp(app), "GET", "/")
+    assert status == 200
+    assert b"Moin lieber Gast!" in body
+
+
+def test_invalid_sign_ins_show_errors(app):
+    status, body = request(SignInApp(app), "POST", "/", b"first_name=foo")
+    assert status == 200
+    assert "Bitte trag deinen Nachnamen ein".encode() in body
+
+
+def test_sign_ins_passed_on_to_flask_are_counted_once(_db):
+    app = create_app(TestConfig())
+    app.config["RATE_LIMIT_PER_IP"] = 1
+    app.config["PROXIES"] = 0
+    asgi_app = SignInApp(app)
+
+    status, body = request(asgi_app, "POST", "/", b"first_name=foo")
+    assert status == 200
+    assert "Bitte trag deinen Nachnamen ein".encode() in body
+    assert request(asgi_app, "POST", "/", b"first_name=foo")[0] == 429
+
+
+def test_valid_sign_ins_are_accepted(app):
+    data = makeSignInData(first_name="Jules")
+    body = urlencode(data).encode()
+    scope = {"headers": [(b"content-type", b"application/x-www-form-urlencoded")]}
+
+    row = SignInApp(app).validate({**scope, "query_string": b""}, body)
+
+    assert row["first_name"] == "Jules"
+    assert row["signed_in_at"]
+
+
+def test_sign_ins_are_admitted_outside_the_event_loop(app, _db, monkeypatch):
+    asgi_app = SignInApp(app)
+    threads = []
+    stored = []
+    admit = asgi_app.admit
+
+    def recording_admit(*args):
+        threads.append(threading.current_thread())
+        return admit(*args)
+
+    async def store(row):
+        stored.append(row)
+
+    monkeypatch.setattr(asgi_app, "admit", recording_admit)
+    monkeypatch.setattr(asgi_app, "store", store)
+    body = urlencode(makeSignInData(first_name="Jules")).encode()
+
+    status, _ = request(asgi_app, "POST", "/", body)
+
+    assert status == 302
+    assert threads and threads[0] is not threading.main_thread()
+    assert stored[0]["first_name"] == "Jules"
+
+
+def test_staff_stream_is_served_without_a_thread(app, _db):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/staff/stream",
+        "headers": [(b"authorization", b"Bearer insecure staff token for testing")],
+    }
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(0.1)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(SignInApp(app)(scope, receive, send))
+
+    assert sent[0]["status"] == 200
+    assert sent[1]["body"].startswith(b"event: occupancy\ndata: {")
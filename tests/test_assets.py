@@ -0,0 +1,97 @@
+import gzip
+import re
+
+from bs4 import BeautifulSoup
+from flask import Flask
+from PIL import Image
+
+from assets import assets, build
+
+
+def test_static_urls_are_fingerprinted(client):
+    html = BeautifulSoup(client.get("/").data, "html.parser")
+    stylesheet = html.find("link", attrs={"rel": "stylesheet"})["href"]
+    assert re.fullmatch(r"/static/styles/main\.[0-9a-f]{10}\.css", stylesheet)
+
+    response = client.get(stylesheet)
+    assert response.status_code == 200
+    assert response.mimetype == "text/css"
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age >= 365 * 24 * 60 * 60
+
+
+def test_unfingerprinted_urls_still_work(client):
+    response = client.get("/static/styles/main.css")
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+
+
+def test_precompressed_files_are_served(tmp_path):
+    (tmp_path / "main.css").write_text("body { color: red; }\n" * 100)
+    build(str(tmp_path))
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path="/static")
+    assets.init_app(app)
+
+    with app.test_client() as client:
+        plain = client.get("/static/main.css")
+        compressed = client.get(
+            "/static/main.css", headers={"Accept-Encoding": "gzip, deflate"}
+        )
+
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.mimetype == "text/css"
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+def test_fonts_are_not_loaded_from_third_parties(client):
+    assert b"fonts.googleapis.com" not in client.get("/").data
+
+
+def test_webp_is_only_served_to_browsers_that_ask_for_it(tmp_path):
+    Image.radial_gradient("L").resize((512, 512)).save(tmp_path / "photo.png")
+    build(str(tmp_path))
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path="/static")
+    assets.init_app(app)
+
+    with app.test_client() as client:
+        chrome = client.get(
+            "/static/photo.png",
+            headers={"Accept": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"},
+        )
+        # Safari 13, which doesn't support WebP
+        safari = client.get(
+            "/static/photo.png",
+            headers={"Accept": "image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5"},
+        )
+        anything = client.get("/static/photo.png", headers={"Accept": "*/*"})
+
+    assert chrome.mimetype == "image/webp"
+    assert safari.mimetype == "image/png"
+    assert anything.mimetype == "image/png"
+
+
+def test_stylesheets_refer_to_fingerprinted_images(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "styles").mkdir()
+    (tmp_path / "images" / "caret.svg").write_text("<svg></svg>")
+    (tmp_path / "styles" / "main.css").write_text(
+        'select { background: url("../images/caret.svg"); }'
+    )
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path="/static")
+    assets.init_app(app)
+    manifest = app.extensions["assets"]
+
+    with app.test_client() as client:
+        css = client.get("/static/" + manifest.fingerprinted["styles/main.css"])
+    caret = manifest.fingerprinted["images/caret.svg"]
+    assert f'url("../{caret}")'.encode() in css.data
+
+    # The stylesheet's URL changes with the image
+    (tmp_path / "images" / "caret.svg").write_text('<svg class="new"></svg>')
+    changed = Flask(__name__, static_folder=str(tmp_path), static_url_path="/static")
+    assets.init_app(changed)
+    assert (
+        changed.extensions["assets"].fingerprinted["styles/main.css"]
+        != manifest.fingerprinted["styles/main.css"]
+    )
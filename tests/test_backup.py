@@ -0,0 +1,140 @@
+import hashlib
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+import sign_ins
+from backup import backup, load_manifest, prune_archives, save_manifest, verify
+from encryption import encryption
+from factories import makeSignInData
+
+
+def add_sign_ins(db, *times):
+    db.session.execute(
+        sign_ins.table.insert(),
+        [makeSignInData(first_name=f"Guest {t}", signed_in_at=t) for t in times],
+    )
+    db.session.commit()
+
+
+def first_names(db):
+    query = select([sign_ins.table]).order_by("signed_in_at")
+    rows = encryption.decrypt(db.session.execute(query).fetchall())
+    return [row.first_name for row in rows]
+
+
+def test_backups_are_incremental_and_restore_days(encrypted_app, _db, tmp_path):
+    directory = str(tmp_path / "backups")
+    add_sign_ins(_db, datetime(2020, 8, 1, 20), datetime(2020, 8, 2, 20))
+    # Sign-ins of the last two hours are left for the next backup
+    backups = backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 1))
+    assert list(backups) == [
+        ("corona-sign-in-2020-08-01.1.backup", 1),
+        ("corona-sign-in-2020-08-02.1.backup", 1),
+    ]
+    add_sign_ins(_db, datetime(2020, 8, 2, 23, 30), datetime(2020, 8, 3, 2))
+
+    backups = backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 5))
+    assert list(backups) == [
+        ("corona-sign-in-2020-08-02.2.backup", 1),
+        ("corona-sign-in-2020-08-03.1.backup", 1),
+    ]
+    assert load_manifest(directory)["high_water_mark"] == "2020-08-03T03:00:00"
+    _db.session.execute(sign_ins.table.delete())
+    _db.session.commit()
+    result = encrypted_app.test_cli_runner().invoke(
+        args=["backup", "restore", "--directory", directory]
+        + ["--from", "2020-08-02", "--to", "2020-08-02"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert first_names(_db) == [
+        "Guest 2020-08-02 20:00:00",
+        "Guest 2020-08-02 23:30:00",
+    ]
+
+
+def test_days_that_gained_sign_ins_are_backed_up_again(encrypted_app, _db, tmp_path):
+    directory = str(tmp_path / "backups")
+    add_sign_ins(_db, datetime(2020, 8, 1, 20), datetime(2020, 8, 2, 20))
+    list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 1)))
+    # e.g. from a paper list
+    add_sign_ins(_db, datetime(2020, 8, 1, 18))
+
+    backups = backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 5))
+
+    assert list(backups) == [("corona-sign-in-2020-08-01.2.backup", 2)]
+    assert sorted(os.listdir(directory)) == [
+        "corona-sign-in-2020-08-01.2.backup",
+        "corona-sign-in-2020-08-02.1.backup",
+        "manifest.json",
+    ]
+    assert (
+        list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 6))) == []
+    )
+
+
+def test_late_sign_ins_are_found_when_the_count_stays(encrypted_app, _db, tmp_path):
+    directory = str(tmp_path / "backups")
+    add_sign_ins(_db, datetime(2020, 8, 1, 20), datetime(2020, 8, 2, 20))
+    list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 1)))
+    # One sign-in is replaced by another of the same day
+    table = sign_ins.table
+    _db.session.execute(
+        table.delete().where(table.c.signed_in_at == datetime(2020, 8, 1, 20))
+    )
+    add_sign_ins(_db, datetime(2020, 8, 1, 18))
+
+    backups = backup(directory, encrypted_app.config, now=datetime(2020, 8, 3, 5))
+
+    assert list(backups) == [("corona-sign-in-2020-08-01.2.backup", 1)]
+    assert load_manifest(directory)["stored_at"]
+
+
+def test_damaged_archives_are_found(encrypted_app, _db, tmp_path):
+    directory = str(tmp_path / "backups")
+    add_sign_ins(_db, datetime(2020, 8, 1, 20), datetime(2020, 8, 2, 20))
+    list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3)))
+    altered = os.path.join(directory, "corona-sign-in-2020-08-01.1.backup")
+    with open(altered, "r+b") as file:
+        file.seek(-20, os.SEEK_END)
+        file.write(b"x")
+    truncated = os.path.join(directory, "corona-sign-in-2020-08-02.1.backup")
+    with open(truncated, "r+b") as file:
+        file.truncate(os.path.getsize(truncated) - 20)
+    # Archives with a matching checksum
+    manifest = load_manifest(directory)
+    for name in manifest["archives"]:
+        manifest["archives"][name]["sha256"] = _sha256(os.path.join(directory, name))
+    save_manifest(directory, manifest)
+
+    problems = dict(verify(directory, encrypted_app.config))
+
+    assert "was altered" in problems["corona-sign-in-2020-08-01.1.backup"]
+    assert "is truncated" in problems["corona-sign-in-2020-08-02.1.backup"]
+
+
+def test_archives_past_retention_are_pruned(encrypted_app, _db, tmp_path):
+    directory = str(tmp_path / "backups")
+    add_sign_ins(_db, datetime(2020, 8, 1, 20), datetime(2020, 8, 2, 20))
+    list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3)))
+    # Left by a run that was interrupted
+    open(os.path.join(directory, "corona-sign-in-2020-08-02.7.backup"), "w").close()
+
+    assert prune_archives(directory, date(2020, 8, 2)) == [
+        "corona-sign-in-2020-08-01.1.backup"
+    ]
+    list(backup(directory, encrypted_app.config, now=datetime(2020, 8, 3)))
+    assert sorted(os.listdir(directory)) == [
+        "corona-sign-in-2020-08-02.1.backup",
+        "manifest.json",
+    ]
+    assert [name for name, problem in verify(directory, encrypted_app.config)] == [
+        "corona-sign-in-2020-08-02.1.backup"
+    ]
+
+
+def _sha256(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
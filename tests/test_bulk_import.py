@@ -0,0 +1,132 @@
+import csv
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import sign_ins
+from bulk_import import RowValidator, import_command
+from factories import makeSignInData
+from locations import get_locations
+
+
+def write_csv(path, *rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=sign_ins.table.c.keys())
+        writer.writeheader()
+        writer.writerows(makeSignInData(**row) for row in rows)
+    return str(path)
+
+
+def stored(db):
+    table = sign_ins.table
+    query = select([table.c.first_name, table.c.location, table.c.signed_in_at])
+    return sorted(db.session.execute(query).fetchall())
+
+
+@pytest.fixture
+def locations(app):
+    app.config["LOCATIONS"] = ["Garten", "Bar"]
+    yield
+    app.config["LOCATIONS"] = None
+
+
+def test_import_csv(app, _db, tmp_path, locations):
+    path = write_csv(
+        tmp_path / "sign-ins.csv",
+        dict(first_name="Octave", location="Bar", signed_in_at="2020-08-01 21:00:00"),
+        dict(first_name="Jules", location="Garten", signed_in_at="02.08.2020 18:30"),
+    )
+
+    result = app.test_cli_runner().invoke(import_command, [path])
+
+    assert result.exit_code == 0, result.output
+    assert stored(_db) == [
+        ("Jules", "Garten", datetime(2020, 8, 2, 18, 30)),
+        ("Octave", "Bar", datetime(2020, 8, 1, 21, 0)),
+    ]
+
+
+@pytest.fixture
+def berlin(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Berlin")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_times_with_an_offset_are_local_times(app, _db, tmp_path, berlin):
+    path = write_csv(
+        tmp_path / "sign-ins.csv",
+        dict(first_name="Octave", signed_in_at="2020-08-01T19:00:00+00:00"),
+        dict(first_name="Jules", signed_in_at="2020-08-01 20:30"),
+        dict(
+            first_name="Left early",
+            signed_in_at="2020-08-01 20:30",
+            signed_out_at="2020-08-01T20:00:00+02:00",
+        ),
+    )
+
+    result = app.test_cli_runner().invoke(import_command, [path, "--skip-invalid"])
+
+    assert "signed_out_at: Before signed_in_at" in result.output
+    assert stored(_db) == [
+        ("Jules", None, datetime(2020, 8, 1, 20, 30)),
+        ("Octave", None, datetime(2020, 8, 1, 21, 0)),
+    ]
+
+
+def test_invalid_rows_prevent_the_import(app, _db, tmp_path, locations):
+    path = write_csv(
+        tmp_path / "sign-ins.csv",
+        dict(first_name="Octave", location="Bar", signed_in_at="2020-08-01 21:00"),
+        dict(last_name="", location="Keller", signed_in_at="2020-08-01 21:00"),
+        dict(
+            first_name="Jules",
+            location="Bar",
+            signed_in_at="2020-08-01 21:00",
+            signed_out_at="2020-08-01 20:00",
+        ),
+    )
+
+    result = app.test_cli_runner().invoke(import_command, [path])
+
+    assert result.exit_code == 1
+    assert 'location: Unknown location "Keller"' in result.output
+    assert "last_name: Bitte trag deinen Nachnamen ein" in result.output
+    assert "signed_out_at: Before signed_in_at" in result.output
+    assert stored(_db) == []
+
+    result = app.test_cli_runner().invoke(import_command, [path, "--skip-invalid"])
+
+    assert result.exit_code == 0, result.output
+    assert [row[0] for row in stored(_db)] == ["Octave"]
+
+
+def test_import_parquet(app, _db, tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    parquet = pytest.importorskip("pyarrow.parquet")
+    rows = [makeSignInData(first_name="Octave", signed_in_at=datetime(2020, 8, 1))]
+    path = str(tmp_path / "sign-ins.parquet")
+    parquet.write_table(pyarrow.Table.from_pylist(rows), path)
+
+    result = app.test_cli_runner().invoke(import_command, [path])
+
+    assert result.exit_code == 0, result.output
+    assert stored(_db) == [("Octave", None, datetime(2020, 8, 1))]
+
+
+def test_shortcut_for_valid_rows_matches_the_form(app, locations):
+    record = {
+        **makeSignInData(first_name=" Octave "),
+        "location": "Bar",
+        "signed_in_at": "2020-08-01 21:00",
+    }
+    validator = RowValidator(get_locations(app))
+    assert validator._text_fields is not None
+    shortcut = validator.validate(record)
+
+    validator._text_fields = None
+    assert validator.validate(record) == shortcut
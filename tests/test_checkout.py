@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy import select
+
+import sign_ins
+from app import create_app
+from checkout import make_token
+from config import TestConfig
+from factories import makeSignInData
+
+
+def sign_in(client):
+    response = client.post("/", data=makeSignInData())
+    assert response.status_code == 302
+    url = urlsplit(response.location)
+    assert url.path == "/thank-you"
+    return parse_qs(url.query)["checkout"][0]
+
+
+def stored_sign_in(db):
+    return db.session.execute(select([sign_ins.table])).fetchone()
+
+
+def test_sign_ins_are_checked_out_automatically(app, client, _db):
+    sign_in(client)
+
+    row = stored_sign_in(_db)
+    assert row.signed_out_at - row.signed_in_at == timedelta(
+        minutes=app.config["AUTO_CHECKOUT"]
+    )
+
+
+def test_checking_out_stores_the_time(client, _db):
+    token = sign_in(client)
+
+    response = client.post("/checkout", data={"token": token})
+
+    assert response.status_code == 200
+    row = stored_sign_in(_db)
+    assert row.signed_in_at <= row.signed_out_at <= datetime.now()
+    assert "Du bist jetzt ausgecheckt" in response.data.decode()
+
+    # Checking out twice keeps the first time
+    response = client.post("/checkout", data={"token": token})
+    assert response.status_code == 200
+    assert "Du warst schon ausgecheckt" in response.data.decode()
+    assert stored_sign_in(_db).signed_out_at == row.signed_out_at
+
+
+def test_invalid_token(client, _db):
+    sign_in(client)
+
+    response = client.post("/checkout", data={"token": "forged"})
+
+    assert response.status_code == 400
+    row = stored_sign_in(_db)
+    assert row.signed_out_at > datetime.now()
+
+
+def test_sign_ins_that_are_not_stored_yet(app, client, _db, tmp_path, monkeypatch):
+    token = make_token({"location": None, "signed_in_at": datetime.now()}, app.config)
+
+    response = client.post("/checkout", data={"token": token})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert "wird gerade noch gespeichert" in response.data.decode()
+
+    # The process's own ingest queue is written first
+    monkeypatch.setenv("CORONA_SIGN_IN_INGEST_FLUSH_INTERVAL", "60")
+    monkeypatch.setenv("CORONA_SIGN_IN_INGEST_SPILL_DIR", str(tmp_path))
+    config = TestConfig()
+    config.INGEST_MODE = "queued"
+    queued_app = create_app(config)
+    try:
+        with queued_app.test_client() as queued_client:
+            token = sign_in(queued_client)
+            assert stored_sign_in(_db) is None
+            response = queued_client.post("/checkout", data={"token": token})
+    finally:
+        queued_app.extensions["ingest"].stop()
+
+    assert response.status_code == 200
+    assert stored_sign_in(_db).signed_out_at <= datetime.now()
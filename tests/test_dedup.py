@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+import sign_ins
+from dedup import RotatingBloomFilter, dedup
+from factories import makeSignInData
+
+
+def count(db):
+    query = select([func.count()]).select_from(sign_ins.table)
+    return db.session.execute(query).scalar()
+
+
+def test_bloom_filter_forgets_old_windows(tmp_path):
+    path = str(tmp_path / "dedup")
+    bloom = RotatingBloomFilter(path, capacity=100, window=60)
+    other_process = RotatingBloomFilter(path, capacity=100, window=60)
+
+    assert not bloom.add(b"Jules", now=600)
+    assert other_process.add(b"Jules", now=610)
+    assert not bloom.add(b"Octave", now=610)
+    # The previous window is still checked, the one before is cleared
+    assert bloom.add(b"Jules", now=670)
+    assert not bloom.add(b"Jules", now=800)
+
+
+def test_sending_a_sign_in_twice_stores_it_once(client, _db):
+    data = makeSignInData()
+
+    first = client.post("/", data=data)
+    second = client.post("/", data=data)
+
+    assert first.status_code == second.status_code == 302
+    assert count(_db) == 1
+    # The guest can check out the stored sign-in
+    token = second.location.split("checkout=")[1]
+    assert client.post("/checkout", data={"token": token}).status_code == 200
+    row = _db.session.execute(select([sign_ins.table])).fetchone()
+    assert row.signed_out_at < datetime.now()
+
+
+def test_false_positives_are_stored(app, client, _db):
+    data = makeSignInData()
+    # As if the filter had seen the sign-in, but it isn't in the database
+    dedup.might_be_duplicate({**data, "location": None})
+
+    assert client.post("/", data=data).status_code == 302
+    assert count(_db) == 1
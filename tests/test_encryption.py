@@ -0,0 +1,80 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import sign_ins
+from encryption import MissingKey, encryption
+from factories import makeSignInData
+
+AUTH = {"Authorization": "Bearer insecure admin token for testing"}
+
+
+def exported(client):
+    response = client.get("/export", headers=AUTH)
+    assert response.status_code == 200
+    return list(csv.DictReader(io.StringIO(response.data.decode())))
+
+
+def test_sign_ins_are_stored_encrypted_and_exported_decrypted(encrypted_app, _db):
+    data = makeSignInData()
+    client = encrypted_app.test_client()
+    # Stored before encryption was switched on
+    _db.session.execute(
+        sign_ins.table.insert(), [makeSignInData(signed_in_at=datetime(2020, 8, 1))]
+    )
+    _db.session.commit()
+
+    assert client.post("/", data=data).status_code == 302
+    # Sent twice, recognized after decrypting
+    assert client.post("/", data=data).status_code == 302
+
+    row = _db.session.execute(
+        select([sign_ins.table]).where(sign_ins.table.c.key_id.isnot(None))
+    ).fetchone()
+    for field in ("first_name", "last_name", "phone_number"):
+        assert data[field] not in row[field]
+    rows = exported(client)
+    assert len(rows) == 2
+    assert {field: rows[1][field] for field in data} == data
+
+
+def test_trace_decrypts_to_find_the_case(encrypted_app, _db):
+    at = datetime.now() - timedelta(hours=1)
+    rows = [
+        makeSignInData(last_name="Case", location="Bar", signed_in_at=at),
+        makeSignInData(first_name="Contact", location="Bar", signed_in_at=at),
+        makeSignInData(first_name="Elsewhere", location="Hof", signed_in_at=at),
+    ]
+    _db.session.execute(
+        sign_ins.table.insert(), [encryption.encrypt(row) for row in rows]
+    )
+    _db.session.commit()
+
+    client = encrypted_app.test_client()
+    response = client.get("/trace?last_name=case", headers=AUTH)
+
+    assert response.status_code == 200
+    contacts = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert [row["first_name"] for row in contacts] == ["Contact"]
+
+
+def test_new_master_keys_and_forgotten_data_keys(encrypted_app, _db):
+    client = encrypted_app.test_client()
+    client.post("/", data=makeSignInData(first_name="Before"))
+    runner = encrypted_app.test_cli_runner()
+    assert runner.invoke(args=["encryption", "new-key"]).exit_code == 0
+    # Data keys live for a day, make the next sign-in use a new one
+    encrypted_app.extensions["encryption"].day = None
+    client.post("/", data=makeSignInData(first_name="After"))
+
+    # A new process that has to load both data keys
+    encrypted_app.extensions["encryption"].keys.clear()
+    assert [row["first_name"] for row in exported(client)] == ["Before", "After"]
+
+    assert encryption.forget(datetime.now() + timedelta(seconds=1)) == 2
+    encrypted_app.extensions["encryption"].keys.clear()
+    with pytest.raises(MissingKey):
+        exported(client)
@@ -0,0 +1,66 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import sign_ins
+from export import export_command
+from factories import makeSignInData
+
+AUTH = {"Authorization": "Bearer insecure admin token for testing"}
+
+
+def add_sign_ins(db, *rows):
+    db.session.execute(sign_ins.table.insert(), [makeSignInData(**r) for r in rows])
+    db.session.commit()
+
+
+def test_export_requires_token(client):
+    assert client.get("/export").status_code == 401
+    assert (
+        client.get("/export", headers={"Authorization": "Bearer no"}).status_code == 401
+    )
+
+
+def test_export_csv_filters_by_date(client, _db):
+    add_sign_ins(
+        _db,
+        dict(first_name="early", signed_in_at=datetime(2020, 8, 1, 23, 59)),
+        dict(first_name="in range", signed_in_at=datetime(2020, 8, 2, 0, 0)),
+        dict(first_name="last day", signed_in_at=datetime(2020, 8, 3, 23, 0)),
+        dict(first_name="late", signed_in_at=datetime(2020, 8, 4, 0, 0)),
+    )
+
+    response = client.get("/export?from=2020-08-02&to=2020-08-03", headers=AUTH)
+
+    assert response.mimetype == "text/csv"
+    assert "corona-sign-in-2020-08-02-to-2020-08-03.csv" in (
+        response.headers["Content-Disposition"]
+    )
+    rows = list(csv.DictReader(io.StringIO(response.data.decode("utf-8"))))
+    assert [r["first_name"] for r in rows] == ["in range", "last day"]
+
+
+def test_export_gzipped_ndjson_filters_by_location(client, _db):
+    add_sign_ins(
+        _db,
+        dict(location="Garden", signed_in_at=datetime(2020, 8, 1, 20)),
+        dict(location="Cafe", signed_in_at=datetime(2020, 8, 1, 21)),
+    )
+
+    response = client.get("/export?format=ndjson&gzip=1&location=Cafe", headers=AUTH)
+
+    lines = gzip.decompress(response.data).decode("utf-8").splitlines()
+    assert [json.loads(line)["location"] for line in lines] == ["Cafe"]
+    assert json.loads(lines[0])["signed_in_at"] == "2020-08-01T21:00:00"
+
+
+def test_export_command(app, _db):
+    add_sign_ins(_db, dict(first_name="Octave", signed_in_at=datetime(2020, 8, 1)))
+
+    result = app.test_cli_runner().invoke(export_command, ["--from", "2020-08-01"])
+
+    assert result.exit_code == 0, result.output
+    rows = list(csv.DictReader(io.StringIO(result.output)))
+    assert [r["first_name"] for r in rows] == ["Octave"]
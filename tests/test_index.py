@@ -1,6 +1,7 @@
 import json
 from base64 import b64encode
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 import requests
 from bs4 import BeautifulSoup
@@ -24,6 +25,19 @@ def test_success_page_has_content(client):
     assert b"Danke" in page.data
 
 
+def test_success_page_is_cacheable(client):
+    page = client.get("/thank-you")
+    assert page.headers["ETag"]
+    assert page.headers["Last-Modified"]
+    assert "max-age" in page.headers["Cache-Control"]
+
+    revalidated = client.get(
+        "/thank-you", headers={"If-None-Match": page.headers["ETag"]}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+
+
 def test_form_validation_errors_are_shown(client):
     page = client.post("/", data={"first_name": "foo"})
     html = BeautifulSoup(page.data, "html.parser")
@@ -101,7 +115,7 @@ def test_submitting_location_works(app, client, db_session):
     try:
         app.config["LOCATIONS"] = ["The Pool", "The Bar"]
         page = client.post("/", data=makeSignInData(location=b64encode(b"The Pool")))
-        assert page.location.endswith("/thank-you")
+        assert urlsplit(page.location).path == "/thank-you"
 
         sign_in_locations = db.session.execute(
             select([sign_ins.table.c.location])
@@ -130,7 +144,9 @@ def test_db(app, db_session):
     results = db.session.execute(select([sign_ins.table])).fetchall()
 
     assert len(results) == 1
-    assert results[0].items() == [
+    # Set by the database
+    assert isinstance(results[0].stored_at, datetime)
+    assert [item for item in results[0].items() if item[0] != "stored_at"] == [
         ("location", None),
         ("first_name", "f"),
         ("last_name", "l"),
@@ -138,6 +154,9 @@ def test_db(app, db_session):
         ("plz_and_city", "12345 anyville"),
         ("phone_number", "555-12345"),
         ("signed_in_at", datetime(2020, 3, 21, 13, 12, 7)),
+        ("signed_out_at", None),
+        ("tenant", None),
+        ("key_id", None),
     ]
 
 
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+import ingest
+import sign_ins
+from factories import makeSignInData
+from ingest import WriteBehindQueue
+
+
+def make_queue(app, tmp_path, **overrides):
+    settings = dict(max_size=10, batch_size=5, flush_interval=60, spill_dir=tmp_path)
+    return WriteBehindQueue(app, **{**settings, **overrides})
+
+
+def test_queued_rows_are_written_on_flush(app, _db, tmp_path):
+    queue = make_queue(app, tmp_path)
+    try:
+        queue.put(makeSignInData(first_name="Octave", signed_in_at=datetime.now()))
+        queue.put(makeSignInData(first_name="Jules", signed_in_at=datetime.now()))
+        assert queue.size == 2
+
+        queue.flush()
+
+        first_names = _db.session.execute(
+            select([sign_ins.table.c.first_name])
+        ).fetchall()
+        assert sorted(first_names) == [("Jules",), ("Octave",)]
+        assert queue.size == 0
+    finally:
+        queue.stop()
+
+
+def test_full_queue_rejects_rows(app, _db, tmp_path):
+    queue = make_queue(app, tmp_path, max_size=1)
+    try:
+        assert queue.put(makeSignInData(signed_in_at=datetime.now()))
+        assert not queue.put(makeSignInData(signed_in_at=datetime.now()))
+    finally:
+        queue.stop()
+
+
+def test_rows_from_spill_files_are_recovered(app, _db, tmp_path):
+    row = makeSignInData(first_name="Octave")
+    row["signed_in_at"] = {"__datetime__": "2020-08-14T20:15:00"}
+    (tmp_path / "ingest-1-20200814201500000000.ndjson").write_text(
+        json.dumps(row) + "\n"
+    )
+
+    make_queue(app, tmp_path).recover()
+
+    results = _db.session.execute(select([sign_ins.table])).fetchall()
+    assert [(r.first_name, r.signed_in_at) for r in results] == [
+        ("Octave", datetime(2020, 8, 14, 20, 15))
+    ]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rows_are_queued_while_others_are_synced(app, _db, tmp_path, monkeypatch):
+    queue = make_queue(app, tmp_path, max_size=100, batch_size=100)
+    synced = []
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        # Only returns once every thread wrote its row, which it can't if the
+        # queue's lock is held meanwhile
+        deadline = time.monotonic() + 5
+        while queue.size < 8 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        synced.append(queue.size)
+        real_fsync(fd)
+
+    monkeypatch.setattr(ingest.os, "fsync", fsync)
+    try:
+        threads = [
+            threading.Thread(
+                target=queue.put, args=(makeSignInData(signed_in_at=datetime.now()),)
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert synced[0] == 8
+        assert len(synced) <= 2
+    finally:
+        queue.stop()
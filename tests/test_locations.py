@@ -0,0 +1,88 @@
+import os
+from base64 import b64encode
+
+from pytest import raises
+from sqlalchemy import select
+
+import locations
+import sign_ins
+from app import create_app
+from config import TestConfig
+from factories import makeSignInData
+from locations import Locations, WatchedFile, get_locations
+from occupancy import occupancy
+
+
+def test_locations_map_labels_to_values():
+    locations = Locations(["Garden", "Größenwahn"])
+
+    assert locations.value_for("Größenwahn") == b64encode(
+        "Größenwahn".encode("utf-8")
+    ).decode("utf-8")
+    assert locations.label_for(locations.value_for("Garden")) == "Garden"
+    assert locations.choices[0] == ("", "Bitte Auswählen")
+    with raises(ValueError):
+        locations.value_for("Library")
+
+
+def test_locations_are_cached_per_config_value(app):
+    try:
+        app.config["LOCATIONS"] = ["Garden"]
+        assert get_locations(app) is get_locations(app)
+
+        app.config["LOCATIONS"] = ["Garden", "Cafe"]
+        assert get_locations(app).labels == ("Garden", "Cafe")
+    finally:
+        app.config["LOCATIONS"] = None
+
+    assert get_locations(app) is None
+
+
+def test_locations_file_is_read_again_when_it_changes(tmp_path, monkeypatch):
+    path = tmp_path / "locations"
+    path.write_text("# Inside\nBalcony\nBar\n\n")
+    now = [1000.0]
+    monkeypatch.setattr(locations.time, "monotonic", lambda: now[0])
+    watched = WatchedFile(str(path))
+    before = watched.get()
+    assert before.labels == ("Balcony", "Bar")
+
+    path.write_text("Terrace\nBar\n")
+    os.utime(path, ns=(0, 1))
+    assert watched.get() is before  # Not checked again yet
+    now[0] += locations.CHECK_INTERVAL
+    after = watched.get()
+
+    assert after.labels == ("Terrace", "Bar")
+    assert watched.get() is after
+    # Forms that still show the balcony
+    assert after.label_for(before.value_for("Balcony")) == "Balcony"
+    assert "Balcony" not in [label for _, label in after.choices]
+    with raises(ValueError):
+        after.value_for("Balcony")
+    now[0] += locations.RETIRED_SECONDS
+    assert not watched.get().has_value(before.value_for("Balcony"))
+
+
+def test_sign_ins_use_the_current_locations_file(tmp_path, _db):
+    path = tmp_path / "locations"
+    path.write_text("Balcony\n")
+    config = TestConfig()
+    config.LOCATIONS_FILE = str(path)
+    app = create_app(config)
+    client = app.test_client()
+    balcony = get_locations(app).value_for("Balcony")
+
+    path.write_text("Terrace\n")
+    os.utime(path, ns=(0, 1))
+    app.extensions["locations_file"]._checked = None
+    sent_before = client.post("/", data=makeSignInData(location=balcony))
+    response = client.get("/?location=Terrace")
+
+    assert sent_before.status_code == 302
+    assert response.status_code == 200
+    assert "Balcony" not in response.data.decode()
+    with app.app_context():
+        assert occupancy.present() == {"Terrace": 0}
+        stored = _db.session.execute(select([sign_ins.table.c.location])).scalar()
+    assert stored == "Balcony"
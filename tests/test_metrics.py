@@ -0,0 +1,49 @@
+import threading
+
+from factories import makeSignInData
+from metrics import REGISTRY, Histogram
+
+AUTH = {"Authorization": "Bearer insecure metrics token for testing"}
+
+
+def test_histogram_adds_up_the_threads():
+    histogram = Histogram("test_seconds", "Test", ("phase",), buckets=(0.1, 1))
+    try:
+        threads = [
+            threading.Thread(target=histogram.observe, args=(seconds, "validate"))
+            for seconds in (0.0625, 0.5, 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert list(histogram.expose()) == [
+            "# HELP test_seconds Test",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{phase="validate",le="0.1"} 1',
+            'test_seconds_bucket{phase="validate",le="1"} 2',
+            'test_seconds_bucket{phase="validate",le="+Inf"} 3',
+            'test_seconds_sum{phase="validate"} 4.5625',
+            'test_seconds_count{phase="validate"} 3',
+        ]
+    finally:
+        REGISTRY.remove(histogram)
+
+
+def test_metrics_need_token(client):
+    assert client.get("/metrics").status_code == 401
+
+
+def test_sign_ins_are_measured(client, _db):
+    client.post("/", data=makeSignInData())
+
+    metrics = client.get("/metrics", headers=AUTH).data.decode()
+    assert 'corona_sign_in_sign_ins_total{location=""}' in metrics
+    assert (
+        'corona_sign_in_phase_seconds_count{endpoint="index",phase="commit"}' in metrics
+    )
+    assert (
+        'corona_sign_in_requests_total{endpoint="index",method="POST",status="302"}'
+        in metrics
+    )
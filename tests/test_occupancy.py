@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import sign_ins
+from config import TestConfig
+from factories import makeSignInData
+from occupancy import Counters
+
+
+@pytest.fixture
+def fresh(app, _db):
+    # The app is shared by all tests, make it count the new database
+    app.extensions["occupancy"].key = None
+
+
+AUTH = {"Authorization": "Bearer insecure staff token for testing"}
+
+
+def present(client):
+    response = client.get("/occupancy", headers=AUTH)
+    assert response.status_code == 200
+    return {row["location"]: row["present"] for row in response.json["locations"]}
+
+
+def test_occupancy_needs_the_staff_token(client):
+    assert client.get("/occupancy").status_code == 401
+
+
+def test_counters_are_shared_and_expire(tmp_path):
+    path = str(tmp_path / "occupancy")
+    first = Counters(path, ["Bar", "Garten"], slots=10)
+    second = Counters(path, ["Bar", "Garten"], slots=10)
+
+    assert first.add("Bar", 105, now=100)
+    assert first.add("Bar", 108, now=100)
+    assert not second.add("Bar", 108, now=100, capacity=2)
+    second.remove("Bar", 108, now=101)
+
+    assert second.present("Bar", now=101) == 1
+    assert first.present("Garten", now=101) == 0
+    assert first.present("Bar", now=105) == 0
+    # Minutes that passed are reused
+    assert first.add("Bar", 115, now=106)
+    assert second.present("Bar", now=106) == 1
+
+
+@pytest.mark.usefixtures("fresh")
+def test_sign_in_and_check_out(client, _db):
+    assert present(client) == {None: 0}
+
+    response = client.post("/", data=makeSignInData())
+    assert present(client) == {None: 1}
+
+    token = response.location.split("checkout=")[1]
+    client.post("/checkout", data={"token": token})
+    assert present(client) == {None: 0}
+
+
+@pytest.mark.usefixtures("fresh")
+def test_full_locations_reject_sign_ins(app, client, _db):
+    app.config["CAPACITY"] = 1
+    try:
+        assert client.post("/", data=makeSignInData()).status_code == 302
+        response = client.post("/", data=makeSignInData())
+    finally:
+        app.config["CAPACITY"] = None
+
+    assert response.status_code == 409
+    assert "voll" in response.data.decode()
+    count = _db.session.execute(select([func.count()]).select_from(sign_ins.table))
+    assert count.scalar() == 1
+
+
+def test_counters_are_filled_from_the_database(_db):
+    now = datetime.now()
+    _db.session.execute(
+        sign_ins.table.insert(),
+        [
+            makeSignInData(
+                location="Bar",
+                signed_in_at=now - timedelta(minutes=minutes),
+                signed_out_at=now + timedelta(minutes=120 - minutes),
+            )
+            for minutes in (10, 20, 130)
+        ]
+        # An imported stay, longer than AUTO_CHECKOUT
+        + [
+            makeSignInData(
+                location="Bar",
+                signed_in_at=now - timedelta(minutes=300),
+                signed_out_at=now + timedelta(minutes=30),
+            )
+        ],
+    )
+    _db.session.commit()
+
+    from app import create_app
+
+    config = TestConfig()
+    config.LOCATIONS = ["Bar", "Garten"]
+    with create_app(config).test_client() as client:
+        assert present(client) == {"Bar": 3, "Garten": 0}
+
+
+def test_counters_are_kept_while_the_labels_are_the_same(_db):
+    from app import create_app
+    from occupancy import occupancy
+
+    config = TestConfig()
+    config.LOCATIONS = ["Bar", "Garten"]
+    app = create_app(config)
+    with app.app_context():
+        counters = occupancy._counters(app)
+        # New Locations, e.g. after a retired location expired
+        app.config["LOCATIONS"] = ["Bar", "Garten"]
+        assert occupancy._counters(app) is counters
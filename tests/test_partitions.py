@@ -0,0 +1,14 @@
+from datetime import date
+
+from partitions import partition_day, partition_name, partitions
+
+
+def test_partition_names_round_trip():
+    assert partition_name(date(2020, 8, 14)) == "sign_ins_p20200814"
+    assert partition_day("sign_ins_p20200814") == date(2020, 8, 14)
+    assert partition_day("sign_ins_default") is None
+
+
+def test_sqlite_falls_back_to_the_plain_table(app):
+    assert not partitions.is_partitioned(app)
+    assert list(partitions.drop_before(date.today())) == []
@@ -0,0 +1,56 @@
+import os
+import unittest.mock as mock
+
+import flask
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from config import ProductionConfig
+from pool import TimedQueuePool, pool_status
+
+
+def test_pool_counts_checkouts_and_timeouts():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    connection = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+
+    status = pool_status(engine.pool)
+    assert status["size"] == 1
+    assert status["checked_out"] == 1
+    assert status["checkouts"] == 1
+    assert status["timeouts"] == 1
+    assert status["wait_seconds_max"] >= 0.05
+    connection.close()
+
+
+def test_gets_pool_options_from_environment():
+    with mock.patch.dict(
+        os.environ,
+        {
+            "CORONA_SIGN_IN_DATABASE_URI": "postgresql://localhost/corona-sign-in",
+            "CORONA_SIGN_IN_DB_POOL_SIZE": "8",
+            "CORONA_SIGN_IN_DB_POOL_PRE_PING": "false",
+            "CORONA_SIGN_IN_DB_STATEMENT_TIMEOUT": "2.5",
+        },
+    ):
+        config = flask.Config("")
+        config.from_object(ProductionConfig())
+        options = config["SQLALCHEMY_ENGINE_OPTIONS"]
+        assert options["poolclass"] is TimedQueuePool
+        assert options["pool_size"] == 8
+        assert options["pool_pre_ping"] is False
+        assert options["connect_args"] == {"options": "-c statement_timeout=2500"}
+
+
+def test_health(client, _db):
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json["database"] == "ok"
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+import werkzeug
+from PIL import ImageFont
+
+import qr
+import tenants
+from app import create_app
+from config import TestConfig
+
+
+@pytest.fixture
+def qr_app():
+    config = TestConfig()
+    config.LOCATIONS = ["Garten", "Großer Saal"]
+    app = create_app(config)
+    app.config["BASE_URL"] = "https://example.org/"
+    with app.app_context():
+        yield app
+
+
+def test_codes_lead_to_the_form_with_the_location(qr_app):
+    assert (
+        qr.location_url("https://example.org/hof", "Großer Saal")
+        == "https://example.org/hof/?location=Gro%C3%9Fer+Saal"
+    )
+    client = qr_app.test_client()
+
+    response = client.get("/qr/Großer Saal")
+    assert response.status_code == 200
+    assert response.mimetype == "image/svg+xml"
+    assert response.data.startswith(b"<?xml")
+    hits = qr.render.cache_info().hits
+    assert client.get("/qr/Großer Saal").data == response.data
+    assert qr.render.cache_info().hits == hits + 1
+
+    response = client.get("/qr/Garten?format=png&scale=2")
+    assert response.mimetype == "image/png"
+    assert response.data.startswith(b"\x89PNG")
+
+
+def test_only_locations_have_codes(qr_app):
+    client = qr_app.test_client()
+    assert client.get("/qr/Keller").status_code == 404
+    assert client.get("/qr/Garten?format=gif").status_code == 400
+    assert client.get("/qr/Garten?scale=1000").status_code == 400
+
+
+def test_codes_do_not_depend_on_the_host(qr_app):
+    client = qr_app.test_client()
+    code = client.get("/qr/Garten").data
+
+    response = client.get("/qr/Garten", headers={"Host": "evil.example.com"})
+
+    assert response.data == code
+    assert response.data == qr.render("https://example.org/?location=Garten")
+
+    qr_app.config["BASE_URL"] = None
+    assert client.get("/qr/Garten").status_code == 404
+
+
+def test_tenants_are_reached_below_the_base_url():
+    tenant = tenants.Tenant("hof", {}, {"BASE_URL": "https://example.org/"})
+    assert tenant.config["BASE_URL"] == "https://example.org/hof/"
+
+    tenant = tenants.Tenant(
+        "hof",
+        {"base_url": "https://hof.example/"},
+        {"BASE_URL": "https://example.org/"},
+    )
+    assert tenant.config["BASE_URL"] == "https://hof.example/"
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_command_prints_a_sheet(qr_app, tmp_path, jobs):
+    output = str(tmp_path / "codes.pdf")
+    directory = str(tmp_path / "codes")
+
+    result = qr_app.test_cli_runner().invoke(
+        args=["qr", "-o", output, "--jobs", jobs] + ["--directory", directory]
+    )
+
+    assert result.exit_code == 0, result.output
+    with open(output, "rb") as file:
+        assert file.read(5) == b"%PDF-"
+    assert sorted(os.listdir(directory)) == ["001.svg", "002.svg"]
+    assert "002.svg: Großer Saal" in result.output
+
+
+# Any TrueType font will do, Werkzeug's debugger brings one
+TTF = os.path.join(os.path.dirname(werkzeug.__file__), "debug", "shared", "ubuntu.ttf")
+
+
+def test_sheet_labels_are_set_in_the_font(qr_app):
+    assert isinstance(qr._font(TTF), ImageFont.FreeTypeFont)
+    codes = [("https://example.org/?location=Garten", "Garten", TTF)]
+
+    assert qr.render_sheet(codes).startswith(b"%PDF-")
+
+
+def test_fonts_pillow_can_not_read_are_replaced(qr_app, tmp_path):
+    woff2 = tmp_path / "font.woff2"
+    woff2.write_bytes(b"wOF2" + bytes(100))
+    codes = [("https://example.org/?location=Garten", "Garten", str(woff2))]
+
+    assert qr.render_sheet(codes).startswith(b"%PDF-")
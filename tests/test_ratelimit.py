@@ -0,0 +1,62 @@
+import pytest
+
+from app import create_app
+from config import TestConfig
+from factories import makeSignInData
+from ratelimit import Buckets, client_address
+
+
+def test_buckets_refill(tmp_path):
+    path = str(tmp_path / "ratelimit")
+    buckets = Buckets(path)
+    other_process = Buckets(path)
+
+    assert buckets.take(1, size=2, now=100) == 0
+    assert other_process.take(1, size=2, now=100) == 0
+    assert buckets.take(1, size=2, now=100) == pytest.approx(30)
+    assert buckets.take(2, size=2, now=100) == 0
+    # One token every 30 seconds
+    assert other_process.take(1, size=2, now=130) == 0
+    assert buckets.take_global(size=1, now=130) == 0
+    assert buckets.take_global(size=1, now=130) == pytest.approx(60)
+
+
+def test_client_address():
+    assert client_address("10.0.0.1", None, 0) == "10.0.0.1"
+    assert client_address("10.0.0.1", "1.2.3.4, 5.6.7.8", 0) == "10.0.0.1"
+    assert client_address("10.0.0.1", "1.2.3.4, 5.6.7.8", 1) == "5.6.7.8"
+    assert client_address("10.0.0.1", "1.2.3.4, 5.6.7.8", 2) == "1.2.3.4"
+    assert client_address("10.0.0.1", "1.2.3.4", 2) == "10.0.0.1"
+
+
+@pytest.mark.usefixtures("_db")
+def test_sign_ins_are_limited_per_address():
+    app = create_app(TestConfig())
+    app.config["RATE_LIMIT_PER_IP"] = 2
+    app.config["PROXIES"] = 1
+    client = app.test_client()
+
+    def sign_in(address):
+        headers = {"X-Forwarded-For": address}
+        return client.post("/", data=makeSignInData(), headers=headers)
+
+    assert sign_in("1.2.3.4").status_code == 302
+    assert sign_in("1.2.3.4").status_code == 302
+    response = sign_in("1.2.3.4")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == 30
+    assert sign_in("5.6.7.8").status_code == 302
+    # The pages aren't limited
+    assert client.get("/", headers={"X-Forwarded-For": "1.2.3.4"}).status_code == 200
+
+
+@pytest.mark.usefixtures("_db")
+def test_addresses_are_only_limited_with_proxies_configured():
+    app = create_app(TestConfig())
+    app.config["RATE_LIMIT_PER_IP"] = 1
+    assert app.config["PROXIES"] is None
+    client = app.test_client()
+
+    # Behind an unknown proxy every guest would have the same address
+    assert client.post("/", data=makeSignInData()).status_code == 302
+    assert client.post("/", data=makeSignInData()).status_code == 302
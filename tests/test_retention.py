@@ -0,0 +1,56 @@
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+import sign_ins
+from factories import makeSignInData
+from retention import cutoff, prune, prune_command
+
+
+def add_sign_ins(db, *times):
+    db.session.execute(
+        sign_ins.table.insert(), [makeSignInData(signed_in_at=t) for t in times]
+    )
+    db.session.commit()
+
+
+def remaining(db):
+    return [
+        r.signed_in_at
+        for r in db.session.execute(
+            select([sign_ins.table.c.signed_in_at]).order_by("signed_in_at")
+        )
+    ]
+
+
+def test_cutoff_matches_the_previous_date_based_query():
+    # The old cronjob deleted where NOW()::date - signed_in_at::date > 28
+    assert cutoff(28, today=date(2020, 8, 30)) == datetime(2020, 8, 2)
+
+
+def test_prune_deletes_in_batches(app, _db):
+    add_sign_ins(_db, *(datetime(2020, 8, day) for day in range(1, 8)))
+
+    batches = list(prune(datetime(2020, 8, 6), batch_size=2))
+
+    assert [rows for rows, _ in batches] == [2, 2, 1]
+    assert remaining(_db) == [datetime(2020, 8, 6), datetime(2020, 8, 7)]
+
+
+def test_dry_run_does_not_delete(app, _db):
+    add_sign_ins(_db, *(datetime(2020, 8, day) for day in range(1, 4)))
+
+    batches = list(prune(datetime(2020, 8, 3), batch_size=1, dry_run=True))
+
+    assert [rows for rows, _ in batches] == [1, 1]
+    assert len(remaining(_db)) == 3
+
+
+def test_prune_command(app, _db):
+    add_sign_ins(_db, datetime(2020, 8, 1), datetime.now())
+
+    result = app.test_cli_runner().invoke(prune_command, ["--days", "28"])
+
+    assert result.exit_code == 0, result.output
+    assert "Deleted 1 rows in total" in result.output
+    assert len(remaining(_db)) == 1
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from app import create_app
+from config import TestConfig
+from factories import makeSignInData
+from staff import Feed
+
+AUTH = {"Authorization": "Bearer insecure staff token for testing"}
+
+
+def test_staff_page_requires_token(client):
+    assert client.get("/staff").status_code == 401
+    assert client.get("/staff/stream").status_code == 401
+    assert client.get("/staff", headers=AUTH).status_code == 200
+
+
+def next_event(response):
+    chunk = next(response.response).decode()
+    assert chunk.startswith("event: occupancy\ndata: ")
+    return json.loads(chunk.split("data: ", 1)[1])
+
+
+@pytest.mark.usefixtures("_db")
+def test_stream_pushes_sign_ins():
+    # The app that is shared by all tests has counted other tests' sign-ins
+    client = create_app(TestConfig()).test_client()
+    response = client.get("/staff/stream", headers=AUTH)
+    assert response.mimetype == "text/event-stream"
+    assert next_event(response)["locations"][0]["present"] == 0
+
+    client.post("/", data=makeSignInData())
+
+    assert next_event(response)["locations"][0]["present"] == 1
+    response.close()
+
+
+@pytest.mark.usefixtures("_db")
+def test_streams_leave_threads_for_guests():
+    app = create_app(TestConfig())
+    client = app.test_client()
+    threads = app.config["THREADS"]
+    streams = [client.get("/staff/stream", headers=AUTH) for _ in range(threads // 2)]
+
+    # Further devices get the occupancy and poll
+    response = client.get("/staff/stream", headers=AUTH)
+    assert response.data.decode().startswith("retry: 5000\nevent: occupancy\n")
+
+    streams.pop().close()
+    response = client.get("/staff/stream", headers=AUTH)
+    assert next_event(response)["locations"][0]["present"] == 0
+    response.close()
+    for stream in streams:
+        stream.close()
+
+
+def test_feed_wakes_up_coroutines(app):
+    feed = Feed(app)
+    feed._version, feed._data = 1, "old"
+
+    async def wait():
+        waiting = asyncio.ensure_future(feed.wait_async(1, timeout=5))
+        await asyncio.sleep(0)
+        threading.Thread(target=publish).start()
+        return await waiting
+
+    def publish():
+        with feed._condition:
+            feed._publish("new")
+
+    assert asyncio.run(wait()) == (2, "new")
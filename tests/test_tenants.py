@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import sign_ins
+from app import create_app
+from config import TestConfig
+from factories import makeSignInData
+from locations import Locations
+
+TENANTS = {
+    "hof": {
+        "hosts": ["hof.example.org"],
+        "name": "Der Hof",
+        "locations": ["Tor", "Scheune"],
+        "capacity": 1,
+        "retention_days": 7,
+        "admin_token": "hof token",
+    },
+    "bar": {
+        "locations": ["Tresen"],
+        "admin_token": "bar token",
+        "staff_token": "bar staff token",
+    },
+}
+
+
+@pytest.fixture
+def tenant_app(tmp_path, _db):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps(TENANTS))
+    config = TestConfig()
+    config.TENANTS_FILE = str(path)
+    app = create_app(config)
+    with app.app_context():
+        yield app
+
+
+def sign_in(client, path, location, base_url="http://localhost", **data):
+    value = Locations([location]).value_for(location)
+    return client.post(
+        path, data=makeSignInData(location=value, **data), base_url=base_url
+    )
+
+
+def stored(db):
+    query = select([sign_ins.table]).order_by(sign_ins.table.c.signed_in_at)
+    return [(row.tenant, row.location) for row in db.session.execute(query)]
+
+
+def test_tenants_are_found_by_host_and_path(tenant_app, _db):
+    client = tenant_app.test_client()
+
+    by_host = sign_in(client, "/", "Tor", base_url="http://hof.example.org")
+    by_path = sign_in(client, "/bar/", "Tresen")
+
+    assert by_host.status_code == 302
+    assert by_host.location.startswith("http://hof.example.org/thank-you?checkout=")
+    assert by_path.status_code == 302
+    assert by_path.location.startswith("http://localhost/bar/thank-you?checkout=")
+    # Another tenant's location, and a full one
+    assert sign_in(client, "/bar/", "Tor").status_code == 200
+    assert sign_in(client, "/hof/", "Tor").status_code == 409
+    assert stored(_db) == [("hof", "Tor"), ("bar", "Tresen")]
+
+    page = client.get("/hof/thank-you").data.decode()
+    assert 'alt="Der Hof"' in page
+    assert 'action="/hof/checkout"' in page
+    assert client.get("/bar").status_code == 308
+    assert client.get("/unknown/").status_code == 404
+    assert client.get("/health").status_code == 200
+
+
+def test_pages_link_to_the_form_the_tenant_was_reached_by(tenant_app):
+    client = tenant_app.test_client()
+
+    by_path = client.get("/hof/thank-you").data.decode()
+    by_host = client.get("/thank-you", base_url="http://hof.example.org").data.decode()
+
+    assert 'action="/hof/checkout"' in by_path
+    assert 'action="/checkout"' in by_host
+    assert 'alt="Der Hof"' in by_host
+
+
+def test_duplicates_can_check_out_at_their_tenant(tenant_app, _db):
+    client = tenant_app.test_client()
+    data = makeSignInData()
+    sign_in(client, "/bar/", "Tresen", **data)
+    duplicate = sign_in(client, "/bar/", "Tresen", **data)
+
+    token = duplicate.location.split("checkout=")[1]
+    response = client.post("/bar/checkout", data={"token": token})
+    assert response.status_code == 200
+    assert stored(_db) == [("bar", "Tresen")]
+
+
+def test_tenants_have_their_own_rate_limits(tmp_path, _db):
+    path = tmp_path / "tenants.json"
+    bar = {"locations": ["Tresen"], "rate_limit_global": 1}
+    path.write_text(json.dumps({**TENANTS, "bar": bar}))
+    config = TestConfig()
+    config.TENANTS_FILE = str(path)
+    config.RATE_LIMIT_GLOBAL = 5
+    client = create_app(config).test_client()
+
+    assert sign_in(client, "/bar/", "Tresen").status_code == 302
+    assert sign_in(client, "/bar/", "Tresen").status_code == 429
+    # The rush at the bar doesn't limit the others
+    assert sign_in(client, "/hof/", "Tor").status_code == 302
+
+
+def test_tenants_only_see_their_own_sign_ins(tenant_app, _db):
+    client = tenant_app.test_client()
+    token = sign_in(client, "/hof/", "Tor").location.split("checkout=")[1]
+    sign_in(client, "/bar/", "Tresen", first_name="Bar guest")
+
+    # Another tenant's check-out token is invalid there
+    response = client.post("/bar/checkout", data={"token": token})
+    assert response.status_code == 400
+    response = client.get(
+        "/bar/occupancy", headers={"Authorization": "Bearer bar staff token"}
+    )
+    assert [row["location"] for row in response.json["locations"]] == ["Tresen"]
+    response = client.get("/bar/export", headers={"Authorization": "Bearer hof token"})
+    assert response.status_code == 401
+
+    response = client.get("/bar/export", headers={"Authorization": "Bearer bar token"})
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert [row["first_name"] for row in rows] == ["Bar guest"]
+    assert "tenant" not in rows[0]
+    result = tenant_app.test_cli_runner().invoke(
+        args=["export", "--tenant", "hof", "--format", "ndjson"]
+    )
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)["location"] for line in result.output.splitlines()] == [
+        "Tor"
+    ]
+
+
+def test_prune_keeps_every_tenants_sign_ins_for_its_retention(tenant_app, _db):
+    ten_days_ago = datetime.now() - timedelta(days=10)
+    _db.session.execute(
+        sign_ins.table.insert(),
+        [
+            makeSignInData(location=location, tenant=tenant, signed_in_at=ten_days_ago)
+            for tenant, location in (("hof", "Tor"), ("bar", "Tresen"), (None, "Alt"))
+        ],
+    )
+    _db.session.commit()
+
+    result = tenant_app.test_cli_runner().invoke(args=["prune"])
+
+    assert result.exit_code == 0, result.output
+    assert "Deleted 1 rows in total" in result.output
+    assert stored(_db) == [("bar", "Tresen"), (None, "Alt")]
+
+
+def test_backups_cover_sign_ins_without_a_tenant(tenant_app, _db, tmp_path):
+    tenant_app.config["ENCRYPTION_KEY_FILE"] = str(tmp_path / "keys")
+    runner = tenant_app.test_cli_runner()
+    assert runner.invoke(args=["encryption", "new-key"]).exit_code == 0
+    yesterday = datetime.now() - timedelta(days=1)
+    _db.session.execute(
+        sign_ins.table.insert(),
+        [
+            makeSignInData(signed_in_at=yesterday, tenant="hof"),
+            # e.g. from before TENANTS_FILE was set
+            makeSignInData(signed_in_at=yesterday, tenant=None),
+        ],
+    )
+    _db.session.commit()
+    directory = tmp_path / "backups"
+
+    result = runner.invoke(args=["backup", "run", "--directory", str(directory)])
+
+    assert result.exit_code == 0, result.output
+    assert "Backing up the sign-ins without a tenant" in result.output
+    archive = f"corona-sign-in-{yesterday.date().isoformat()}.1.backup"
+    assert sorted(os.listdir(directory)) == ["bar", archive, "hof", "manifest.json"]
+    assert sorted(os.listdir(directory / "hof")) == [archive, "manifest.json"]
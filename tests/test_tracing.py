@@ -0,0 +1,118 @@
+import csv
+import io
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import sign_ins
+from factories import makeSignInData
+from tracing import Presence, presences, trace_command
+
+AUTH = {"Authorization": "Bearer insecure admin token for testing"}
+
+
+def add_sign_ins(db, *rows):
+    db.session.execute(sign_ins.table.insert(), [makeSignInData(**r) for r in rows])
+    db.session.commit()
+
+
+def at(hour, minute=0):
+    return datetime(2020, 8, 1, hour, minute)
+
+
+def test_overlapping_stays_are_merged():
+    case = [
+        SimpleNamespace(location="Bar", signed_in_at=at(18), signed_out_at=at(19)),
+        SimpleNamespace(location="Bar", signed_in_at=at(19), signed_out_at=None),
+        SimpleNamespace(location="Bar", signed_in_at=at(23), signed_out_at=at(23, 30)),
+    ]
+    assert presences(case, timedelta(hours=2)) == [
+        Presence("Bar", at(18), at(21)),
+        Presence("Bar", at(23), at(23, 30)),
+    ]
+
+
+def test_trace_finds_guests_at_the_same_place_and_time(client, _db):
+    add_sign_ins(
+        _db,
+        dict(last_name="Case", phone_number="1", location="Bar", signed_in_at=at(20)),
+        dict(first_name="Before", location="Bar", signed_in_at=at(18, 30)),
+        dict(first_name="After", location="Bar", signed_in_at=at(21, 30)),
+        dict(first_name="Elsewhere", location="Garten", signed_in_at=at(20)),
+        dict(first_name="Earlier", location="Bar", signed_in_at=at(17, 30)),
+        dict(first_name="Later", location="Bar", signed_in_at=at(22, 30)),
+    )
+    add_sign_ins(
+        _db,
+        dict(
+            first_name="Left before",
+            location="Bar",
+            signed_in_at=at(19),
+            signed_out_at=at(19, 45),
+        ),
+    )
+
+    response = client.get("/trace?last_name=case&window=120", headers=AUTH)
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert [row["first_name"] for row in rows] == ["Before", "After"]
+
+
+def test_trace_command_with_time_span(app, _db):
+    add_sign_ins(
+        _db,
+        dict(first_name="Octave", location="Bar", signed_in_at=at(20)),
+        dict(first_name="Jules", location="Bar", signed_in_at=at(12)),
+    )
+
+    result = app.test_cli_runner().invoke(
+        trace_command,
+        [
+            "--location",
+            "Bar",
+            "--start",
+            "2020-08-01 19:00",
+            "--end",
+            "2020-08-01 21:00",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Octave" in result.output
+    assert "Jules" not in result.output
+
+
+def test_stays_are_found_from_the_longest_stay_before(app, _db):
+    add_sign_ins(
+        _db,
+        dict(
+            first_name="Long",
+            location="Bar",
+            signed_in_at=at(17, 30),
+            signed_out_at=at(19, 30),
+        ),
+        dict(first_name="Open", location="Bar", signed_in_at=at(8), signed_out_at=None),
+        dict(
+            first_name="Too early",
+            location="Bar",
+            signed_in_at=at(16, 30),
+            signed_out_at=at(18, 30),
+        ),
+    )
+
+    result = app.test_cli_runner().invoke(
+        trace_command,
+        [
+            "--location",
+            "Bar",
+            "--start",
+            "2020-08-01 19:00",
+            "--end",
+            "2020-08-01 21:00",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Long" in result.output
+    assert "Open" not in result.output
+    assert "Too early" not in result.output